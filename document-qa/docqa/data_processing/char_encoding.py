@@ -0,0 +1,89 @@
+from typing import List, Dict, Tuple, Iterable
+
+import numpy as np
+
+"""
+Vectorized conversion of tokens to padded character id arrays, shared by our
+`CharEmbedder`s and the ELMo batcher so neither has to loop over individual characters
+"""
+
+
+def pad_ragged(flat: np.ndarray, lens: np.ndarray, max_len: int,
+               pad: int=0, dtype=np.int32) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert `flat`, the concatenation of sequences with lengths `lens`, into a
+    (len(lens), max_len) array where each sequence is truncated to `max_len` and
+    padded with `pad`. Returns the array and the truncated lengths
+    """
+    lens = np.asarray(lens, dtype=np.int64)
+    starts = np.zeros(len(lens), dtype=np.int64)
+    if len(lens) > 1:
+        np.cumsum(lens[:-1], out=starts[1:])
+    clipped = np.minimum(lens, max_len)
+    arange = np.arange(max_len)
+    mask = arange[None, :] < clipped[:, None]
+    out = np.full((len(lens), max_len), pad, dtype=dtype)
+    out[mask] = flat[(starts[:, None] + arange[None, :])[mask]]
+    return out, clipped
+
+
+def word_codepoints(words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """ Unicode code points of all `words` concatenated, and the number of code points in each word """
+    lens = np.fromiter((len(w) for w in words), dtype=np.int64, count=len(words))
+    # `surrogatepass` so we line up with iterating over the str even if it contains lone surrogates
+    flat = np.frombuffer("".join(words).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    return flat, lens
+
+
+def word_utf8_bytes(words: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """ UTF-8 bytes of all `words` concatenated, and the number of bytes in each word """
+    encoded = [w.encode("utf-8", "ignore") for w in words]
+    lens = np.fromiter((len(w) for w in encoded), dtype=np.int64, count=len(encoded))
+    flat = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return flat, lens
+
+
+class CharIdTable(object):
+    """
+    Dense code point -> id table built from a char -> id dictionary, any
+    code point not in the dictionary maps to `unk_id`
+    """
+
+    def __init__(self, char_to_ix: Dict[str, int], unk_id: int):
+        self.unk_id = unk_id
+        size = max(ord(c) for c in char_to_ix) + 1 if len(char_to_ix) > 0 else 0
+        self.table = np.full(size, unk_id, dtype=np.int32)
+        for c, ix in char_to_ix.items():
+            self.table[ord(c)] = ix
+
+    def lookup(self, codepoints: np.ndarray) -> np.ndarray:
+        out = np.full(len(codepoints), self.unk_id, dtype=np.int32)
+        in_table = codepoints < len(self.table)
+        out[in_table] = self.table[codepoints[in_table]]
+        return out
+
+    def encode(self, words: List[str], max_chars: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ (len(words), max_chars) array of zero-padded char ids, and the (truncated) length of each word """
+        flat, lens = word_codepoints(words)
+        return pad_ragged(self.lookup(flat), lens, max_chars)
+
+    def fill(self, sequences: Iterable[List[str]], chars: np.ndarray, word_lens: np.ndarray):
+        """
+        Write the char ids of each sequence into the zero-initialized (batch, word_dim, char_dim)
+        `chars` array and the word lengths into the (batch, word_dim) `word_lens` array.
+        Sequences are truncated to `word_dim` words and words to `char_dim` characters.
+        """
+        word_dim, char_dim = chars.shape[1:]
+        seq_lens = []
+        words = []
+        for seq in sequences:
+            seq = seq[:word_dim]
+            seq_lens.append(len(seq))
+            words += seq
+        if len(words) == 0:
+            return
+        ids, lens = self.encode(words, char_dim)
+        mask = np.arange(word_dim)[None, :] < np.array(seq_lens)[:, None]
+        n = len(seq_lens)
+        chars[:n][mask] = ids
+        word_lens[:n][mask] = lens
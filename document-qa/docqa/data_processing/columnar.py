@@ -0,0 +1,180 @@
+import json
+from os import makedirs, stat
+from os.path import join, exists
+from typing import List, Iterable, Dict, Optional
+
+import numpy as np
+
+"""
+Minimal columnar storage, a directory of .npy arrays that are memory mapped when read, used to store
+our pre-processed datasets so they can be loaded lazily instead of unpickling a full object graph
+"""
+
+
+def source_stamp(filename: str) -> Dict:
+    """ Size and modification time of `filename`, used to tell if a columnar copy of it is out of date """
+    st = stat(filename)
+    return dict(size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+
+def use_columnar(directory: str, source: str) -> bool:
+    """
+    Whether to read the columnar copy in `directory` instead of the pickle `source` it was converted from.
+    Copies that were built from a different version of `source` are ignored, if `source` does not exist
+    the copy is all we have so we use it.
+    """
+    if not ColumnarReader.exists(directory):
+        return False
+    if not exists(source):
+        return True
+    with open(join(directory, "index.json"), "r") as f:
+        stamp = json.load(f).get("source")
+    if stamp != source_stamp(source):
+        print("WARNING: %s is out of date with %s, loading the pickle instead "
+              "(re-run the columnar conversion to fix)" % (directory, source))
+        return False
+    return True
+
+
+class StringColumn(object):
+    """ Sequence of strings stored as one UTF-8 byte array and the byte offset of each string """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ColumnarReader(object):
+    """ Reads a directory built by `ColumnarWriter`, arrays are memory mapped the first time they are used """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._arrays = {}
+        self._strings = {}
+        self._vocab = None
+        with open(join(directory, "index.json"), "r") as f:
+            self.index = json.load(f)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return exists(join(directory, "index.json"))
+
+    def array(self, name: str) -> np.ndarray:
+        arr = self._arrays.get(name)
+        if arr is None:
+            arr = np.load(join(self.directory, name + ".npy"), mmap_mode="r")
+            self._arrays[name] = arr
+        return arr
+
+    def strings(self, name: str) -> StringColumn:
+        col = self._strings.get(name)
+        if col is None:
+            col = StringColumn(self.array(name + "_bytes"), self.array(name + "_offsets"))
+            self._strings[name] = col
+        return col
+
+    def ragged(self, name: str, i: int) -> np.ndarray:
+        """ Row `i` of a column written with `ColumnarWriter.add_ragged` """
+        offsets = self.array(name + "_offsets")
+        return self.array(name)[offsets[i]:offsets[i + 1]]
+
+    def json(self, name: str, i: int):
+        return json.loads(self.strings(name)[i])
+
+    @property
+    def vocab(self) -> List[str]:
+        """ Shared vocabulary for columns written with `ColumnarWriter.add_tokens` """
+        if self._vocab is None:
+            self._vocab = list(self.strings("vocab"))
+        return self._vocab
+
+    def tokens(self, name: str, i: int) -> List[str]:
+        vocab = self.vocab
+        return [vocab[x] for x in self.ragged(name, i).tolist()]
+
+    def __getstate__(self):
+        # Memory maps are re-opened after unpickling
+        state = dict(self.__dict__)
+        state["_arrays"] = {}
+        state["_strings"] = {}
+        state["_vocab"] = None
+        return state
+
+
+class ColumnarWriter(object):
+    """ Builds a directory that can be read by `ColumnarReader` """
+
+    def __init__(self, directory: str):
+        if not exists(directory):
+            makedirs(directory)
+        self.directory = directory
+        self._word_ix = {}
+
+    def add_array(self, name: str, arr: np.ndarray):
+        np.save(join(self.directory, name + ".npy"), arr)
+
+    def add_strings(self, name: str, strings: Iterable[str]):
+        encoded = [x.encode("utf-8") for x in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(x) for x in encoded], out=offsets[1:])
+        self.add_array(name + "_bytes", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        self.add_array(name + "_offsets", offsets)
+
+    def add_json(self, name: str, objects: Iterable):
+        self.add_strings(name, (json.dumps(x) for x in objects))
+
+    def add_offsets(self, name: str, lengths: List[int]):
+        """ Offsets for consecutive groups of the given lengths, so group `i` is `offsets[i]:offsets[i+1]` """
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        self.add_array(name, offsets)
+        return offsets
+
+    def add_ragged(self, name: str, rows: List[np.ndarray], dtype, shape=()):
+        """ Concatenate `rows`, arrays of shape (n_i,) + `shape`, into one column """
+        offsets = self.add_offsets(name + "_offsets", [len(x) for x in rows])
+        if offsets[-1] == 0:
+            values = np.zeros((0,) + shape, dtype=dtype)
+        else:
+            values = np.concatenate([np.asarray(x, dtype=dtype).reshape((-1,) + shape) for x in rows])
+        self.add_array(name, values)
+
+    def add_tokens(self, name: str, rows: List[List[str]]):
+        """ Store lists of words as int32 ids into the shared vocabulary """
+        word_ix = self._word_ix
+        self.add_ragged(name, [[word_ix.setdefault(w, len(word_ix)) for w in row] for row in rows], np.int32)
+
+    def finish(self, index: Dict, source: Optional[str]=None):
+        """ Write the index, `source` is the file the data was converted from, if any """
+        self.add_strings("vocab", self._word_ix)
+        if source is not None:
+            index = dict(index, source=source_stamp(source))
+        with open(join(self.directory, "index.json"), "w") as f:
+            json.dump(index, f)
+
+
+def lazy_field(name: str, load):
+    """
+    Property that computes its value with `load(self)` the first time it is read and stores it in the
+    instance's `_loaded` dictionary, assignments are stored there as well
+    """
+    def get(self):
+        loaded = self._loaded
+        if name not in loaded:
+            loaded[name] = load(self)
+        return loaded[name]
+
+    def set(self, value):
+        self._loaded[name] = value
+
+    return property(get, set)
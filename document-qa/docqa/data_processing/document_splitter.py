@@ -1,3 +1,7 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
 from typing import List, Optional
 
 import numpy as np
@@ -52,15 +56,25 @@ class DocParagraphWithAnswers(ExtractedParagraphWithAnswers):
 class ParagraphFilter(Configurable):
     """ Selects and ranks paragraphs """
 
-    def prune(self, question, paragraphs: List[ExtractedParagraph]) -> List[ExtractedParagraph]:
+    def prune(self, question, paragraphs: List[ExtractedParagraph],
+              doc_id: Optional[str]=None) -> List[ExtractedParagraph]:
+        """
+        :param doc_id: If the paragraphs all come from one document, the id of that document, filters
+                       can use it to cache work that does not depend on the question
+        """
         raise NotImplementedError()
 
+    def prune_batch(self, questions: List[List[str]], paragraphs: List[ExtractedParagraph],
+                    doc_id: Optional[str]=None) -> List[List[ExtractedParagraph]]:
+        """ `prune` for each of `questions`, subclasses can override this to share work between the questions """
+        return [self.prune(q, paragraphs, doc_id) for q in questions]
+
 
 class FirstN(ParagraphFilter):
     def __init__(self, n):
         self.n = n
 
-    def prune(self, question, paragraphs: List[ExtractedParagraphWithAnswers]):
+    def prune(self, question, paragraphs: List[ExtractedParagraphWithAnswers], doc_id=None):
         return sorted(paragraphs, key=lambda x: x.start)[:self.n]
 
 
@@ -70,7 +84,7 @@ class ContainsQuestionWord(ParagraphFilter):
         self.allow_first = allow_first
         self.n_paragraphs = n_paragraphs
 
-    def prune(self, question, paragraphs: List[ExtractedParagraphWithAnswers]):
+    def prune(self, question, paragraphs: List[ExtractedParagraphWithAnswers], doc_id=None):
         q_words = {x.lower() for x in question}
         q_words -= self.stop.words
         output = []
@@ -91,54 +105,150 @@ class ContainsQuestionWord(ParagraphFilter):
         return output
 
 
+class TfIdfIndexCache(object):
+    """
+    LRU cache of tf-idf vectorizers fitted to a document's paragraphs along with the paragraphs'
+    tf-idf matrix, optionally persisted to `cache_dir` so they can be re-used in later runs.
+    Only the settings are pickled, so each process builds its own cache.
+    """
+
+    def __init__(self, max_docs: int=100, cache_dir: Optional[str]=None):
+        self.max_docs = max_docs
+        self.cache_dir = cache_dir
+        self._cache = OrderedDict()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.md5(repr(key).encode("utf-8")).hexdigest() + ".pkl")
+
+    def get_or_build(self, key, build_fn):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        value = None
+        found = False
+        if self.cache_dir is not None:
+            path = self._path(key)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    stored_key, value = pickle.load(f)
+                found = stored_key == key  # Guard against hash collisions
+        if not found:
+            value = build_fn()
+            if self.cache_dir is not None:
+                # Write to a temporary file first so readers never see a partial file
+                tmp = "%s.%d.tmp" % (path, os.getpid())
+                with open(tmp, "wb") as f:
+                    pickle.dump((key, value), f)
+                os.replace(tmp, path)
+
+        self._cache[key] = value
+        if len(self._cache) > self.max_docs:
+            self._cache.popitem(last=False)
+        return value
+
+    def __getstate__(self):
+        return dict(max_docs=self.max_docs, cache_dir=self.cache_dir)
+
+    def __setstate__(self, state):
+        self.__init__(state["max_docs"], state["cache_dir"])
+
+
 class TopTfIdf(ParagraphFilter):
     def __init__(self, stop, n_to_select: int, filter_dist_one: bool=False, rank=True):
         self.stop = stop
         self.rank = rank
         self.n_to_select = n_to_select
         self.filter_dist_one = filter_dist_one
+        self._cache = None
+        self._cache_key = None
 
-    def prune(self, question, paragraphs: List[ExtractedParagraph]):
-        if not self.filter_dist_one and len(paragraphs) == 1:
-            return paragraphs
+    def enable_cache(self, max_docs: int=100, cache_dir: Optional[str]=None, key: Optional[str]=None):
+        """
+        Cache the tf-idf index built for each document so it only has to be fit once
+        for all the questions about that document, requires callers to pass `doc_id`.
+        `key` should identify how the paragraphs were built (e.g., the splitter's config), indices are
+        also keyed by a hash of the paragraphs' text so re-tokenized documents are not matched
+        """
+        self._cache = TfIdfIndexCache(max_docs, cache_dir)
+        self._cache_key = key
 
+    def _fit(self, text: List[str]):
         tfidf = TfidfVectorizer(strip_accents="unicode", stop_words=self.stop.words)
-        text = []
-        for para in paragraphs:
-            text.append(" ".join(" ".join(s) for s in para.text))
         try:
             para_features = tfidf.fit_transform(text)
-            q_features = tfidf.transform([" ".join(question)])
         except ValueError:
-            return []
+            return None
+        tfidf.stop_words_ = None  # Only needed for introspection, but can be large
+        return tfidf, para_features
+
+    def _rank(self, questions: List[List[str]], paragraphs: List[ExtractedParagraph], doc_id: Optional[str]):
+        """ (dists, sorted_ix) for each question, or None if the text had no usable words """
+        text = [" ".join(" ".join(s) for s in para.text) for para in paragraphs]
+        if self._cache is not None and doc_id is not None:
+            text_hash = hashlib.sha1("\n".join(text).encode("utf-8")).hexdigest()
+            key = (doc_id, tuple((x.start, x.end) for x in paragraphs), text_hash,
+                   str(self.stop.get_config()), self._cache_key)
+            index = self._cache.get_or_build(key, lambda: self._fit(text))
+        else:
+            index = self._fit(text)
+        if index is None:
+            return None
+        tfidf, para_features = index
+        try:
+            q_features = tfidf.transform([" ".join(q) for q in questions])
+        except ValueError:
+            return None
 
-        dists = pairwise_distances(q_features, para_features, "cosine").ravel()
-        sorted_ix = np.lexsort(([x.start for x in paragraphs], dists))  # in case of ties, use the earlier paragraph
+        # Rows are computed independently, so this matches scoring the questions one at a time
+        all_dists = pairwise_distances(q_features, para_features, "cosine")
+        starts = [x.start for x in paragraphs]
+        out = []
+        for dists in all_dists:
+            sorted_ix = np.lexsort((starts, dists))  # in case of ties, use the earlier paragraph
+            out.append((dists, sorted_ix))
+        return out
 
+    def _select(self, paragraphs: List[ExtractedParagraph], dists, sorted_ix):
         if self.filter_dist_one:
             return [paragraphs[i] for i in sorted_ix[:self.n_to_select] if dists[i] < 1.0]
         else:
             return [paragraphs[i] for i in sorted_ix[:self.n_to_select]]
 
-    def dists(self, question, paragraphs: List[ExtractedParagraph]):
-        tfidf = TfidfVectorizer(strip_accents="unicode", stop_words=self.stop.words)
-        text = []
-        for para in paragraphs:
-            text.append(" ".join(" ".join(s) for s in para.text))
-        try:
-            para_features = tfidf.fit_transform(text)
-            q_features = tfidf.transform([" ".join(question)])
-        except ValueError:
-            return []
+    def prune(self, question, paragraphs: List[ExtractedParagraph], doc_id: Optional[str]=None):
+        return self.prune_batch([question], paragraphs, doc_id)[0]
+
+    def prune_batch(self, questions: List[List[str]], paragraphs: List[ExtractedParagraph],
+                    doc_id: Optional[str]=None):
+        if not self.filter_dist_one and len(paragraphs) == 1:
+            return [paragraphs for _ in questions]
 
-        dists = pairwise_distances(q_features, para_features, "cosine").ravel()
-        sorted_ix = np.lexsort(([x.start for x in paragraphs], dists))  # in case of ties, use the earlier paragraph
+        ranked = self._rank(questions, paragraphs, doc_id)
+        if ranked is None:
+            return [[] for _ in questions]
+        return [self._select(paragraphs, dists, sorted_ix) for dists, sorted_ix in ranked]
+
+    def dists(self, question, paragraphs: List[ExtractedParagraph], doc_id: Optional[str]=None):
+        ranked = self._rank([question], paragraphs, doc_id)
+        if ranked is None:
+            return []
+        dists, sorted_ix = ranked[0]
 
         if self.filter_dist_one:
             return [(paragraphs[i], dists[i]) for i in sorted_ix[:self.n_to_select] if dists[i] < 1.0]
         else:
             return [(paragraphs[i], dists[i]) for i in sorted_ix[:self.n_to_select]]
 
+    def __setstate__(self, state):
+        fields = state["state"] if "state" in state else state
+        if "_cache" not in fields:
+            fields["_cache"] = None
+        if "_cache_key" not in fields:
+            fields["_cache_key"] = None
+        super().__setstate__(state)
+
 
 class ShallowOpenWebRanker(ParagraphFilter):
     # Hard coded weight learned from a logistic regression classifier
@@ -161,46 +271,86 @@ class ShallowOpenWebRanker(ParagraphFilter):
     def get_feature_names(self):
         return ["Score"]
 
+    @staticmethod
+    def _encode_tokens(paragraphs: List[ExtractedParagraph]):
+        """
+        Map the tokens of `paragraphs` to integer ids, returns the token -> id map, the lowercased
+        token -> id map, the lowercased id of each token id, and the paragraph index and token id of
+        each unique (paragraph, token) pair
+        """
+        voc = {}
+        para_ix = []
+        token_ids = []
+        for i, para in enumerate(paragraphs):
+            para_ids = {voc.setdefault(w, len(voc)) for sent in para.text for w in sent}
+            token_ids += para_ids
+            para_ix += [i] * len(para_ids)
+        lower_voc = {}
+        lower_ids = np.array([lower_voc.setdefault(w.lower(), len(lower_voc)) for w in voc], dtype=np.int64)
+        return voc, lower_voc, lower_ids, np.array(para_ix, dtype=np.int64), np.array(token_ids, dtype=np.int64)
+
+    def _word_match_features(self, question, n_paragraphs: int, encoded):
+        """ (n_paragraphs, 2) array of the number of exact and lowercase-only matches to words in `question` """
+        voc, lower_voc, lower_ids, para_ix, token_ids = encoded
+        q_words = {x for x in question if x.lower() not in self._stop}
+        q_words_lower = {x.lower() for x in q_words}
+        q_ids = np.array([voc[x] for x in q_words if x in voc], dtype=np.int64)
+        q_lower_ids = np.array([lower_voc[x] for x in q_words_lower if x in lower_voc], dtype=np.int64)
+
+        word_matches_features = np.zeros((n_paragraphs, 2))
+        exact = np.isin(token_ids, q_ids)
+        word_matches_features[:, 0] = np.bincount(para_ix[exact], minlength=n_paragraphs)
+
+        # Tokens that did not match exactly, but whose lowercased form matches, counted once per lowercased form
+        other_para_ix = para_ix[np.logical_not(exact)]
+        other_lower = lower_ids[token_ids[np.logical_not(exact)]]
+        match = np.isin(other_lower, q_lower_ids)
+        pairs = np.unique(other_para_ix[match] * max(len(lower_voc), 1) + other_lower[match])
+        word_matches_features[:, 1] = np.bincount(pairs // max(len(lower_voc), 1), minlength=n_paragraphs)
+        return word_matches_features
+
     def score_paragraphs(self, question, paragraphs: List[ExtractedParagraphWithAnswers]):
+        return self.score_paragraphs_batch([question], paragraphs)[0]
+
+    def score_paragraphs_batch(self, questions: List[List[str]], paragraphs: List[ExtractedParagraphWithAnswers]):
+        """ `score_paragraphs` for each question, the tf-idf model and token ids are only built once """
         tfidf = self._tfidf
         text = []
         for para in paragraphs:
             text.append(" ".join(" ".join(s) for s in para.text))
         try:
             para_features = tfidf.fit_transform(text)
-            q_features = tfidf.transform([" ".join(question)])
+            q_features = tfidf.transform([" ".join(q) for q in questions])
         except ValueError:
-            return []
+            return [[] for _ in questions]
 
-        q_words = {x for x in question if x.lower() not in self._stop}
-        q_words_lower = {x.lower() for x in q_words}
-        word_matches_features = np.zeros((len(paragraphs), 2))
-        for para_ix, para in enumerate(paragraphs):
-            found = set()
-            found_lower = set()
-            for sent in para.text:
-                for word in sent:
-                    if word in q_words:
-                        found.add(word)
-                    elif word.lower() in q_words_lower:
-                        found_lower.add(word.lower())
-            word_matches_features[para_ix, 0] = len(found)
-            word_matches_features[para_ix, 1] = len(found_lower)
-
-        tfidf = pairwise_distances(q_features, para_features, "cosine").ravel()
+        encoded = self._encode_tokens(paragraphs)
+        all_tfidf = pairwise_distances(q_features, para_features, "cosine")
         starts = np.array([p.start for p in paragraphs])
         log_word_start = np.log(starts/400.0 + 1)
         first = starts == 0
-        scores = tfidf * self.TFIDF_W + self.LOG_WORD_START_W * log_word_start + self.FIRST_W * first +\
-                 self.LOWER_WORD_W * word_matches_features[:, 1] + self.WORD_W * word_matches_features[:, 0]
-        return scores
+        out = []
+        for question, tfidf in zip(questions, all_tfidf):
+            word_matches_features = self._word_match_features(question, len(paragraphs), encoded)
+            scores = tfidf * self.TFIDF_W + self.LOG_WORD_START_W * log_word_start + self.FIRST_W * first +\
+                     self.LOWER_WORD_W * word_matches_features[:, 1] + self.WORD_W * word_matches_features[:, 0]
+            out.append(scores)
+        return out
 
-    def prune(self, question, paragraphs: List[ExtractedParagraphWithAnswers]):
+    def prune(self, question, paragraphs: List[ExtractedParagraphWithAnswers], doc_id=None):
         scores = self.score_paragraphs(question, paragraphs)
         sorted_ix = np.argsort(scores)
 
         return [paragraphs[i] for i in sorted_ix[:self.n_to_select]]
 
+    def prune_batch(self, questions: List[List[str]], paragraphs: List[ExtractedParagraphWithAnswers],
+                    doc_id: Optional[str]=None):
+        out = []
+        for scores in self.score_paragraphs_batch(questions, paragraphs):
+            sorted_ix = np.argsort(scores)
+            out.append([paragraphs[i] for i in sorted_ix[:self.n_to_select]])
+        return out
+
     def __getstate__(self):
         return dict(n_to_select=self.n_to_select)
 
@@ -231,8 +381,16 @@ class DocumentSplitter(Configurable):
         """
         Split a document and additionally splits answer_span of each paragraph
         """
+        return self.annotate(self.split(doc), spans)
+
+    @staticmethod
+    def annotate(paragraphs: List[ExtractedParagraph], spans: np.ndarray) -> List[ExtractedParagraphWithAnswers]:
+        """
+        Attach the answer spans in `spans` that fall inside each paragraph, so a document
+        can be split once and then annotated for each question that uses it
+        """
         out = []
-        for para in self.split(doc):
+        for para in paragraphs:
             para_spans = spans[np.logical_and(spans[:, 0] >= para.start, spans[:, 1] < para.end)] - para.start
             out.append(ExtractedParagraphWithAnswers(para.text, para.start, para.end, para_spans))
         return out
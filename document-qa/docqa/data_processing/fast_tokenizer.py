@@ -0,0 +1,241 @@
+import re
+from typing import List, Tuple
+
+import nltk
+import numpy as np
+
+from docqa.configurable import Configurable
+from docqa.data_processing.text_utils import ParagraphWithInverse, NltkAndPunctTokenizer, extra_split_chars
+
+"""
+A regex based re-implementation of `NltkAndPunctTokenizer`. `NltkAndPunctTokenizer` runs NLTK's Treebank
+tokenizer (about twenty regex substitutions per sentence), splits each token again with `post_split_tokens`
+and then searches the text for every token to recover its span. Here all of that is replaced by one
+compiled regex that scans the raw text and yields the final tokens with their spans directly.
+"""
+
+# Characters TreebankWordTokenizer always surrounds with spaces
+_PAD = ";@#$%&?!\\[\\](){}<>\""
+
+# Characters that always become tokens of their own, either through TreebankWordTokenizer or `post_split_tokens`
+_SPLIT = _PAD + "".join(re.escape(x) for x in extra_split_chars)
+
+# Text before which TreebankWordTokenizer inserts a space, not counting whitespace
+_PADDED = (
+    "[" + _PAD + "]"
+    "|(?<![:,])[:,](?!\\d)"  # commas and colons, unless followed by a digit
+    "|\\.\\.\\.|``|''|--"
+    "|\\.[\\])}>\"']*\\s*\\Z"  # the final period of a sentence
+)
+
+# Quote rules that TreebankWordTokenizer only applies when followed by a literal space
+_SPACE = "(?: |\\Z|" + _PADDED + ")"
+_QUOTE = "'[sSmMdD]?(?=" + _SPACE + ")"
+_NT = "(?=" + _SPACE + "|" + _QUOTE + ")"
+
+# End of a token in the Treebank output, which is what `post_split_tokens` sees
+_CHUNK_END = "\\s|\\Z|" + _PADDED + "|" + _QUOTE + "|(?:'(?:ll|LL|re|RE|ve|VE)|n't|N'T)(?=" + _SPACE + ")"
+
+def _after_chunk_start(suffix: str) -> str:
+    """ Lookbehind for `suffix` at the start of a token in the Treebank output """
+    return ("(?:(?<=(?<![^\\s" + _PAD + "])" + suffix + ")|(?<=(?<![:,])[:,]" + suffix + ")"
+            "|(?<=\\.\\.\\." + suffix + ")|(?<=(?:``|''|--)" + suffix + "))")
+
+
+# The contractions TreebankWordTokenizer splits (from Robert MacIntyre's tokenizer), "'tis" and "'twas" are
+# only split if they start a token
+_CONTRACTION_END = "(?=\\s|\\Z|" + _PADDED + "|" + _QUOTE + "|(?:n't|N'T)" + _NT + ")"
+_CONTRACTION = (
+    "\\b(?i:can(?=not\\b)|gim(?=me\\b)|gon(?=na\\b)|got(?=ta\\b)|lem(?=me\\b)|wan(?=na" + _CONTRACTION_END + "))"
+)
+_CONTRACTION_PARTS = (
+    _CONTRACTION +
+    "|(?i:not(?<=\\bcannot)|me(?<=\\bgimme)|na(?<=\\bgonna)|ta(?<=\\bgotta)|me(?<=\\blemme))\\b"
+    "|(?i:na(?<=\\bwanna))" + _CONTRACTION_END +
+    "|[tT](?=(?i:is|was)\\b)" + _after_chunk_start("'[tT]") +
+    "|(?i:is)\\b" + _after_chunk_start("'[tT](?i:is)") +
+    "|(?i:was)\\b" + _after_chunk_start("'[tT](?i:was)")
+)
+
+# Non-word characters a word can contain
+_WORD_PUNCT = (
+    "(?:[^\\w\\s" + _SPLIT + "`.,:]"
+    "|\\.(?!\\.\\.)(?:(?<=\\.\\.)|(?![\\])}>\"']*\\s*\\Z))"  # periods, except "..." or the final period
+    "|[:,](?=\\d)"
+    "|[:,](?<=[:,][:,])(?<![:,][:,][:,])"  # Treebank does not split the second of two commas or colons
+    "|`(?!`)"
+    ")"
+)
+
+_WORD_PIECE = (
+    "(?:[^\\W_nN]+|n(?!'t" + _NT + ")|N(?!'T" + _NT + ")"
+    "|" + _WORD_PUNCT +
+    # `post_split_tokens` splits single underscores unless they start or end a token
+    "|(?=_)(?:__+|" + _after_chunk_start("") + "_|_(?=" + _CHUNK_END + "))"
+    ")"
+)
+
+# Treebank splits words at contractions that follow a non-word character
+_WORD = _WORD_PIECE + "(?:(?:(?<=\\w)|(?!" + _CONTRACTION + "))" + _WORD_PIECE + ")*"
+
+_TOKEN_RE = re.compile(
+    "\\.\\.\\.|``|''"
+    "|\\.(?<!\\.\\.)(?=[\\])}>\"']*\\s*\\Z)"  # the final period
+    "|[:,](?!\\d)(?:(?<![:,][:,])|(?<=[:,][:,][:,]))"
+    "|[" + _SPLIT + "]"
+    "|(?=_)(?:(?<=[^\\s_" + _PAD + ",:])|(?<=(?<![:,])[:,][:,]))(?<!\\.\\.\\.)(?<!``|''|--)_(?=[^_\\s])"
+    "(?!" + _CHUNK_END + ")"
+    "|(?=[cgltwnmiCGLTWNMI])(?:" + _CONTRACTION_PARTS + ")"
+    "|[^\\W_]+(?=\\s|\\Z)"  # fast path for the common case, letters and digits followed by a space
+    "|" + _WORD +
+    "|\\S"
+)
+
+_CLEAN = {"``": "\"", "''": "\"", "−": "-", "—": "–"}
+
+
+def scan_tokens(text: str, start: int=0, end: int=None) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """
+    Tokens and char spans `NltkAndPunctTokenizer` would produce for the sentence `text[start:end]`,
+    spans are relative to `text`
+    """
+    if end is None:
+        end = len(text)
+    matches = list(_TOKEN_RE.finditer(text, start, end))
+    tokens = [m.group() for m in matches]
+    return [_CLEAN.get(t, t) for t in tokens], [m.span() for m in matches]
+
+
+# Abbreviations a period does not end a sentence after, based on the most common ones in
+# Punkt's English model
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "st", "jr", "sr", "rev", "gen", "gov", "sen", "rep", "lt", "col",
+    "capt", "sgt", "maj", "cmdr", "adm", "hon", "pres", "messrs", "mme", "mlle",
+    "inc", "co", "corp", "ltd", "bros", "dept", "univ", "assn", "est",
+    "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+    "mon", "tue", "tues", "wed", "thu", "thur", "thurs", "fri", "sat", "sun",
+    "u.s", "u.k", "u.n", "u.s.a", "e.g", "i.e", "a.m", "p.m", "d.c", "n.y", "l.a", "b.c", "a.d",
+    "etc", "vs", "al", "cf", "ca", "approx", "no", "nos", "vol", "vols", "pp", "fig", "figs", "ed", "eds",
+    "ft", "mt", "ave", "blvd", "rd", "hwy", "ariz", "calif", "colo", "conn", "fla", "ga", "ill", "ind",
+    "kan", "ky", "la", "mass", "md", "mich", "minn", "miss", "mo", "mont", "neb", "nev", "okla", "ore",
+    "pa", "penn", "tenn", "tex", "va", "vt", "wash", "wis", "wyo",
+}
+
+# Capitalized words that start a sentence after an abbreviation or initial
+SENTENCE_STARTERS = {
+    "the", "a", "an", "in", "it", "he", "she", "they", "we", "i", "this", "that", "these", "there",
+    "his", "her", "their", "but", "and", "however", "after", "on", "at", "as", "for", "when", "while",
+    "if", "although", "since", "during", "many", "some", "its", "one", "both", "other", "most",
+}
+
+_SENT_END_RE = re.compile("(?<!\\S)(\\S*?)([.?!])[\"')\\]}’”]*(?=\\s+(\\S+))")
+_OPEN_PUNCT = "\"'([{`‘“"
+_NUMBER_RE = re.compile("^[\\d.,\\-/:]+$")
+
+
+class RegexSentenceSplitter(object):
+    """
+    Rule based approximation of the Punkt sentence tokenizer: a period, question mark or exclamation
+    mark followed by whitespace ends a sentence, unless it ends a known abbreviation, an initial or a number
+    and the next word does not look like it starts a new sentence
+    """
+
+    @staticmethod
+    def _is_break(word: str, end_char: str, next_word: str) -> bool:
+        if end_char != ".":
+            return True
+        next_char = next_word.lstrip(_OPEN_PUNCT)[:1]
+        if word.endswith("."):
+            # Ellipsis
+            return next_char.isupper()
+        word = word.lstrip(_OPEN_PUNCT).lower()
+        if word in ABBREVIATIONS or word.rsplit("-", 1)[-1] in ABBREVIATIONS or \
+                (len(word) == 1 and word.isalpha()):
+            return next_char.isupper() and next_word.lstrip(_OPEN_PUNCT).lower() in SENTENCE_STARTERS
+        if _NUMBER_RE.match(word):
+            return not next_char.islower()
+        return True
+
+    def span_tokenize(self, text: str) -> List[Tuple[int, int]]:
+        spans = []
+        start = len(text) - len(text.lstrip())
+        for m in _SENT_END_RE.finditer(text):
+            if m.start() < start:
+                continue
+            if self._is_break(m.group(1), m.group(2), m.group(3)):
+                spans.append((start, m.end()))
+                start = m.start(3)
+        end = len(text.rstrip())
+        if start < end:
+            spans.append((start, end))
+        return spans
+
+
+class FastNltkAndPunctTokenizer(Configurable):
+    """
+    Faster drop-in replacement for `NltkAndPunctTokenizer`. Sentences are tokenized with one regex
+    scan (see `scan_tokens`) that reproduces the Treebank tokenizer and `post_split_tokens`, and
+    gives the token spans directly. If `sentence_splitter` is "punkt" we use the same Punkt model to split
+    sentences, so the output should match `NltkAndPunctTokenizer`, if it is "regex" we use `RegexSentenceSplitter`,
+    which is much faster but can split sentences differently.
+    """
+
+    def __init__(self, sentence_splitter: str="regex"):
+        if sentence_splitter not in ["regex", "punkt"]:
+            raise ValueError(sentence_splitter)
+        self.sentence_splitter = sentence_splitter
+        if sentence_splitter == "punkt":
+            self._sent_tokenizer = nltk.load('tokenizers/punkt/english.pickle')
+        else:
+            self._sent_tokenizer = RegexSentenceSplitter()
+
+    def clean_text(self, word):
+        return NltkAndPunctTokenizer.clean_text(self, word)
+
+    def tokenize_sentence(self, sent) -> List[str]:
+        return scan_tokens(sent)[0]
+
+    def tokenize_paragraph(self, paragraph: str) -> List[List[str]]:
+        return [scan_tokens(paragraph, s, e)[0] for s, e in self._sent_tokenizer.span_tokenize(paragraph)]
+
+    def tokenize_paragraph_flat(self, paragraph: str) -> List[str]:
+        return [w for s, e in self._sent_tokenizer.span_tokenize(paragraph) for w in scan_tokens(paragraph, s, e)[0]]
+
+    def tokenize_with_inverse(self, paragraph: str, is_sentence: bool=False) -> ParagraphWithInverse:
+        if is_sentence:
+            sentences = [(0, len(paragraph))]
+        else:
+            sentences = self._sent_tokenizer.span_tokenize(paragraph)
+        text = []
+        spans = []
+        for s, e in sentences:
+            tokens, token_spans = scan_tokens(paragraph, s, e)
+            text.append(tokens)
+            spans += token_spans
+        if len(spans) == 0:
+            spans = np.zeros((0, 2), dtype=np.int32)
+        else:
+            spans = np.array(spans, dtype=np.int32)
+        return ParagraphWithInverse(text, paragraph, spans)
+
+    def __getstate__(self):
+        return dict(sentence_splitter=self.sentence_splitter)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+# Tokenizers that can be selected on the command line, "nltk" is the reference, "fast-punkt" should give
+# the same output faster and "fast-regex" is the fastest but can split sentences differently
+TOKENIZERS = ["nltk", "fast-punkt", "fast-regex"]
+
+
+def get_tokenizer(name: str):
+    if name == "nltk":
+        return NltkAndPunctTokenizer()
+    elif name == "fast-punkt":
+        return FastNltkAndPunctTokenizer("punkt")
+    elif name == "fast-regex":
+        return FastNltkAndPunctTokenizer("regex")
+    else:
+        raise ValueError(name)
@@ -0,0 +1,111 @@
+from typing import List, Callable, Optional
+
+import numpy as np
+
+"""
+Token sequences that have been mapped to word/char ids ahead of time, so batches
+can be built by slicing numpy arrays instead of looking up each word and character
+"""
+
+
+class EncodedTokenSequences(object):
+    """
+    Ragged int32 word and char ids for a list of token sequences. Sequence `i` owns words
+    `word_offsets[i]:word_offsets[i+1]` of `word_ids`, and word `w` owns characters
+    `char_offsets[w]:char_offsets[w+1]` of `char_ids`. Words are truncated to `max_chars`
+    characters when built, so the char ids never need to be truncated again.
+    """
+
+    def __init__(self, word_offsets: np.ndarray, word_ids: Optional[np.ndarray],
+                 char_offsets: Optional[np.ndarray], char_ids: Optional[np.ndarray], max_chars: int):
+        self.word_offsets = word_offsets
+        self.word_ids = word_ids
+        self.char_offsets = char_offsets
+        self.char_ids = char_ids
+        self.max_chars = max_chars
+
+    @staticmethod
+    def build(sequences: List[List[str]],
+              word_to_ix: Optional[Callable[[str], int]],
+              char_to_ix: Optional[Callable[[str], int]],
+              max_chars: int):
+        """ Encode `sequences`, each unique word is only looked up once """
+        word_offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        for i, seq in enumerate(sequences):
+            word_offsets[i + 1] = word_offsets[i] + len(seq)
+        n_words = int(word_offsets[-1])
+
+        word_ids = np.zeros(n_words, dtype=np.int32) if word_to_ix is not None else None
+        if char_to_ix is not None:
+            char_lens = np.zeros(n_words, dtype=np.int64)
+            word_chars = []
+        else:
+            char_lens, word_chars = None, None
+
+        word_cache = {}
+        char_cache = {}
+        on_word = 0
+        for seq in sequences:
+            for word in seq:
+                if word_ids is not None:
+                    ix = word_cache.get(word)
+                    if ix is None:
+                        ix = word_to_ix(word)
+                        word_cache[word] = ix
+                    word_ids[on_word] = ix
+                if char_lens is not None:
+                    chars = char_cache.get(word)
+                    if chars is None:
+                        chars = [char_to_ix(c) for c in word[:max_chars]]
+                        char_cache[word] = chars
+                    char_lens[on_word] = len(chars)
+                    word_chars.append(chars)
+                on_word += 1
+
+        if char_lens is not None:
+            char_offsets = np.zeros(n_words + 1, dtype=np.int64)
+            np.cumsum(char_lens, out=char_offsets[1:])
+            char_ids = np.fromiter((c for chars in word_chars for c in chars),
+                                   dtype=np.int32, count=int(char_offsets[-1]))
+        else:
+            char_offsets, char_ids = None, None
+        return EncodedTokenSequences(word_offsets, word_ids, char_offsets, char_ids, max_chars)
+
+    def __len__(self):
+        return len(self.word_offsets) - 1
+
+    def lengths(self, ixs: np.ndarray) -> np.ndarray:
+        return (self.word_offsets[ixs + 1] - self.word_offsets[ixs]).astype(np.int32)
+
+    def _word_positions(self, ixs: np.ndarray, word_dim: int):
+        """ mask of the filled (batch, word) positions, and the flat word index for each of them """
+        starts = self.word_offsets[ixs]
+        lens = np.minimum(self.word_offsets[ixs + 1] - starts, word_dim)
+        arange = np.arange(word_dim)
+        mask = arange[None, :] < lens[:, None]
+        return mask, (starts[:, None] + arange[None, :])[mask]
+
+    def fill(self, ixs: np.ndarray, words: Optional[np.ndarray],
+             chars: Optional[np.ndarray], word_lens: Optional[np.ndarray]):
+        """
+        Write the ids of sequences `ixs` into the zero-initialized, already allocated
+        `words` (batch, word_dim), `chars` (batch, word_dim, char_dim) and `word_lens` (batch, word_dim)
+        arrays, any of which can be None. Sequences longer than `word_dim` are truncated.
+        """
+        n = len(ixs)
+        word_dim = (words if words is not None else word_lens).shape[1]
+        mask, src = self._word_positions(ixs, word_dim)
+
+        if words is not None:
+            words[:n][mask] = self.word_ids[src]
+
+        if chars is not None:
+            char_dim = chars.shape[2]
+            char_starts = self.char_offsets[src]
+            char_lens = np.minimum(self.char_offsets[src + 1] - char_starts, char_dim)
+            char_arange = np.arange(char_dim)
+            char_mask = char_arange[None, :] < char_lens[:, None]
+            per_word = np.zeros((len(src), char_dim), dtype=chars.dtype)
+            per_word[char_mask] = self.char_ids[(char_starts[:, None] + char_arange[None, :])[char_mask]]
+            chars[:n][mask] = per_word
+            word_lens[:n][mask] = char_lens
@@ -1,6 +1,8 @@
-from typing import List
+import heapq
+from typing import List, Optional, Tuple
 
 import numpy as np
+from scipy.special import logsumexp
 
 from docqa.data_processing.qa_training_data import Answer
 
@@ -161,6 +163,113 @@ def top_disjoint_spans(span_scores, bound: int, n_spans: int):
     return cur_spans[:spans_found], cur_scores[:spans_found]
 
 
+def _end_logsumexp(end_logits, bound):
+    """ logsumexp(end_logits[i:i+bound]) for each start i """
+    n = len(end_logits)
+    if bound == n:
+        return np.logaddexp.accumulate(end_logits[::-1])[::-1]
+    padded = np.full(n + bound - 1, -np.inf)
+    padded[:n] = end_logits
+    out = padded[:n].copy()
+    for offset in range(1, bound):
+        out = np.logaddexp(out, padded[offset:offset + n])
+    return out
+
+
+def _best_ends(end_logits, bound):
+    """ argmax(end_logits[i:i+bound]) + i for each start i, choosing the first end for ties """
+    n = len(end_logits)
+    if bound == n:
+        # The best end for `i` is the first j >= i that is at least as large as everything after it
+        suffix_max = np.maximum.accumulate(end_logits[::-1])[::-1]
+        candidates = np.where(end_logits == suffix_max, np.arange(n), n)
+        return np.minimum.accumulate(candidates[::-1])[::-1]
+    padded = np.full(n + bound - 1, -np.inf)
+    padded[:n] = end_logits
+    best_val = padded[:n].copy()
+    best = np.arange(n)
+    for offset in range(1, bound):
+        better = padded[offset:offset + n] > best_val
+        best_val[better] = padded[offset:offset + n][better]
+        best[better] = np.arange(n)[better] + offset
+    return best
+
+
+def top_k_spans_single(start_logits, end_logits, k: Optional[int], none_logit=None, bound: Optional[int]=None):
+    """
+    Find the `k` most likely spans (start <= end, and end - start < `bound`) under the distribution
+    softmax(start_logits[start] + end_logits[end]) over all such spans, and the no-answer
+    option if `none_logit` is given. If `k` is None, all spans are returned.
+
+    Returns the log-partition and the spans as a (n, 2) int array, with no-answer as (-1, -1), and
+    a (n,) array of their log-probabilities, sorted from most to least likely
+    """
+    start_logits = np.asarray(start_logits, dtype=np.float64)
+    end_logits = np.asarray(end_logits, dtype=np.float64)
+    n = len(start_logits)
+    bound = n if bound is None else min(bound, n)
+
+    log_partition = logsumexp(start_logits + _end_logsumexp(end_logits, bound))
+    if none_logit is not None:
+        log_partition = np.logaddexp(log_partition, none_logit)
+
+    if k is None:
+        starts, ends = np.triu_indices(n)
+        valid = ends - starts < bound
+        spans = np.stack([starts[valid], ends[valid]], axis=1)
+        scores = start_logits[spans[:, 0]] + end_logits[spans[:, 1]]
+        if none_logit is not None:
+            spans = np.concatenate([[[-1, -1]], spans], axis=0)
+            scores = np.concatenate([[none_logit], scores])
+        order = np.argsort(-scores, kind="mergesort")
+        return log_partition, spans[order], scores[order] - log_partition
+
+    # Each start's best span, only the `k` starts with the best spans can be part of the answer
+    best_ends = _best_ends(end_logits, bound)
+    best_scores = start_logits + end_logits[best_ends]
+    if k < n:
+        candidates = np.argpartition(-best_scores, k)[:k]
+    else:
+        candidates = np.arange(n)
+    heap = [(-best_scores[i], i, best_ends[i]) for i in candidates]
+    if none_logit is not None:
+        heap.append((-none_logit, -1, -1))
+    heapq.heapify(heap)
+
+    # Ends in order of decreasing score, used to find the next best end for a start
+    end_order = np.argsort(-end_logits, kind="mergesort")
+    end_rank = np.empty(n, dtype=np.int64)
+    end_rank[end_order] = np.arange(n)
+
+    spans = []
+    scores = []
+    while len(heap) > 0 and len(spans) < k:
+        neg_score, start, end = heapq.heappop(heap)
+        spans.append((start, end))
+        scores.append(-neg_score)
+        if start >= 0:
+            remaining = end_order[end_rank[end] + 1:]
+            next_ends = np.flatnonzero(np.logical_and(remaining >= start, remaining < start + bound))
+            if len(next_ends) > 0:
+                next_end = remaining[next_ends[0]]
+                heapq.heappush(heap, (-(start_logits[start] + end_logits[next_end]), start, next_end))
+
+    return log_partition, np.array(spans, dtype=np.int64).reshape(-1, 2), np.array(scores) - log_partition
+
+
+def top_k_spans(start_logits, end_logits, lens, k: Optional[int], none_logits=None,
+                bound: Optional[int]=None) -> List[Tuple[float, np.ndarray, np.ndarray]]:
+    """
+    `top_k_spans_single` for a batch, `start_logits` and `end_logits` can be (batch, max_len)
+    arrays or lists of arrays, and only the first `lens[i]` logits of each example are used
+    """
+    out = []
+    for i, n in enumerate(lens):
+        out.append(top_k_spans_single(start_logits[i][:n], end_logits[i][:n], k,
+                                      None if none_logits is None else none_logits[i], bound))
+    return out
+
+
 def compute_span_f1(true_span, pred_span):
     start = max(true_span[0], pred_span[0])
     stop = min(true_span[1], pred_span[1])
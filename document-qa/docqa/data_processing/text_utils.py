@@ -32,15 +32,16 @@ def post_split_tokens(tokens: List[str]) -> List[str]:
                             for token in tokens)
 
 
-def get_word_span(spans: np.ndarray, start: int, stop: int):
-    idxs = []
-    for word_ix, (s, e) in enumerate(spans):
-        if e > start:
-            if s < stop:
-                idxs.append(word_ix)
-            else:
-                break
-    return idxs
+def get_word_span(spans: np.ndarray, start: int, stop: int) -> List[int]:
+    """
+    Indices of the words in `spans`, an (n_words, 2) array of character spans in increasing order,
+    that overlap the characters [start, stop)
+    """
+    # Since both the span starts and ends are sorted, the words that end after `start` and
+    # start before `stop` form a contiguous range we can find with binary search
+    first = int(np.searchsorted(spans[:, 1], start, side="right"))
+    last = int(np.searchsorted(spans[:, 0], stop, side="left"))
+    return list(range(first, max(first, last)))
 
 
 class ParagraphWithInverse(object):
@@ -95,25 +96,29 @@ class NltkAndPunctTokenizer(Configurable):
     @staticmethod
     def convert_to_spans(raw_text: str, sentences: List[List[str]]) -> List[List[Tuple[int, int]]]:
         """ Convert a tokenized version of `raw_text` into a series character spans referencing the `raw_text` """
+        # Single forward pass, every search starts at `cur_idx` of `raw_text` so we never copy the remaining
+        # text, which made this quadratic for long documents with many quotes
         cur_idx = 0
         all_spans = []
+        find = raw_text.find
+        search_quote = double_quote_re.search
         for sent in sentences:
             spans = []
             for token in sent:
                 # (our) Tokenizer might transform double quotes, for this case search over several
                 # possible encodings
                 if double_quote_re.match(token):
-                    span = double_quote_re.search(raw_text[cur_idx:])
-                    tmp = cur_idx + span.start()
-                    l = span.end() - span.start()
+                    span = search_quote(raw_text, cur_idx)
+                    if span is None:
+                        raise ValueError(token)
+                    start, end = span.span()
                 else:
-                    tmp = raw_text.find(token, cur_idx)
-                    l = len(token)
-                if tmp < cur_idx:
-                    raise ValueError(token)
-                cur_idx = tmp
-                spans.append((cur_idx, cur_idx + l))
-                cur_idx += l
+                    start = find(token, cur_idx)
+                    if start < 0:
+                        raise ValueError(token)
+                    end = start + len(token)
+                spans.append((start, end))
+                cur_idx = end
             all_spans.append(spans)
         return all_spans
 
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from docqa.configurable import Configurable
+from docqa.data_processing.text_utils import ParagraphWithInverse
+
+"""
+Content-addressed cache of tokenizer outputs, so text that has already been tokenized
+(by this process, an earlier corpus build, or another worker) does not have to be tokenized again
+"""
+
+
+def _encode(sentences: List[List[str]], spans: Optional[np.ndarray]) -> bytes:
+    sent_lens = np.array([len(s) for s in sentences], dtype=np.int32)
+    tokens = [w for s in sentences for w in s]
+    return zlib.compress(pickle.dumps((sent_lens.tobytes(), tokens,
+                                       None if spans is None else spans.astype(np.int32).tobytes())))
+
+
+def _decode(blob: bytes):
+    sent_lens, tokens, spans = pickle.loads(zlib.decompress(blob))
+    sentences = []
+    on_token = 0
+    for n in np.frombuffer(sent_lens, dtype=np.int32).tolist():
+        sentences.append(tokens[on_token:on_token + n])
+        on_token += n
+    if spans is not None:
+        spans = np.frombuffer(spans, dtype=np.int32).reshape((-1, 2)).copy()
+    return sentences, spans
+
+
+class CachedTokenizer(Configurable):
+    """
+    Wraps a tokenizer such as `NltkAndPunctTokenizer` and caches the output of `tokenize_with_inverse`
+    and `tokenize_paragraph`, keyed by a hash of the text, the method and the tokenizer's configuration.
+
+    Outputs are stored as zlib compressed token lists, sentence lengths and char spans. An in-memory LRU cache
+    holds up to `max_memory_mb` of them, and if `cache_dir` is given they are also stored in an sqlite
+    database there, so they are shared between processes and later runs. The database is trimmed back
+    to `max_disk_mb`, dropping the least recently used outputs first. Only the settings are pickled,
+    so each process opens its own connection.
+    """
+
+    def __init__(self, tokenizer, cache_dir: Optional[str]=None,
+                 max_memory_mb: float=256, max_disk_mb: float=10240):
+        self.tokenizer = tokenizer
+        self.cache_dir = cache_dir
+        self.max_memory_mb = max_memory_mb
+        self.max_disk_mb = max_disk_mb
+        if hasattr(tokenizer, "get_config"):
+            self._tokenizer_key = str(tokenizer.get_config())
+        else:
+            self._tokenizer_key = tokenizer.__class__.__name__
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._db = None
+        self._n_writes = 0
+        self._lock = threading.Lock()  # So it can be shared by the demo server's threads
+        self.hits = 0
+        self.misses = 0
+
+    def _get_db(self):
+        if self._db is None:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.cache_dir, "tokenized.sqlite"), timeout=120,
+                                 check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS tokenized (key BLOB PRIMARY KEY, value BLOB, "
+                       "size INTEGER, last_used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS tokenized_last_used ON tokenized (last_used)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _key(self, method: str, text: str) -> bytes:
+        h = hashlib.sha1()
+        h.update(self._tokenizer_key.encode("utf-8"))
+        h.update(b"\0")
+        h.update(method.encode("utf-8"))
+        h.update(b"\0")
+        h.update(text.encode("utf-8", "surrogatepass"))
+        return h.digest()
+
+    def _add_to_memory(self, key, blob):
+        self._memory[key] = blob
+        self._memory_bytes += len(blob)
+        max_bytes = self.max_memory_mb * 2**20
+        while self._memory_bytes > max_bytes and len(self._memory) > 0:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _trim_disk(self, db):
+        max_bytes = self.max_disk_mb * 2**20
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM tokenized").fetchone()[0]
+        if total <= max_bytes:
+            return
+        # Evict down to 90% of the budget so we don't have to trim again immediately
+        to_remove = total - max_bytes * 0.9
+        cutoff = None
+        removed = 0
+        for last_used, size in db.execute("SELECT last_used, size FROM tokenized ORDER BY last_used"):
+            removed += size
+            cutoff = last_used
+            if removed >= to_remove:
+                break
+        db.execute("DELETE FROM tokenized WHERE last_used <= ?", (cutoff,))
+
+    def _get_or_build(self, method: str, text: str, build_fn):
+        key = self._key(method, text)
+        with self._lock:
+            blob = self._lookup(key)
+        if blob is None:
+            blob = _encode(*build_fn())
+            with self._lock:
+                self._store(key, blob)
+        # Always return a freshly decoded copy, so callers can't modify the cached value
+        return _decode(blob)
+
+    def _lookup(self, key: bytes) -> Optional[bytes]:
+        blob = self._memory.get(key)
+        if blob is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return blob
+
+        if self.cache_dir is not None:
+            db = self._get_db()
+            row = db.execute("SELECT value FROM tokenized WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                blob = row[0]
+                with db:
+                    db.execute("UPDATE tokenized SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                self._add_to_memory(key, blob)
+                return blob
+        self.misses += 1
+        return None
+
+    def _store(self, key: bytes, blob: bytes):
+        self._add_to_memory(key, blob)
+        if self.cache_dir is not None:
+            db = self._get_db()
+            with db:
+                db.execute("INSERT OR REPLACE INTO tokenized VALUES (?, ?, ?, ?)",
+                           (key, blob, len(blob), time.time()))
+                self._n_writes += 1
+                if self._n_writes % 1000 == 0:
+                    self._trim_disk(db)
+
+    def tokenize_with_inverse(self, paragraph: str, is_sentence: bool=False) -> ParagraphWithInverse:
+        def build():
+            tokenized = self.tokenizer.tokenize_with_inverse(paragraph, is_sentence)
+            return tokenized.text, tokenized.spans
+        text, spans = self._get_or_build("tokenize_with_inverse-%s" % is_sentence, paragraph, build)
+        return ParagraphWithInverse(text, paragraph, spans)
+
+    def tokenize_paragraph(self, paragraph: str) -> List[List[str]]:
+        return self._get_or_build("tokenize_paragraph", paragraph,
+                                  lambda: (self.tokenizer.tokenize_paragraph(paragraph), None))[0]
+
+    def tokenize_paragraph_flat(self, paragraph: str) -> List[str]:
+        return [w for s in self.tokenize_paragraph(paragraph) for w in s]
+
+    def tokenize_sentence(self, sent: str) -> List[str]:
+        # Sentences are short, so tokenizing them is about as fast as a cache lookup
+        return self.tokenizer.tokenize_sentence(sent)
+
+    def clean_text(self, word):
+        return self.tokenizer.clean_text(word)
+
+    def __getstate__(self):
+        return dict(tokenizer=self.tokenizer, cache_dir=self.cache_dir,
+                    max_memory_mb=self.max_memory_mb, max_disk_mb=self.max_disk_mb)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
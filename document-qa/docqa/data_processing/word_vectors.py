@@ -1,8 +1,11 @@
 import gzip
+import mmap
 import pickle
-from os.path import join, exists
+from bisect import bisect_left, bisect_right
+from os import makedirs, remove
+from os.path import join, exists, isdir
 from tqdm import tqdm
-from typing import Iterable, Optional
+from typing import Iterable, Optional, Dict
 
 import numpy as np
 
@@ -12,12 +15,18 @@ from docqa.config import VEC_DIR
 """ Loading words vectors """
 
 
+# Suffix of the directories built by `convert_word_vector_file`
+BINARY_SUFFIX = ".vecs"
+
+
 def load_word_vectors(vec_name: str, vocab: Optional[Iterable[str]]=None, is_path=False):
     if not is_path:
         vec_path = join(VEC_DIR, vec_name)
     else:
         vec_path = vec_name
-    if exists(vec_path + ".txt"):
+    if exists(vec_path + BINARY_SUFFIX):
+        vec_path = vec_path + BINARY_SUFFIX
+    elif exists(vec_path + ".txt"):
         vec_path = vec_path + ".txt"
     elif exists(vec_path + ".txt.gz"):
         vec_path = vec_path + ".txt.gz"
@@ -28,21 +37,25 @@ def load_word_vectors(vec_name: str, vocab: Optional[Iterable[str]]=None, is_pat
     return load_word_vector_file(vec_path, vocab)
 
 
+def has_binary_word_vectors(vec_name: str, is_path=False) -> bool:
+    """ Whether `vec_name` has a binary copy, in which case loading a few words does not read the entire file """
+    if not is_path:
+        vec_name = join(VEC_DIR, vec_name)
+    return exists(vec_name + BINARY_SUFFIX)
+
+
 def load_word_vector_file(vec_path: str, vocab: Optional[Iterable[str]] = None):
     if vocab is not None:
         vocab = set(x.lower() for x in vocab)
 
-    # notes some of the large vec files produce utf-8 errors for some words, just skip them
+    if isdir(vec_path):
+        return BinaryWordVectors(vec_path).get_vectors(vocab)
     if vec_path.endswith(".pkl"):
         with open(vec_path, "rb") as f:
             return pickle.load(f)
-    elif vec_path.endswith(".txt.gz"):
-        handle = lambda x: gzip.open(x, 'r', encoding='utf-8', errors='ignore')
-    else:
-        handle = lambda x: open(x, 'r', encoding='utf-8', errors='ignore')
 
     pruned_dict = {}
-    with handle(vec_path) as fh:
+    with _open_text_vectors(vec_path) as fh:
         if vocab is None:
             # Print progress bar because this will be slow
             if 'glove.840B.300d' in vec_path:
@@ -53,3 +66,114 @@ def load_word_vector_file(vec_path: str, vocab: Optional[Iterable[str]] = None):
             if (vocab is None) or (word.lower() in vocab):
                 pruned_dict[word] = np.array([float(x) for x in line[word_ix + 1:-1].split(" ")], dtype=np.float32)
     return pruned_dict
+
+
+def _open_text_vectors(vec_path: str):
+    # notes some of the large vec files produce utf-8 errors for some words, just skip them
+    if vec_path.endswith(".gz"):
+        return gzip.open(vec_path, 'rt', encoding='utf-8', errors='ignore')
+    else:
+        return open(vec_path, 'r', encoding='utf-8', errors='ignore')
+
+
+class BinaryWordVectors(object):
+    """
+    Word vectors stored in a directory built by `convert_word_vector_file`, which contains:
+
+    matrix.npy: (n_words, dim) float32 matrix, opened with `np.load(mmap_mode='r')`
+    words.bin, word_offsets.npy: utf-8 words concatenated together, and their start/end bytes
+    keys.bin, key_offsets.npy: the same for the lower-cased words
+
+    Rows are sorted by (lower-cased word, word), so all the capitalizations of a word are contiguous and
+    can be found with a binary search over the keys. Since nothing is parsed up front and the matrix is
+    memory mapped, opening the vectors is fast and the OS shares the pages between processes.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.matrix = np.load(join(directory, "matrix.npy"), mmap_mode="r")
+        self._word_offsets = np.load(join(directory, "word_offsets.npy"), mmap_mode="r")
+        self._key_offsets = np.load(join(directory, "key_offsets.npy"), mmap_mode="r")
+        self._words = self._map(join(directory, "words.bin"))
+        self._keys = self._map(join(directory, "keys.bin"))
+
+    @staticmethod
+    def _map(filename):
+        with open(filename, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __getitem__(self, ix: int) -> bytes:
+        # Indexing by row makes this object a sorted sequence of keys we can `bisect`
+        return self._keys[self._key_offsets[ix]:self._key_offsets[ix + 1]]
+
+    def get_word(self, ix: int) -> str:
+        return self._words[self._word_offsets[ix]:self._word_offsets[ix + 1]].decode("utf-8")
+
+    def find(self, word: str):
+        """ (start, end) rows of all the words that lower-case to `word.lower()` """
+        key = word.lower().encode("utf-8")
+        return bisect_left(self, key), bisect_right(self, key)
+
+    def get_vectors(self, vocab: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """ Same output as `load_word_vector_file`, the vectors are views of the memory mapped matrix """
+        matrix = np.asarray(self.matrix)
+        if vocab is None:
+            rows = range(len(self))
+        else:
+            rows = []
+            for word in set(x.lower() for x in vocab):
+                start, end = self.find(word)
+                rows += range(start, end)
+        return {self.get_word(i): matrix[i] for i in rows}
+
+
+def convert_word_vector_file(vec_path: str, output_dir: str):
+    """ Convert a text word vector file into the directory format read by `BinaryWordVectors` """
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    # Stream the vectors to a flat file so we never hold the parsed text in memory
+    words = []
+    dim = None
+    raw_file = join(output_dir, "matrix.tmp")
+    with _open_text_vectors(vec_path) as fh, open(raw_file, "wb") as out:
+        if 'glove.840B.300d' in vec_path:
+            fh = tqdm(fh, total=2196017)
+        for line in fh:
+            word_ix = line.find(" ")
+            vec = np.array([float(x) for x in line[word_ix + 1:].rstrip("\n").split(" ")], dtype=np.float32)
+            if dim is None:
+                dim = len(vec)
+            elif len(vec) != dim:
+                raise ValueError("Word %s had dimension %d, but expected %d" % (line[:word_ix], len(vec), dim))
+            words.append(line[:word_ix])
+            out.write(vec.tobytes())
+    if dim is None:
+        raise ValueError("No vectors found in %s" % vec_path)
+
+    # If a word occurs twice, `load_word_vector_file` keeps the last one, so we do as well
+    last_occurrence = {w: i for i, w in enumerate(words)}
+    order = sorted(last_occurrence.values(), key=lambda i: (words[i].lower().encode("utf-8"),
+                                                              words[i].encode("utf-8")))
+
+    raw = np.memmap(raw_file, dtype=np.float32, mode="r", shape=(len(words), dim))
+    matrix = np.lib.format.open_memmap(join(output_dir, "matrix.npy"), mode="w+",
+                                       dtype=np.float32, shape=(len(order), dim))
+    for start in range(0, len(order), 100000):
+        matrix[start:start+100000] = raw[order[start:start+100000]]
+    matrix.flush()
+    del matrix, raw
+    remove(raw_file)
+
+    for name, values in [("words", [words[i] for i in order]),
+                         ("keys", [words[i].lower() for i in order])]:
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        with open(join(output_dir, name + ".bin"), "wb") as f:
+            for i, value in enumerate(values):
+                encoded = value.encode("utf-8")
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        np.save(join(output_dir, name[:-1] + "_offsets.npy"), offsets)
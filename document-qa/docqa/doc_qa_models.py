@@ -4,6 +4,7 @@ import tensorflow as tf
 from tensorflow import Tensor
 
 from docqa.data_processing.qa_training_data import ParagraphAndQuestionDataset, ParagraphAndQuestionSpec
+from docqa.dataset import ListDataset
 from docqa.encoder import DocumentAndQuestionEncoder
 from docqa.model import Model, Prediction
 from docqa.nn.embedder import WordEmbedder, CharWordEmbedder
@@ -37,6 +38,7 @@ class ParagraphQuestionModel(Model):
         self.word_embed_layer = word_embed_layer
         self.encoder = encoder
         self._is_train_placeholder = None
+        self._context_encoding = None
 
     def init(self, corpus, loader: ResourceLoader):
         if self.word_embed is not None:
@@ -70,6 +72,22 @@ class ParagraphQuestionModel(Model):
         self._is_train_placeholder = tf.placeholder(tf.bool, ())
         return self.encoder.get_placeholders()
 
+    def pre_encode(self, datasets: List[ParagraphAndQuestionDataset]):
+        # Only datasets with a fixed list of examples will re-use the same example objects each epoch
+        data = []
+        seen = set()
+        for dataset in datasets:
+            if isinstance(dataset, ListDataset):
+                for x in dataset.data:
+                    if id(x) not in seen:  # The train set might also be used as an eval set
+                        seen.add(id(x))
+                        data.append(x)
+        if len(data) == 0:
+            return
+        print("Pre-encoding %d examples..." % len(data))
+        # Our word embedders that can be pre-encoded give the same ids regardless of `is_train`
+        self.encoder.pre_encode(data, True)
+
     def get_placeholders(self):
         return self.encoder.get_placeholders() + [self._is_train_placeholder]
 
@@ -120,6 +138,11 @@ class ParagraphQuestionModel(Model):
                              answer) -> Prediction:
         raise NotImplemented()
 
+    def get_context_encoding(self):
+        if self.encoder.word_featurizer is not None:
+            return None  # The context features can depend on the question
+        return self._context_encoding
+
     def encode(self, batch: List, is_train: bool):
         data = self.encoder.encode(batch, is_train)
         data[self._is_train_placeholder] = is_train
@@ -128,12 +151,16 @@ class ParagraphQuestionModel(Model):
     def __getstate__(self):
         state = super().__getstate__()
         state["_is_train_placeholder"] = None
+        state["_context_encoding"] = None
         return state
 
     def __setstate__(self, state):
         if "state" in state:
             if "preprocessor" not in state["state"]:
                 state["state"]["preprocessor"] = None
+        fields = state["state"] if "state" in state else state
+        if "_context_encoding" not in fields:
+            fields["_context_encoding"] = None
         super().__setstate__(state)
 
 
@@ -206,6 +233,8 @@ class Attention(ParagraphQuestionModel):
             with tf.variable_scope("map_context"):
                 context_rep = self.context_mapper.apply(is_train, context_rep, context_mask)
 
+        self._context_encoding = context_rep
+
         with tf.variable_scope("buid_memories"):
             keys, memories = self.memory_builder.apply(is_train, question_rep, question_mask)
 
@@ -276,6 +305,8 @@ class AttentionAndEncode(ParagraphQuestionModel):
             with tf.variable_scope("map_context"):
                 context_rep = self.context_mapper.apply(is_train, context_rep, context_mask)
 
+        self._context_encoding = context_rep
+
         with tf.variable_scope("build_memories"):
             keys, memories = self.memory_builder.apply(is_train, question_rep, question_mask)
 
@@ -3,6 +3,8 @@ import numpy as np
 
 from typing import List
 
+from docqa.data_processing.char_encoding import pad_ragged, word_utf8_bytes
+
 
 class Vocabulary(object):
     '''
@@ -121,8 +123,7 @@ class UnicodeCharsVocabulary(Vocabulary):
         self.bos_chars = _make_bos_eos(self.bos_char)
         self.eos_chars = _make_bos_eos(self.eos_char)
 
-        for i, word in enumerate(self._id_to_word):
-            self._word_char_ids[i] = self._convert_word_to_char_ids(word)
+        self._word_char_ids[:] = self._convert_words_to_char_ids(self._id_to_word)
 
         self._word_char_ids[self.bos] = self.bos_chars
         self._word_char_ids[self.eos] = self.eos_chars
@@ -137,15 +138,16 @@ class UnicodeCharsVocabulary(Vocabulary):
         return self._max_word_length
 
     def _convert_word_to_char_ids(self, word):
-        code = np.zeros([self.max_word_length], dtype=np.int32)
-        code[:] = self.pad_char
-
-        word_encoded = word.encode('utf-8', 'ignore')[:(self.max_word_length-2)]
-        code[0] = self.bow_char
-        for k, chr_id in enumerate(word_encoded, start=1):
-            code[k] = chr_id
-        code[k + 1] = self.eow_char
-
+        return self._convert_words_to_char_ids([word])[0]
+
+    def _convert_words_to_char_ids(self, words: List[str]):
+        n_words = len(words)
+        code = np.full([n_words, self.max_word_length], self.pad_char, dtype=np.int32)
+        flat, lens = word_utf8_bytes(words)
+        byte_ids, lens = pad_ragged(flat, lens, self.max_word_length-2, self.pad_char)
+        code[:, 0] = self.bow_char
+        code[:, 1:-1] = byte_ids
+        code[np.arange(n_words), lens + 1] = self.eow_char
         return code
 
     def word_to_char_ids(self, word):
@@ -154,6 +156,15 @@ class UnicodeCharsVocabulary(Vocabulary):
         else:
             return self._convert_word_to_char_ids(word)
 
+    def words_to_char_ids(self, words: List[str]):
+        """ (len(words), max_word_length) char ids for `words` """
+        word_ids = np.fromiter((self._word_to_id.get(w, -1) for w in words), dtype=np.int64, count=len(words))
+        code = self._word_char_ids[np.maximum(word_ids, 0)]
+        unknown = np.flatnonzero(word_ids < 0)
+        if len(unknown) > 0:
+            code[unknown] = self._convert_words_to_char_ids([words[i] for i in unknown])
+        return code
+
     def encode_chars(self, sentence, reverse=False):
         '''
         Encode the sentence as a white space delimited string of tokens.
@@ -195,11 +206,16 @@ class Batcher(object):
             dtype=np.int64
         )
 
-        for k, sent in enumerate(sentences):
-            length = len(sent) + 2
-            char_ids_without_mask = self._lm_vocab.encode_chars(' '.join(sent))
-            # add one so that 0 is the mask value
-            X_char_ids[k, :length, :] = char_ids_without_mask + 1
+        lens = np.array([len(sentence) for sentence in sentences])
+        words = [word for sentence in sentences for word in sentence]
+
+        # add one so that 0 is the mask value
+        X_char_ids[:, 0] = self._lm_vocab.bos_chars + 1
+        X_char_ids[np.arange(n_sentences), lens + 1] = self._lm_vocab.eos_chars + 1
+        if len(words) > 0:
+            positions = np.arange(max_length)[None, :]
+            mask = (positions >= 1) & (positions <= lens[:, None])
+            X_char_ids[mask] = self._lm_vocab.words_to_char_ids(words) + 1
 
         return X_char_ids
 
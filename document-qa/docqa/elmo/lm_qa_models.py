@@ -72,6 +72,7 @@ class ElmoQaModel(Model):
         self._question_char_ids_placeholder = None
         self._context_char_ids_placeholder = None
         self._context_sentence_ixs = None
+        self._context_encoding = None
 
     @property
     def token_lookup(self):
@@ -204,6 +205,11 @@ class ElmoQaModel(Model):
                              answer) -> Prediction:
         raise NotImplementedError()
 
+    def get_context_encoding(self):
+        if self.encoder.word_featurizer is not None:
+            return None  # The context features can depend on the question
+        return self._context_encoding
+
     def encode(self, batch: List[ContextAndQuestion], is_train: bool):
         if len(batch) > self.max_batch_size:
             raise ValueError("The model can only use a batch <= %d, but got %d" %
@@ -308,6 +314,8 @@ class AttentionWithElmo(ElmoQaModel):
             context_rep = self._with_lm(is_train, context_rep, context_lm, context_mask, False, True)
             question_rep = self._with_lm(is_train, question_rep, question_lm, question_mask, True, True)
 
+        self._context_encoding = context_rep
+
         with tf.variable_scope("build_memories"):
             keys, memories = self.memory_builder.apply(is_train, question_rep, question_mask)
 
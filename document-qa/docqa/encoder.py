@@ -4,6 +4,7 @@ import numpy as np
 import tensorflow as tf
 
 from docqa.configurable import Configurable
+from docqa.data_processing.pre_encoded import EncodedTokenSequences
 from docqa.data_processing.qa_training_data import ParagraphAndQuestionSpec, ContextAndQuestion
 from docqa.data_processing.span_data import ParagraphSpans, TokenSpans
 from docqa.data_processing.text_features import QaTextFeautrizer
@@ -202,6 +203,7 @@ class DocumentAndQuestionEncoder(Configurable):
 
         self._word_embedder = None
         self._char_emb = None
+        self._char_table = None
 
         # Internal stuff we need to set on `init`
         self.len_opt = None
@@ -221,6 +223,11 @@ class DocumentAndQuestionEncoder(Configurable):
         self.question_len = None
         self.question_word_len = None
 
+        # Built by `pre_encode`
+        self._pre_encoded_rows = None
+        self._pre_encoded_questions = None
+        self._pre_encoded_contexts = None
+
     @property
     def version(self):
         return 3
@@ -230,6 +237,7 @@ class DocumentAndQuestionEncoder(Configurable):
 
         self._word_embedder = word_emb
         self._char_emb = char_emb
+        self._char_table = None if char_emb is None else char_emb.get_char_table()
 
         self.batch_size = input_spec.batch_size
         self.len_opt = len_op
@@ -296,6 +304,42 @@ class DocumentAndQuestionEncoder(Configurable):
                  self._word_embedder.common_word_mat]
                 if x is not None] + self.answer_encoder.get_placeholders()
 
+    def pre_encode(self, data: List[ContextAndQuestion], is_train: bool):
+        """
+        Map the question/context text of `data` to word/char ids once, so `encode` can build batches
+        containing only these examples by slicing arrays. Must be called after `init`, and again if the
+        word embedder's vocabulary changes.
+        """
+        if self._word_embedder is not None and self._word_embedder.query_once():
+            raise ValueError("Can't pre-encode with a word embedder that must be queried once per batch")
+        if self._word_embedder is not None:
+            word_to_ix = lambda w: self._word_embedder.context_word_to_ix(w, is_train)
+        else:
+            word_to_ix = None
+        char_to_ix = None if self._char_emb is None else self._char_emb.char_to_ix
+        self._pre_encoded_questions = EncodedTokenSequences.build(
+            [x.question for x in data], word_to_ix, char_to_ix, self.max_char_dim)
+        self._pre_encoded_contexts = EncodedTokenSequences.build(
+            [x.get_context() for x in data], word_to_ix, char_to_ix, self.max_char_dim)
+        # Keep a reference to the example so its id can't be re-used by a different object
+        self._pre_encoded_rows = {id(x): (x, i) for i, x in enumerate(data)}
+
+    def clear_pre_encoded(self):
+        self._pre_encoded_rows = None
+        self._pre_encoded_questions = None
+        self._pre_encoded_contexts = None
+
+    def _get_pre_encoded_rows(self, batch: List[ContextAndQuestion]) -> Optional[np.ndarray]:
+        if self._pre_encoded_rows is None:
+            return None
+        rows = np.zeros(len(batch), dtype=np.int64)
+        for i, x in enumerate(batch):
+            row = self._pre_encoded_rows.get(id(x))
+            if row is None or row[0] is not x:
+                return None
+            rows[i] = row[1]
+        return rows
+
     def encode(self, batch: List[ContextAndQuestion], is_train: bool):
         batch_size = len(batch)
         if self.batch_size is not None:
@@ -354,10 +398,26 @@ class DocumentAndQuestionEncoder(Configurable):
         else:
             context_chars, question_chars, question_word_len, context_word_len = None, None, None, None
 
+        pre_encoded_rows = self._get_pre_encoded_rows(batch)
+        if pre_encoded_rows is not None:
+            self._pre_encoded_questions.fill(pre_encoded_rows, question_words, question_chars, question_word_len)
+            self._pre_encoded_contexts.fill(pre_encoded_rows, context_words, context_chars, context_word_len)
+            batch_to_fill = []
+        else:
+            batch_to_fill = batch
+
         query_once = self._word_embedder.query_once()
 
+        if self._char_table is not None and len(batch_to_fill) > 0:
+            # Fill in all the chars at once, so the loop below only needs to handle words
+            self._char_table.fill([doc.question for doc in batch_to_fill], question_chars, question_word_len)
+            self._char_table.fill([doc.get_context() for doc in batch_to_fill], context_chars, context_word_len)
+            fill_chars = False
+        else:
+            fill_chars = self._char_emb is not None
+
         # Now fill in the place holders by iterating through the data
-        for doc_ix, doc in enumerate(batch):
+        for doc_ix, doc in enumerate(batch_to_fill):
             doc_mapping = {}  # word->ix mapping if `query_once` is True
 
             for word_ix, word in enumerate(doc.question):
@@ -370,7 +430,7 @@ class DocumentAndQuestionEncoder(Configurable):
                     else:
                         ix = self._word_embedder.context_word_to_ix(word, is_train)
                     question_words[doc_ix, word_ix] = ix
-                if self._char_emb is not None:
+                if fill_chars:
                     question_word_len[doc_ix, word_ix] = min(self.max_char_dim, len(word))
                     for char_ix, char in enumerate(word):
                         if char_ix == self.max_char_dim:
@@ -388,7 +448,7 @@ class DocumentAndQuestionEncoder(Configurable):
                         ix = self._word_embedder.context_word_to_ix(word, is_train)
                     context_words[doc_ix, word_ix] = ix
 
-                if self._char_emb is not None:
+                if fill_chars:
                     context_word_len[doc_ix, word_ix] = min(self.max_char_dim, len(word))
                     for char_ix, char in enumerate(word):
                         if char_ix == self.max_char_dim:
@@ -436,6 +496,8 @@ class DocumentAndQuestionEncoder(Configurable):
         else:
             del state["version"]
             return self.__init__(**state)
+        # Older versions skip `__init__`, and pre-encoded data is never pickled
+        self.clear_pre_encoded()
 
 
 class CheatingEncoder(DocumentAndQuestionEncoder):
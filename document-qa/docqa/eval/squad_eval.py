@@ -104,6 +104,8 @@ def main():
     parser.add_argument('--no_ema', action="store_true", help="Don't use EMA weights even if they exist")
     parser.add_argument('--none_prob', action="store_true", help="Output none probability for samples")
     parser.add_argument('--elmo', action="store_true", help="Use elmo model")
+    parser.add_argument('--share_contexts', action="store_true",
+                        help="Encode each paragraph once and re-use it for all its questions")
     parser.add_argument('--per_question_loss_file', type=str, default=None,
             help="Run question by question and output a question_id -> loss output to this file")
     args = parser.parse_known_args()[0]
@@ -152,7 +154,8 @@ def main():
 
 
     evaluation = trainer.test(model, evaluators, {args.corpus: dataset},
-                              corpus.get_resource_loader(), checkpoint, not args.no_ema)[args.corpus]
+                              corpus.get_resource_loader(), checkpoint, not args.no_ema,
+                              share_contexts=args.share_contexts)[args.corpus]
 
     # Print the scalar results in a two column table
     scalars = evaluation.scalars
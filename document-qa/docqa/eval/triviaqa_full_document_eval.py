@@ -9,7 +9,7 @@ import pandas as pd
 from tqdm import tqdm
 
 from docqa import trainer
-from docqa.config import TRIVIA_QA
+from docqa.config import TRIVIA_QA, CORPUS_DIR
 from docqa.data_processing.document_splitter import MergeParagraphs, TopTfIdf, ShallowOpenWebRanker, FirstN
 from docqa.data_processing.preprocessed_corpus import preprocess_par
 from docqa.data_processing.qa_training_data import ParagraphAndQuestionDataset
@@ -20,6 +20,7 @@ from docqa.eval.ranked_triviaqa_scores import compute_model_scores
 from docqa.evaluator import Evaluator, Evaluation
 from docqa.model_dir import ModelDir
 from docqa.triviaqa.build_span_corpus import TriviaQaWebDataset, TriviaQaOpenDataset
+from docqa.triviaqa.evidence_index import Bm25Ranker
 from docqa.triviaqa.read_data import normalize_wiki_filename
 from docqa.triviaqa.training_data import DocumentParagraphQuestion, ExtractMultiParagraphs, \
     ExtractMultiParagraphsPerQuestion
@@ -107,8 +108,20 @@ def main():
                         help="Max tokens per a paragraph")
     parser.add_argument('-g', '--n_paragraphs', type=int, default=15,
                         help="Number of paragraphs to run the model on")
-    parser.add_argument('-f', '--filter', type=str, default=None, choices=["tfidf", "truncate", "linear"],
+    parser.add_argument('-f', '--filter', type=str, default=None, choices=["tfidf", "truncate", "linear", "bm25"],
                         help="How to select paragraphs")
+    parser.add_argument('--bm25_index', type=str, default=join(CORPUS_DIR, "triviaqa", "evidence-index"),
+                        help="Index built by docqa/triviaqa/evidence_index.py to use with the bm25 filter, "
+                             "should be built with the same number of tokens per a paragraph")
+    parser.add_argument('--tfidf_cache_dir', type=str, default=None,
+                        help="Directory to save the tf-idf index built for each document in, so "
+                             "they can be re-used by later runs")
+    parser.add_argument('--tfidf_cache_docs', type=int, default=0,
+                        help="Number of tf-idf indices to also keep in memory in each process, questions "
+                             "are grouped by document unless --no_group_by_doc is set so this rarely helps")
+    parser.add_argument('--no_group_by_doc', action="store_true",
+                        help="Split and rank each (question, document) pair separately instead of "
+                             "once per document for all its questions")
     parser.add_argument('-b', '--batch_size', type=int, default=200,
                         help="Batch size, larger sizes might be faster but wll take more memory")
     parser.add_argument('--max_answer_len', type=int, default=8,
@@ -161,10 +174,14 @@ def main():
 
     if filter_name == "tfidf":
         para_filter = TopTfIdf(NltkPlusStopWords(punctuation=True), args.n_paragraphs)
+        if args.tfidf_cache_dir is not None or args.tfidf_cache_docs > 0:
+            para_filter.enable_cache(args.tfidf_cache_docs, args.tfidf_cache_dir, str(splitter.get_config()))
     elif filter_name == "truncate":
         para_filter = FirstN(args.n_paragraphs)
     elif filter_name == "linear":
         para_filter = ShallowOpenWebRanker(args.n_paragraphs)
+    elif filter_name == "bm25":
+        para_filter = Bm25Ranker(args.bm25_index, args.n_paragraphs)
     else:
         raise ValueError()
 
@@ -177,7 +194,8 @@ def main():
     print("Building question/paragraph pairs...")
     # Loads the relevant questions/documents, selects the right paragraphs, and runs the model's preprocessor
     if per_document:
-        prep = ExtractMultiParagraphs(splitter, para_filter, model.preprocessor, require_an_answer=False)
+        prep = ExtractMultiParagraphs(splitter, para_filter, model.preprocessor, require_an_answer=False,
+                                      group_by_doc=not args.no_group_by_doc)
     else:
         prep = ExtractMultiParagraphsPerQuestion(splitter, para_filter, model.preprocessor, require_an_answer=False)
     prepped_data = preprocess_par(test_questions, corpus, prep, args.n_processes, 1000)
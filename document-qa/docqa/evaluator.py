@@ -12,6 +12,7 @@ from docqa.utils import flatten_iterable
 from docqa.data_processing.qa_training_data import ContextAndQuestion
 from docqa.data_processing.span_data import compute_span_f1
 from docqa.model import Model, Prediction
+from docqa.shared_context import SharedContextRunner
 from docqa.squad.squad_official_evaluation import exact_match_score as squad_official_em_score
 from docqa.squad.squad_official_evaluation import f1_score as squad_official_f1_score
 from docqa.triviaqa.trivia_qa_eval import f1_score as triviaqa_f1_score
@@ -407,8 +408,7 @@ class EvaluatorRunner(object):
         data_used = []
 
         for batch in tqdm(batches, total=n_batches, desc=name, ncols=80):
-            feed_dict = self.model.encode(batch, is_train=False)
-            output = sess.run(all_tensors_needed, feed_dict=feed_dict)
+            output = self._run_batch(sess, all_tensors_needed, batch)
             data_used += batch
             for i in range(len(all_tensors_needed)):
                 tensors[all_tensors_needed[i]].append(output[i])
@@ -444,6 +444,34 @@ class EvaluatorRunner(object):
 
         return combined
 
+    def _run_batch(self, sess: tf.Session, tensors: List, batch: List):
+        return sess.run(tensors, feed_dict=self.model.encode(batch, is_train=False))
+
+
+class SharedContextEvaluatorRunner(EvaluatorRunner):
+    """
+    Evaluator runner that computes the question-independent encoding of each context once, and
+    re-uses it for all the questions about that context. Works best if the dataset yields
+    questions that share a context close to each other.
+    """
+
+    def __init__(self, evaluators: List[Evaluator], model: Model, cache_size: int=1024):
+        super().__init__(evaluators, model)
+        self.cache_size = cache_size
+        self.runner = None
+
+    def set_input(self, prediction: Prediction):
+        super().set_input(prediction)
+        self.runner = SharedContextRunner(self.model, self.cache_size)
+
+    def run_evaluators(self, sess: tf.Session, dataset: Dataset, name, n_sample=None, feed_dict=None) -> Evaluation:
+        evaluation = super().run_evaluators(sess, dataset, name, n_sample, feed_dict)
+        self.runner.print_stats()
+        return evaluation
+
+    def _run_batch(self, sess: tf.Session, tensors: List, batch: List):
+        return self.runner.run(sess, tensors, batch)
+
 
 class AysncEvaluatorRunner(object):
     """ Knows how to run a list of evluators use a tf.Queue to feed in the data """
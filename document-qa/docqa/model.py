@@ -1,4 +1,4 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from docqa.dataset import Dataset
 from tensorflow import Tensor
@@ -58,6 +58,10 @@ class Model(Configurable):
     def set_inputs(self, datasets: List[Dataset], resource_loader: ResourceLoader) -> List[Tensor]:
         raise NotImplementedError()
 
+    def pre_encode(self, datasets: List[Dataset]):
+        """ Optionally pre-compute whatever `encode` can re-use across epochs for the given datasets """
+        pass
+
     def get_prediction(self) -> Prediction:
         return self.get_predictions_for({x: x for x in self.get_placeholders()})
 
@@ -67,5 +71,13 @@ class Model(Configurable):
     def get_predictions_for(self, input_tensors: Dict[Tensor, Tensor]) -> Prediction:
         raise NotImplementedError()
 
+    def get_context_encoding(self) -> Optional[Tensor]:
+        """
+        The question-independent (batch, context_words, dim) encoding of the context built by the
+        last call to `get_predictions_for`, or None if the model does not have one. Clients can feed
+        a pre-computed value for this tensor to re-use it for several questions about the same context
+        """
+        return None
+
     def encode(self, examples, is_train: bool) -> Dict[Tensor, object]:
         raise NotImplementedError()
@@ -1,10 +1,11 @@
 from collections import Counter
-from typing import List, Iterable
+from typing import List, Iterable, Optional
 
 import numpy as np
 import tensorflow as tf
 
 from docqa.configurable import Configurable
+from docqa.data_processing.char_encoding import CharIdTable
 from docqa.nn.layers import Encoder
 from docqa.utils import ResourceLoader
 
@@ -58,6 +59,10 @@ class CharEmbedder(Configurable):
     def get_word_size_th(self):
         raise ValueError()
 
+    def get_char_table(self) -> Optional[CharIdTable]:
+        """ Table for vectorized char -> id lookups, or None if `char_to_ix` must be used """
+        return None
+
     def char_to_ix(self, char):
         raise NotImplementedError()
 
@@ -100,6 +105,9 @@ class LearnedCharEmbedder(CharEmbedder):
     def char_to_ix(self, char):
         return self._char_to_ix.get(char, 1)
 
+    def get_char_table(self):
+        return CharIdTable(self._char_to_ix, 1)
+
     def embed(self, is_train, *char_ix):
         if self.force_cpu:
             with tf.device('/cpu:0'):
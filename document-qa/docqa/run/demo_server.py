@@ -2,23 +2,31 @@ import argparse
 import bottle
 import numpy as np
 import os
+import queue
 import re
 import sys
+import threading
+import time
 import tensorflow as tf
+from collections import deque
 
 from docqa.data_processing.document_splitter import Truncate, TopTfIdf
+from docqa.data_processing.fast_tokenizer import TOKENIZERS, get_tokenizer
 from docqa.data_processing.qa_training_data import ParagraphAndQuestion, ParagraphAndQuestionSpec
-from docqa.data_processing.text_utils import NltkAndPunctTokenizer, NltkPlusStopWords
+from docqa.data_processing.text_utils import NltkPlusStopWords
+from docqa.data_processing.tokenizer_cache import CachedTokenizer
 from docqa.doc_qa_models import ParagraphQuestionModel
 from docqa.model_dir import ModelDir
 from docqa.utils import flatten_iterable, CachingResourceLoader, ResourceLoader
 
-from util import logits_to_probs
+from util import logits_to_probs, tokenize_document, get_paragraph_spans
 
 OPTS = None
 
 MAX_SPAN_LENGTH = 8
 BEAM_SIZE = 10
+DEFAULT_BATCH_WINDOW_MS = 5.0
+DEFAULT_MAX_BATCH_SIZE = 16
 
 def parse_args():
   parser = argparse.ArgumentParser('Start a demo server for QA over a single document.')
@@ -28,22 +36,150 @@ def parse_args():
   parser.add_argument('--debug', '-d', action='store_true', help='Run in debug mode')
   parser.add_argument('--reload-vocab',  action='store_true', 
                       help='Reload word vectors each time (faster startup, higher latency)')
+  parser.add_argument('--word-vec-cache-mb', type=float, default=None,
+                      help='Memory budget for cached binary (.vecs) word vectors (default: unbounded)')
+  parser.add_argument('--batch-window-ms', type=float, default=DEFAULT_BATCH_WINDOW_MS,
+                      help='How long to wait for more queries before running a batch')
+  parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                      help='Run a batch as soon as this many queries are waiting')
+  parser.add_argument('--tokenizer', choices=TOKENIZERS, default='nltk',
+                      help='nltk is the reference, fast-punkt gives the same output faster, '
+                           'fast-regex is the fastest but can split sentences differently')
+  parser.add_argument('--tokenizer-cache', metavar='DIR', default=None,
+                      help='Directory to also cache tokenized documents in (default: memory only)')
   if len(sys.argv) == 1:
     parser.print_help()
     sys.exit(1)
   return parser.parse_args()
 
+class ThreadedWSGIRefServer(bottle.ServerAdapter):
+  """bottle's default wsgiref server, but with a thread per request so queries
+  can wait on the scheduler concurrently."""
+
+  def run(self, handler):
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+    class ThreadedServer(ThreadingMixIn, WSGIServer):
+      daemon_threads = True
+
+    quiet = self.quiet
+
+    class Handler(WSGIRequestHandler):
+      def log_request(self, *args, **kwargs):
+        if not quiet:
+          return WSGIRequestHandler.log_request(self, *args, **kwargs)
+
+    server = make_server(self.host, self.port, handler, ThreadedServer, Handler)
+    server.serve_forever()
+
+
+class BatchRequest(object):
+  def __init__(self, example):
+    self.example = example
+    self.enqueue_time = time.perf_counter()
+    self.done = threading.Event()
+    self.output = None
+    self.error = None
+    self.queue_time = None
+    self.inference_time = None
+
+
+class MicroBatchScheduler(object):
+  """Collects queries that arrive within `window` seconds of the first one, or
+  until `max_batch_size` are waiting, into a single call to `run_batch`.
+
+  `run_batch` is only ever called from the scheduler's own thread, so it can
+  freely use the session and update the model's vocabulary.
+  """
+
+  def __init__(self, run_batch, window, max_batch_size, n_stats=1000):
+    self.run_batch = run_batch
+    self.window = window
+    self.max_batch_size = max_batch_size
+    self._queue = queue.Queue()
+    self._stats_lock = threading.Lock()
+    self._queue_times = deque(maxlen=n_stats)
+    self._inference_times = deque(maxlen=n_stats)
+    self._batch_sizes = deque(maxlen=n_stats)
+    self._thread = threading.Thread(target=self._loop, daemon=True)
+    self._thread.start()
+
+  def submit(self, example):
+    """Block until `example` has been run, and return its `BatchRequest`."""
+    request = BatchRequest(example)
+    self._queue.put(request)
+    request.done.wait()
+    if request.error is not None:
+      raise request.error
+    return request
+
+  def _collect(self):
+    batch = [self._queue.get()]
+    deadline = time.perf_counter() + self.window
+    while len(batch) < self.max_batch_size:
+      timeout = deadline - time.perf_counter()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(self._queue.get(timeout=timeout))
+      except queue.Empty:
+        break
+    return batch
+
+  def _loop(self):
+    while True:
+      batch = self._collect()
+      t0 = time.perf_counter()
+      outputs, error = None, None
+      try:
+        outputs = self.run_batch([x.example for x in batch])
+      except Exception as e:
+        error = e
+      t1 = time.perf_counter()
+      for i, request in enumerate(batch):
+        request.queue_time = t0 - request.enqueue_time
+        request.inference_time = t1 - t0
+        if error is None:
+          request.output = outputs[i]
+        else:
+          request.error = error
+        request.done.set()
+      with self._stats_lock:
+        self._queue_times.extend(x.queue_time for x in batch)
+        self._inference_times.extend(x.inference_time for x in batch)
+        self._batch_sizes.append(len(batch))
+
+  def get_stats(self):
+    """Latency percentiles (in ms) over the most recent requests"""
+    with self._stats_lock:
+      queue_times = np.array(self._queue_times) * 1000
+      inference_times = np.array(self._inference_times) * 1000
+      batch_sizes = np.array(self._batch_sizes)
+    stats = {'n_requests': len(queue_times), 'n_batches': len(batch_sizes)}
+    if len(queue_times) == 0:
+      return stats
+    stats['mean_batch_size'] = float(batch_sizes.mean())
+    for name, times in [('queue_ms', queue_times), ('inference_ms', inference_times),
+                        ('total_ms', queue_times + inference_times)]:
+      stats[name] = {'p%d' % p: float(np.percentile(times, p)) for p in [50, 90, 99]}
+    return stats
+
+
 def main():
   print('Starting...')
   model_dir = ModelDir(OPTS.model)
   model = model_dir.get_model()
-  tokenizer = NltkAndPunctTokenizer()
+  # Cache tokenized documents so re-submitting a document with a new question is fast
+  tokenizer = get_tokenizer(OPTS.tokenizer)
+  tokenizer = CachedTokenizer(tokenizer, OPTS.tokenizer_cache)
   if not isinstance(model, ParagraphQuestionModel):
       raise ValueError("This script is built to work for ParagraphQuestionModel models only")
   if OPTS.reload_vocab:
     loader = ResourceLoader()
   else:
-    loader = CachingResourceLoader()
+    max_bytes = None if OPTS.word_vec_cache_mb is None else int(OPTS.word_vec_cache_mb * 2**20)
+    loader = CachingResourceLoader(max_bytes=max_bytes)
   print('Loading word vectors...')
   model.set_input_spec(ParagraphAndQuestionSpec(batch_size=None), set([',']),
                        word_vec_loader=loader, allow_update=True)
@@ -51,51 +187,71 @@ def main():
   sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
   with sess.as_default():
     prediction = model.get_prediction()
-    # Take 0-th here because we know we only truncate to one paragraph
-    start_logits_tf = prediction.start_logits[0]
-    end_logits_tf = prediction.end_logits[0]
-    none_logit_tf = prediction.none_logit[0]
+    start_logits_tf = prediction.start_logits
+    end_logits_tf = prediction.end_logits
+    none_logit_tf = prediction.none_logit
     #best_spans_tf, conf_tf = prediction.get_best_span(MAX_SPAN_LENGTH)
   model_dir.restore_checkpoint(sess)
   splitter = Truncate(400)  # NOTE: we truncate past 400 tokens
   selector = TopTfIdf(NltkPlusStopWords(True), n_to_select=5)
+
+  def run_batch(data):
+    vocab = set()
+    for ex in data:
+      vocab.update(ex.question)
+      vocab.update(ex.get_context())
+    model.word_embed.update(loader, vocab)
+    encoded = model.encode(data, is_train=False)
+    start_logits, end_logits, none_logit = sess.run(
+        [start_logits_tf, end_logits_tf, none_logit_tf], feed_dict=encoded)
+    # Slice off the padding so each query sees exactly its own logits
+    return [(start_logits[i, :ex.n_context_words], end_logits[i, :ex.n_context_words],
+             none_logit[i]) for i, ex in enumerate(data)]
+
+  scheduler = MicroBatchScheduler(run_batch, OPTS.batch_window_ms / 1000.0,
+                                  OPTS.max_batch_size)
   app = bottle.Bottle()
 
   @app.route('/')
   def index():
     return bottle.template('index')
 
+  @app.route('/stats')
+  def stats():
+    stats = scheduler.get_stats()
+    if isinstance(loader, CachingResourceLoader):
+      stats['word_vectors'] = loader.get_stats()
+    return stats
+
   @app.route('/post_query', method='post')
   def post_query():
     document_raw = bottle.request.forms.getunicode('document').strip()
     question_raw = bottle.request.forms.getunicode('question').strip()
-    document = re.split("\s*\n\s*", document_raw)
     question = tokenizer.tokenize_paragraph_flat(question_raw)
-    doc_toks = [tokenizer.tokenize_paragraph(p) for p in document]
+    doc_toks, doc_spans = tokenize_document(tokenizer, document_raw)
     split_doc = splitter.split(doc_toks)
     context = selector.prune(question, split_doc)
     if model.preprocessor is not None:
       context = [model.preprocessor.encode_text(question, x) for x in context]
+      token_spans = None
     else:
+      token_spans = get_paragraph_spans(doc_spans, context[0])
       context = [flatten_iterable(x.text) for x in context]
-    vocab = set(question)
-    for txt in context:
-      vocab.update(txt)
-    data = [ParagraphAndQuestion(x, question, None, "user-question%d"%i)
-            for i, x in enumerate(context)]
-    model.word_embed.update(loader, vocab)
-    encoded = model.encode(data, is_train=False)
-    start_logits, end_logits, none_logit = sess.run(
-        [start_logits_tf, end_logits_tf, none_logit_tf], feed_dict=encoded)
+    # Take 0-th here because we know we only truncate to one paragraph
+    request = scheduler.submit(ParagraphAndQuestion(context[0], question, None, "user-question0"))
+    start_logits, end_logits, none_logit = request.output
     beam, p_na = logits_to_probs(
         document_raw, context[0], start_logits, end_logits, none_logit,
-        beam_size=BEAM_SIZE)
+        beam_size=BEAM_SIZE, token_spans=token_spans)
+    bottle.response.set_header('X-Queue-Time-Ms', '%.2f' % (request.queue_time * 1000))
+    bottle.response.set_header('X-Inference-Time-Ms', '%.2f' % (request.inference_time * 1000))
     return bottle.template('results', document=document_raw, question=question_raw, 
                            beam=beam, p_na=p_na)
 
   cur_dir = os.path.abspath(os.path.dirname(__file__))
   bottle.TEMPLATE_PATH.insert(0, os.path.join(cur_dir, 'views'))
-  bottle.run(app, host=OPTS.hostname, port=OPTS.port, debug=OPTS.debug)
+  bottle.run(app, server=ThreadedWSGIRefServer, host=OPTS.hostname, port=OPTS.port,
+             debug=OPTS.debug)
 
 if __name__ == '__main__':
   OPTS = parse_args()
@@ -5,12 +5,17 @@ import numpy as np
 import os
 import re
 import sys
+import time
+from itertools import islice
+from multiprocessing import Pool
 import tensorflow as tf
 from tqdm import tqdm
 
 from docqa.data_processing.document_splitter import Truncate, TopTfIdf
+from docqa.data_processing.fast_tokenizer import TOKENIZERS, get_tokenizer
 from docqa.data_processing.qa_training_data import ParagraphAndQuestion, ParagraphAndQuestionSpec
-from docqa.data_processing.text_utils import NltkAndPunctTokenizer, NltkPlusStopWords
+from docqa.data_processing.text_utils import NltkPlusStopWords
+from docqa.data_processing.tokenizer_cache import CachedTokenizer
 from docqa.doc_qa_models import ParagraphQuestionModel
 from docqa.model_dir import ModelDir
 from docqa.utils import flatten_iterable, CachingResourceLoader, ResourceLoader
@@ -20,6 +25,7 @@ from util import *
 OPTS = None
 
 DEFAULT_BEAM_SIZE = 100
+DEFAULT_SORT_WINDOW = 20
 
 def parse_args():
   parser = argparse.ArgumentParser('Generate predictions for a batch of inputs.')
@@ -28,42 +34,188 @@ def parse_args():
   parser.add_argument('output_file', metavar='output.jsonl')
   parser.add_argument('--beam-size', '-k', type=int, default=DEFAULT_BEAM_SIZE,
                       help='Beam size')
+  parser.add_argument('--max-span-len', type=int, default=None,
+                      help='Only consider answers of at most this many tokens')
   parser.add_argument('--no-vec', action='store_true')
+  parser.add_argument('--batch-size', '-b', type=int, default=None,
+                      help='Run this many examples per session call (default: one per line)')
+  parser.add_argument('--sort-window', type=int, default=DEFAULT_SORT_WINDOW,
+                      help='Number of batches to read, sort by context length and write at once')
+  parser.add_argument('--num-workers', '-j', type=int, default=1,
+                      help='Number of processes used to tokenize and select paragraphs')
+  parser.add_argument('--resume', action='store_true',
+                      help='Append to output.jsonl, skipping input lines it already has')
+  parser.add_argument('--tokenizer', choices=TOKENIZERS, default='nltk',
+                      help='nltk is the reference, fast-punkt gives the same output faster, '
+                           'fast-regex is the fastest but can split sentences differently')
+  parser.add_argument('--tokenizer-cache', metavar='DIR',
+                      help='Directory to cache tokenized documents in, shared with the workers and other runs')
   if len(sys.argv) == 1:
     parser.print_help()
     sys.exit(1)
   return parser.parse_args()
 
-def read_input_data(model):
-  data = []
-  vocab = set()
-  tokenizer = NltkAndPunctTokenizer()
-  splitter = Truncate(400)  # NOTE: we truncate past 400 tokens
-  selector = TopTfIdf(NltkPlusStopWords(True), n_to_select=5)
-  with open(OPTS.input_file) as f:
+class Preprocessor(object):
+  """Tokenizes, truncates and TF-IDF prunes single input lines."""
+
+  def __init__(self, text_preprocessor, tokenizer_cache=None, tokenizer='nltk'):
+    self.tokenizer = get_tokenizer(tokenizer)
+    if tokenizer_cache:
+      self.tokenizer = CachedTokenizer(self.tokenizer, tokenizer_cache)
+    self.splitter = Truncate(400)  # NOTE: we truncate past 400 tokens
+    self.selector = TopTfIdf(NltkPlusStopWords(True), n_to_select=5)
+    self.text_preprocessor = text_preprocessor
+
+  def __call__(self, item):
+    line_ix, line = item
+    try:
+      document_raw, question_raw = line.strip().split('\t')
+    except ValueError:
+      raise ValueError('Error at line %d: %s' % (line_ix, line.strip()))
+    tokenizer = self.tokenizer
+    question = tokenizer.tokenize_paragraph_flat(question_raw)
+    doc_toks, doc_spans = tokenize_document(tokenizer, document_raw)
+    split_doc = self.splitter.split(doc_toks)
+    context = self.selector.prune(question, split_doc)
+    if self.text_preprocessor is not None:
+      context = [self.text_preprocessor.encode_text(question, x) for x in context]
+      # The preprocessor can add tokens, so we have to search for the answer text
+      token_spans = None
+    else:
+      # We know we only truncate to one paragraph
+      token_spans = get_paragraph_spans(doc_spans, context[0])
+      context = [flatten_iterable(x.text) for x in context]
+    ex = [ParagraphAndQuestion(x, question, None, "user-question%d"%i)
+          for i, x in enumerate(context)]
+    return (document_raw, question_raw, context, ex, token_spans)
+
+_WORKER_PREPROCESSOR = None
+
+def _init_worker(text_preprocessor, tokenizer_cache, tokenizer):
+  global _WORKER_PREPROCESSOR
+  _WORKER_PREPROCESSOR = Preprocessor(text_preprocessor, tokenizer_cache, tokenizer)
+
+def _preprocess_in_worker(item):
+  return _WORKER_PREPROCESSOR(item)
+
+def iter_input_lines(input_file, skip):
+  with open(input_file) as f:
     for i, line in enumerate(f):
-      try:
-        document_raw, question_raw = line.strip().split('\t')
-      except ValueError as e:
-        print(line.strip())
-        print('Error at line %d' % i)
-        raise e
-      document = re.split("\s*\n\s*", document_raw)
-      question = tokenizer.tokenize_paragraph_flat(question_raw)
-      doc_toks = [tokenizer.tokenize_paragraph(p) for p in document]
-      split_doc = splitter.split(doc_toks)
-      context = selector.prune(question, split_doc)
-      if model.preprocessor is not None:
-        context = [model.preprocessor.encode_text(question, x) for x in context]
-      else:
-        context = [flatten_iterable(x.text) for x in context]
-      vocab.update(question)
-      for txt in context:
-        vocab.update(txt)
-      ex = [ParagraphAndQuestion(x, question, None, "user-question%d"%i)
-            for i, x in enumerate(context)]
-      data.append((document_raw, question_raw, context, ex))
-  return data, vocab
+      if i >= skip:
+        yield i, line
+
+def iter_windows(lines, window_size, text_preprocessor, pool):
+  """Yield lists of up to `window_size` preprocessed lines, in input order.
+
+  With a pool, the next window is preprocessed by the workers while the
+  caller runs the model on the current one. At most two windows are ever in
+  memory, so the reader blocks (backpressure) until the model catches up.
+  """
+  next_chunk = lambda: list(islice(lines, window_size))
+  if pool is None:
+    preprocess = Preprocessor(text_preprocessor, OPTS.tokenizer_cache, OPTS.tokenizer)
+    for chunk in iter(next_chunk, []):
+      yield [preprocess(x) for x in chunk]
+    return
+  chunksize = max(1, window_size // (OPTS.num_workers * 4))
+  pending = None
+  for chunk in iter(next_chunk, []):
+    job = pool.map_async(_preprocess_in_worker, chunk, chunksize=chunksize)
+    if pending is not None:
+      yield pending.get()
+    pending = job
+  if pending is not None:
+    yield pending.get()
+
+def get_window_vocab(window):
+  vocab = set()
+  for _, _, context, ex, _ in window:
+    vocab.update(ex[0].question)
+    for txt in context:
+      vocab.update(txt)
+  return vocab
+
+def count_written_lines(output_file):
+  """Number of complete lines in `output_file`, dropping any partial last line."""
+  if not os.path.exists(output_file):
+    return 0
+  n_lines = 0
+  complete_bytes = 0
+  with open(output_file, 'rb') as f:
+    for line in f:
+      if not line.endswith(b'\n'):
+        break
+      n_lines += 1
+      complete_bytes += len(line)
+  with open(output_file, 'r+b') as f:
+    f.truncate(complete_bytes)
+  return n_lines
+
+def make_output(doc_raw, q_raw, beam, p_na, context_rep, m1, m2):
+  inputs = [context_rep, m1, m2]
+  vec = np.concatenate([np.amax(x, axis=0) for x in inputs] +
+                       [np.amin(x, axis=0) for x in inputs] +
+                       [np.mean(x, axis=0) for x in inputs])
+  #span_logits = np.add.outer(start_logits, end_logits)
+  #all_logits = np.concatenate((np.array([none_logit]), span_logits.flatten()))
+  #log_partition = scipy.special.logsumexp(all_logits)
+  #vec = np.concatenate([
+  #    np.amax(context_rep, axis=0),
+  #    np.amin(context_rep, axis=0),
+  #    np.mean(context_rep, axis=0),
+  #    [np.amax(start_logits), scipy.special.logsumexp(start_logits),
+  #     np.amax(end_logits), scipy.special.logsumexp(end_logits),
+  #     none_logit, log_partition] 
+  #])
+  out_obj = {'paragraph': doc_raw, 'question': q_raw,
+             'beam': beam, 'p_na': p_na}
+  if not OPTS.no_vec:
+    out_obj['vec'] = vec.tolist()
+  return out_obj
+
+def run_single(sess, model, fetches, window):
+  results = []
+  for doc_raw, q_raw, context, ex, token_spans in window:
+    encoded = model.encode(ex, is_train=False)
+    start_logits, end_logits, none_logit, context_rep, m1, m2 = sess.run(
+        fetches, feed_dict=encoded)
+    beam, p_na = logits_to_probs(
+        doc_raw, context[0], start_logits, end_logits, none_logit,
+        beam_size=OPTS.beam_size, max_span_len=OPTS.max_span_len,
+        token_spans=token_spans)
+    results.append(make_output(doc_raw, q_raw, beam, p_na, context_rep, m1, m2))
+  return results
+
+def run_batched(sess, model, fetches, window):
+  """Run `OPTS.batch_size` lines per session call.
+
+  Lines in the window are sorted by context length to reduce padding, and
+  the outputs are returned in input order.  Each output is sliced back to its
+  own context length, so the padded positions never reach the span decoder
+  or the pooled `vec`.
+  """
+  order = sorted(range(len(window)), key=lambda i: len(window[i][2][0]))
+  results = [None] * len(window)
+  for batch_start in range(0, len(order), OPTS.batch_size):
+    batch_ixs = order[batch_start:batch_start + OPTS.batch_size]
+    # We know we only truncate to one paragraph, so take the 0-th example of each line
+    batch = [window[i][3][0] for i in batch_ixs]
+    encoded = model.encode(batch, is_train=False)
+    start_logits, end_logits, none_logit, context_rep, m1, m2 = sess.run(
+        fetches, feed_dict=encoded)
+    beams = logits_to_probs_batch(
+        [window[i][0] for i in batch_ixs], [window[i][2][0] for i in batch_ixs],
+        start_logits, end_logits, none_logit,
+        beam_size=OPTS.beam_size, max_span_len=OPTS.max_span_len,
+        token_spans=[window[i][4] for i in batch_ixs])
+    for batch_ix, i in enumerate(batch_ixs):
+      doc_raw, q_raw, context, _, _ = window[i]
+      n = len(context[0])
+      beam, p_na = beams[batch_ix]
+      results[i] = make_output(
+          doc_raw, q_raw, beam, p_na, context_rep[batch_ix, :n],
+          m1[batch_ix, :n], m2[batch_ix, :n])
+  return results
 
 def main():
   print('Starting...')
@@ -71,54 +223,62 @@ def main():
   model = model_dir.get_model()
   if not isinstance(model, ParagraphQuestionModel):
     raise ValueError("This script is built to work for ParagraphQuestionModel models only")
-  input_data, vocab = read_input_data(model)
 
+  # The vocabulary is not known up front, so we update the embedding matrix for each window of
+  # input. The loader reads text vectors once, binary (.vecs) vectors only for the words it needs
+  loader = CachingResourceLoader()
   print('Loading word vectors...')
-  model.set_input_spec(ParagraphAndQuestionSpec(batch_size=None), vocab)
+  model.set_input_spec(ParagraphAndQuestionSpec(batch_size=None), set([',']),
+                       word_vec_loader=loader, allow_update=True)
 
   print('Starting Tensorflow session...')
   sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True))
   with sess.as_default():
     prediction = model.get_prediction()
-    # Take 0-th here because we know we only truncate to one paragraph
-    start_logits_tf = prediction.start_logits[0]
-    end_logits_tf = prediction.end_logits[0]
-    none_logit_tf = prediction.none_logit[0]
-    context_rep_tf = model.context_rep[0]
-    m1_tf = model.predictor.m1[0]
-    m2_tf = model.predictor.m2[0]
+    fetches = [prediction.start_logits, prediction.end_logits,
+               prediction.none_logit, model.context_rep,
+               model.predictor.m1, model.predictor.m2]
+    if not OPTS.batch_size:
+      # Take 0-th here because we know we only truncate to one paragraph
+      fetches = [x[0] for x in fetches]
   model_dir.restore_checkpoint(sess)
 
-  with open(OPTS.output_file, 'w') as f:
-    for doc_raw, q_raw, context, ex in tqdm(input_data):
-      encoded = model.encode(ex, is_train=False)
-      start_logits, end_logits, none_logit, context_rep, m1, m2 = sess.run(
-          [start_logits_tf, end_logits_tf, none_logit_tf, context_rep_tf,
-           m1_tf, m2_tf],
-          feed_dict=encoded)
-      beam, p_na = logits_to_probs(
-          doc_raw, context[0], start_logits, end_logits, none_logit,
-          beam_size=OPTS.beam_size)
-      inputs = [context_rep, m1, m2]
-      vec = np.concatenate([np.amax(x, axis=0) for x in inputs] +
-                           [np.amin(x, axis=0) for x in inputs] +
-                           [np.mean(x, axis=0) for x in inputs])
-      #span_logits = np.add.outer(start_logits, end_logits)
-      #all_logits = np.concatenate((np.array([none_logit]), span_logits.flatten()))
-      #log_partition = scipy.special.logsumexp(all_logits)
-      #vec = np.concatenate([
-      #    np.amax(context_rep, axis=0),
-      #    np.amin(context_rep, axis=0),
-      #    np.mean(context_rep, axis=0),
-      #    [np.amax(start_logits), scipy.special.logsumexp(start_logits),
-      #     np.amax(end_logits), scipy.special.logsumexp(end_logits),
-      #     none_logit, log_partition] 
-      #])
-      out_obj = {'paragraph': doc_raw, 'question': q_raw,
-                 'beam': beam, 'p_na': p_na}
-      if not OPTS.no_vec:
-        out_obj['vec'] = vec.tolist()
-      print(json.dumps(out_obj), file=f)
+  if OPTS.resume:
+    n_done = count_written_lines(OPTS.output_file)
+    print('Resuming after %d completed lines' % n_done)
+  else:
+    n_done = 0
+  window_size = (OPTS.batch_size or 1) * OPTS.sort_window
+  lines = iter_input_lines(OPTS.input_file, n_done)
+  if OPTS.num_workers > 1:
+    pool = Pool(OPTS.num_workers, initializer=_init_worker,
+                initargs=[model.preprocessor, OPTS.tokenizer_cache, OPTS.tokenizer])
+  else:
+    pool = None
+
+  n_lines = 0
+  t0 = time.perf_counter()
+  pbar = tqdm(initial=n_done)
+  with open(OPTS.output_file, 'a' if OPTS.resume else 'w') as f:
+    for window in iter_windows(lines, window_size, model.preprocessor, pool):
+      model.word_embed.update(loader, get_window_vocab(window))
+      if OPTS.batch_size:
+        results = run_batched(sess, model, fetches, window)
+      else:
+        results = run_single(sess, model, fetches, window)
+      # Lines are written in input order, so `--resume` can continue after any prefix of complete
+      # lines, `count_written_lines` drops a partial last line if we are interrupted mid-write
+      f.write(''.join(json.dumps(out_obj) + '\n' for out_obj in results))
+      f.flush()
+      n_lines += len(window)
+      pbar.update(len(window))
+  pbar.close()
+  if pool is not None:
+    pool.close()
+    pool.join()
+  elapsed = time.perf_counter() - t0
+  print('Predicted %d lines in %.1f seconds (%.2f lines/sec)' % (
+      n_lines, elapsed, n_lines / max(elapsed, 1e-9)))
 
 if __name__ == '__main__':
   OPTS = parse_args()
@@ -10,9 +10,11 @@ from tqdm import tqdm
 
 from docqa.data_processing.qa_training_data import ParagraphAndQuestion, ParagraphAndQuestionSpec
 from docqa.data_processing.text_utils import NltkAndPunctTokenizer, NltkPlusStopWords
+from docqa.data_processing.tokenizer_cache import CachedTokenizer
 from docqa.doc_qa_models import ParagraphQuestionModel
 from docqa.elmo.lm_qa_models import ElmoQaModel
 from docqa.model_dir import ModelDir
+from docqa.shared_context import SharedContextRunner
 from docqa.squad.build_squad_dataset import parse_squad_data
 from docqa.utils import flatten_iterable, CachingResourceLoader, ResourceLoader
 
@@ -29,6 +31,10 @@ def parse_args():
     parser.add_argument('output_file', metavar='pred.json')
     parser.add_argument('--na-prob-file', metavar='na_prob.json')
     parser.add_argument('--always-answer-file', metavar='pred_alwaysAnswer.json')
+    parser.add_argument('--share-contexts', action='store_true',
+                        help='Encode each paragraph once and re-use it for all its questions')
+    parser.add_argument('--tokenizer-cache', metavar='DIR',
+                        help='Directory to cache tokenized contexts in, shared with other runs')
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(1)
@@ -38,6 +44,8 @@ def read_input_data(model):
   data = []
   vocab = set()
   tokenizer = NltkAndPunctTokenizer()
+  if OPTS.tokenizer_cache:
+    tokenizer = CachedTokenizer(tokenizer, OPTS.tokenizer_cache)
   with open(OPTS.input_file) as f:
     json_data = json.load(f)
   for doc in json_data['data']:
@@ -45,13 +53,16 @@ def read_input_data(model):
       context = tokenizer.tokenize_with_inverse(paragraph['context'])
       if model.preprocessor is not None:
         context = model.preprocessor.encode_text(question, context)
+        token_spans = None
+      else:
+        token_spans = context.spans
       context = context.get_context()
       vocab.update(context)
       for qa in paragraph['qas']:
         question = tokenizer.tokenize_sentence(qa['question'])
         vocab.update(question)
         ex = [ParagraphAndQuestion(context, question, None, qa['id'])]
-        data.append((paragraph['context'], context, ex))
+        data.append((paragraph['context'], context, token_spans, ex))
   return data, sorted(list(vocab))
 
 def main():
@@ -99,20 +110,27 @@ def run_elmo_model(model_dir, model):
     pred_obj = {}
     na_prob_obj = {}
     pred_always_ans_obj = {}
-    for context_raw, context_toks, ex in tqdm(input_data):
-        encoded = model.encode(ex, is_train=False)
-        start_logits, end_logits, none_logit = sess.run(
-                [start_logits_tf, end_logits_tf, none_logit_tf],
-                feed_dict=encoded)
+    runner = SharedContextRunner(model) if OPTS.share_contexts else None
+    for context_raw, context_toks, token_spans, ex in tqdm(input_data):
+        if runner is not None:
+            start_logits, end_logits, none_logit = runner.run(
+                    sess, [start_logits_tf, end_logits_tf, none_logit_tf], ex)
+        else:
+            encoded = model.encode(ex, is_train=False)
+            start_logits, end_logits, none_logit = sess.run(
+                    [start_logits_tf, end_logits_tf, none_logit_tf],
+                    feed_dict=encoded)
         beam, p_na = logits_to_probs(
                 context_raw, context_toks, start_logits, end_logits, none_logit,
-                beam_size=2)
+                beam_size=2, token_spans=token_spans)
         ans = beam[0][0]
         non_empty_ans = [x[0] for x in beam if x[0]][0]
         qid = ex[0].question_id
         pred_obj[qid] = ans
         na_prob_obj[qid] = p_na
         pred_always_ans_obj[qid] = non_empty_ans
+    if runner is not None:
+        runner.print_stats()
     with open(OPTS.output_file, 'w') as f:
         json.dump(pred_obj, f)
     if OPTS.na_prob_file:
@@ -142,20 +160,27 @@ def run_paragraph_model(model_dir, model):
   pred_obj = {}
   na_prob_obj = {}
   pred_always_ans_obj = {}
-  for context_raw, context_toks, ex in tqdm(input_data):
-    encoded = model.encode(ex, is_train=False)
-    start_logits, end_logits, none_logit = sess.run(
-        [start_logits_tf, end_logits_tf, none_logit_tf],
-        feed_dict=encoded)
+  runner = SharedContextRunner(model) if OPTS.share_contexts else None
+  for context_raw, context_toks, token_spans, ex in tqdm(input_data):
+    if runner is not None:
+      start_logits, end_logits, none_logit = runner.run(
+          sess, [start_logits_tf, end_logits_tf, none_logit_tf], ex)
+    else:
+      encoded = model.encode(ex, is_train=False)
+      start_logits, end_logits, none_logit = sess.run(
+          [start_logits_tf, end_logits_tf, none_logit_tf],
+          feed_dict=encoded)
     beam, p_na = logits_to_probs(
         context_raw, context_toks, start_logits, end_logits, none_logit,
-        beam_size=2)
+        beam_size=2, token_spans=token_spans)
     ans = beam[0][0]
     non_empty_ans = [x[0] for x in beam if x[0]][0]
     qid = ex[0].question_id
     pred_obj[qid] = ans
     na_prob_obj[qid] = p_na
     pred_always_ans_obj[qid] = non_empty_ans
+  if runner is not None:
+    runner.print_stats()
   with open(OPTS.output_file, 'w') as f:
     json.dump(pred_obj, f)
   if OPTS.na_prob_file:
@@ -1,5 +1,8 @@
+import re
+
 import numpy as np
-import scipy
+
+from docqa.data_processing.span_data import top_k_spans
 
 def get_preimages(tok):
   """Get possible pre-images of token.
@@ -30,27 +33,89 @@ def make_tok_to_char(document, tokens):
   tok_to_char.append(i)  # After the last token
   return tok_to_char
 
+def spans_to_tok_to_char(token_spans):
+  """Same output as `make_tok_to_char`, but read off the tokenizer's char spans."""
+  if len(token_spans) == 0:
+    return [0]
+  return token_spans[:, 0].tolist() + [int(token_spans[-1, 1])]
+
+def tokenize_document(tokenizer, document):
+  """Tokenize the newline-separated paragraphs of `document`.
+
+  Returns the tokenized paragraphs and a (n_tokens, 2) array with the char
+  span of each token in `document`, or None if the tokenizer could not align
+  its tokens with the text.
+  """
+  bounds = []
+  on_char = 0
+  # Same paragraphs as re.split(r"\s*\n\s*", document), but we need their offsets
+  for sep in re.finditer(r"\s*\n\s*", document):
+    bounds.append((on_char, sep.start()))
+    on_char = sep.end()
+  bounds.append((on_char, len(document)))
+  doc_toks = []
+  all_spans = []
+  try:
+    for start, end in bounds:
+      para = tokenizer.tokenize_with_inverse(document[start:end])
+      doc_toks.append(para.text)
+      all_spans.append(para.spans + start)
+  except ValueError:
+    doc_toks = [tokenizer.tokenize_paragraph(document[start:end]) for start, end in bounds]
+    return doc_toks, None
+  return doc_toks, np.concatenate(all_spans, axis=0)
+
+def get_paragraph_spans(token_spans, paragraph):
+  """Char spans for the tokens of an `ExtractedParagraph`, if we know them."""
+  if token_spans is None:
+    return None
+  spans = token_spans[paragraph.start:paragraph.end]
+  if len(spans) != paragraph.n_context_words:
+    return None  # Not a contiguous run of document tokens
+  return spans
+
 def logits_to_probs(document, tokens, start_logits, end_logits, none_logit,
-                    beam_size=None):
-  span_logits = np.add.outer(start_logits, end_logits)
-  tok_to_char = make_tok_to_char(document, tokens)
-  all_logits = np.concatenate((np.array([none_logit]), span_logits.flatten()))
-  log_partition = scipy.special.logsumexp(all_logits)
-  all_probs_np = np.exp(all_logits - log_partition)
-  all_probs = all_probs_np.tolist()  # for JSON serializability later
-  p_na = all_probs[0]
-  beam = []
-  sorted_inds = np.argsort(-all_probs_np)
-  for ind in sorted_inds:
-    cur_prob = all_probs[ind]
-    if beam_size and len(beam) == beam_size: break
-    if ind == 0:
-      beam.append(('', cur_prob))
+                    beam_size=None, max_span_len=None, token_spans=None):
+  return logits_to_probs_batch(
+      [document], [tokens], [start_logits], [end_logits], [none_logit],
+      beam_size=beam_size, max_span_len=max_span_len,
+      token_spans=[token_spans])[0]
+
+def logits_to_probs_batch(documents, tokens, start_logits, end_logits,
+                          none_logits, beam_size=None, max_span_len=None,
+                          token_spans=None):
+  """Top `beam_size` answers and the no-answer probability for each example.
+
+  Spans are only considered if they start at or before their end and are at
+  most `max_span_len` tokens long, and probabilities are normalized over those
+  spans plus the no-answer option.  Only the first `len(tokens[i])` logits of
+  each example are used, so padded batch outputs can be passed in directly.
+  Answer text is found using `token_spans[i]`, the char span of each token,
+  if it is not None, otherwise by searching for the tokens in the document.
+  A `beam_size` or `max_span_len` of 0 or None means no limit.
+  """
+  beam_size = beam_size or None
+  max_span_len = max_span_len or None
+  decoded = top_k_spans(start_logits, end_logits, [len(t) for t in tokens],
+                        beam_size, none_logits, max_span_len)
+  if token_spans is None:
+    token_spans = [None] * len(documents)
+  results = []
+  for document, toks, doc_spans, none_logit, (log_partition, spans, log_probs) in zip(
+      documents, tokens, token_spans, none_logits, decoded):
+    if doc_spans is not None:
+      tok_to_char = spans_to_tok_to_char(doc_spans)
     else:
-      i, j = np.unravel_index(ind - 1, span_logits.shape)
-      if i > j: continue
-      start_char = tok_to_char[i]
-      end_char = tok_to_char[j+1]
-      phrase = document[start_char:end_char].strip()
-      beam.append((phrase, cur_prob))
-  return beam, p_na
+      tok_to_char = make_tok_to_char(document, toks)
+    p_na = float(np.exp(none_logit - log_partition))
+    beam = []
+    for (i, j), cur_prob in zip(spans, np.exp(log_probs).tolist()):
+      if i < 0:
+        beam.append(('', cur_prob))
+      else:
+        start_char = tok_to_char[i]
+        end_char = tok_to_char[j+1]
+        phrase = document[start_char:end_char].strip()
+        beam.append((phrase, cur_prob))
+    results.append((beam, p_na))
+  return results
@@ -0,0 +1,71 @@
+import argparse
+import time
+from os import walk
+from os.path import join, getsize
+
+from docqa import config
+from docqa.data_processing.text_utils import NltkAndPunctTokenizer, double_quote_re, post_split_tokens
+
+"""
+Time `NltkAndPunctTokenizer.convert_to_spans` on the longest TriviaQA web documents, compared to the
+previous implementation that searched a copy of the remaining text for each quote
+"""
+
+
+def convert_to_spans_sliced(raw_text, sentences):
+    cur_idx = 0
+    all_spans = []
+    for sent in sentences:
+        spans = []
+        for token in sent:
+            if double_quote_re.match(token):
+                span = double_quote_re.search(raw_text[cur_idx:])
+                tmp = cur_idx + span.start()
+                l = span.end() - span.start()
+            else:
+                tmp = raw_text.find(token, cur_idx)
+                l = len(token)
+            if tmp < cur_idx:
+                raise ValueError(token)
+            cur_idx = tmp
+            spans.append((cur_idx, cur_idx + l))
+            cur_idx += l
+        all_spans.append(spans)
+    return all_spans
+
+
+def main():
+    parser = argparse.ArgumentParser("Benchmark convert_to_spans on the longest TriviaQA web documents")
+    parser.add_argument("--source", default=join(config.TRIVIA_QA, "evidence", "web"))
+    parser.add_argument("-n", "--n_docs", type=int, default=20)
+    args = parser.parse_args()
+
+    files = [join(root, x) for root, dirs, filenames in walk(args.source) for x in filenames]
+    files = sorted(files, key=getsize, reverse=True)[:args.n_docs]
+
+    tokenizer = NltkAndPunctTokenizer()
+    docs = []
+    for filename in files:
+        with open(filename, "r") as f:
+            text = f.read()
+        # Treat the whole document as one paragraph, the worst case for the old implementation
+        sentences = [post_split_tokens(tokenizer.word_tokenizer.tokenize(s))
+                     for s in tokenizer.sent_tokenzier.tokenize(text)]
+        docs.append((text, sentences))
+    n_chars = sum(len(text) for text, _ in docs)
+    n_tokens = sum(len(s) for _, sentences in docs for s in sentences)
+    print("%d documents, %d chars, %d tokens" % (len(docs), n_chars, n_tokens))
+
+    for name, fn in [("sliced", convert_to_spans_sliced), ("forward", NltkAndPunctTokenizer.convert_to_spans)]:
+        t0 = time.perf_counter()
+        out = [fn(text, sentences) for text, sentences in docs]
+        elapsed = time.perf_counter() - t0
+        print("%s: %.3f seconds, %.0f tokens/sec" % (name, elapsed, n_tokens / elapsed))
+        if name == "sliced":
+            expected = out
+        elif out != expected:
+            raise RuntimeError("Outputs do not match")
+
+
+if __name__ == "__main__":
+    main()
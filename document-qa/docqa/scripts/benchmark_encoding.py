@@ -0,0 +1,61 @@
+import argparse
+import time
+
+import numpy as np
+
+from docqa.data_processing.qa_training_data import ParagraphAndQuestionDataset, ContextLenKey, QaCorpusLazyStats
+from docqa.dataset import ClusteredBatcher
+from docqa.encoder import DocumentAndQuestionEncoder, SingleSpanAnswerEncoder
+from docqa.nn.embedder import FixedWordEmbedder, LearnedCharEmbedder
+from docqa.squad.squad_data import SquadCorpus, split_docs
+
+
+def time_epoch(encoder, batches):
+    t0 = time.perf_counter()
+    out = [encoder.encode(batch, True) for batch in batches]
+    return time.perf_counter() - t0, out
+
+
+def main():
+    parser = argparse.ArgumentParser("Compare the speed of encoding batches with and without pre-encoding")
+    parser.add_argument("--vecs", default="glove.840B.300d")
+    parser.add_argument("-b", "--batch_size", type=int, default=45)
+    parser.add_argument("-n", "--n_batches", type=int, default=None, help="Only encode this many batches")
+    args = parser.parse_args()
+
+    corpus = SquadCorpus()
+    data = split_docs(corpus.get_dev())
+    dataset = ParagraphAndQuestionDataset(data, ClusteredBatcher(args.batch_size, ContextLenKey(), False, True))
+
+    word_embed = FixedWordEmbedder(vec_name=args.vecs, word_vec_init_scale=0, learn_unk=False)
+    char_embed = LearnedCharEmbedder(word_size_th=14, char_th=50, char_dim=20)
+    char_embed.set_vocab(QaCorpusLazyStats(data))
+    word_embed.init(corpus.get_resource_loader(), dataset.get_vocab())
+    encoder = DocumentAndQuestionEncoder(SingleSpanAnswerEncoder())
+    encoder.init(dataset.get_spec(), True, word_embed, char_embed)
+
+    batches = list(dataset.get_epoch())
+    if args.n_batches is not None:
+        batches = batches[:args.n_batches]
+    print("Encoding %d batches of %d examples" % (len(batches), args.batch_size))
+
+    python_time, expected = time_epoch(encoder, batches)
+    print("Per-word encoding: %.3f seconds" % python_time)
+
+    t0 = time.perf_counter()
+    encoder.pre_encode(data, True)
+    pre_encode_time = time.perf_counter() - t0
+    print("Pre-encoding: %.3f seconds (once)" % pre_encode_time)
+
+    sliced_time, actual = time_epoch(encoder, batches)
+    print("Pre-encoded: %.3f seconds per epoch (%.1fx faster)" % (sliced_time, python_time / sliced_time))
+
+    for a, b in zip(expected, actual):
+        for k, v in a.items():
+            if not np.array_equal(v, b[k]):
+                raise RuntimeError("Pre-encoded batch did not match for %s" % k)
+    print("Outputs are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import json
+import time
+from os import walk
+from os.path import join, exists
+from typing import List
+
+import numpy as np
+
+from docqa import config
+from docqa.data_processing.fast_tokenizer import TOKENIZERS, get_tokenizer
+
+"""
+Measure how often `FastNltkAndPunctTokenizer` agrees with `NltkAndPunctTokenizer` on SQuAD and TriviaQA
+paragraphs, and how many tokens/sec each tokenizer gets through
+"""
+
+
+def squad_paragraphs(source: str) -> List[str]:
+    with open(source, "r") as f:
+        data = json.load(f)["data"]
+    return [para["context"] for article in data for para in article["paragraphs"]]
+
+
+def triviaqa_paragraphs(source: str, n_files: int) -> List[str]:
+    paragraphs = []
+    n = 0
+    for root, dirs, filenames in walk(source):
+        for filename in sorted(filenames):
+            with open(join(root, filename), "r") as f:
+                paragraphs += [x for x in f.read().split("\n") if len(x.strip()) > 0]
+            n += 1
+            if n == n_files:
+                return paragraphs
+    return paragraphs
+
+
+def token_agreement(expected, actual):
+    """ Fraction of (token, span) pairs in `expected` that are also in `actual`, and whether
+    the sentences boundaries are identical """
+    expected_tokens = set(zip(expected.get_context(), map(tuple, expected.spans.tolist())))
+    actual_tokens = set(zip(actual.get_context(), map(tuple, actual.spans.tolist())))
+    n_correct = len(expected_tokens & actual_tokens)
+    return n_correct, max(len(expected_tokens), len(actual_tokens)), \
+        [len(s) for s in expected.text] == [len(s) for s in actual.text]
+
+
+def run(name: str, paragraphs: List[str], tokenizers):
+    print("%s: %d paragraphs" % (name, len(paragraphs)))
+    reference = None
+    for tok_name, tokenizer in tokenizers:
+        t0 = time.perf_counter()
+        out = [tokenizer.tokenize_with_inverse(x) for x in paragraphs]
+        elapsed = time.perf_counter() - t0
+        n_tokens = sum(x.n_tokens for x in out)
+        print("%s: %d tokens, %.0f tokens/sec" % (tok_name, n_tokens, n_tokens / elapsed))
+        if reference is None:
+            reference = out
+            continue
+        scores = np.array([token_agreement(e, a) for e, a in zip(reference, out)])
+        n_correct, n_total, same_sentences = scores.sum(axis=0)
+        n_same = sum(e.text == a.text and np.array_equal(e.spans, a.spans) for e, a in zip(reference, out))
+        print("  token agreement %.4f, identical paragraphs %.4f, identical sentences %.4f" % (
+            n_correct / max(n_total, 1), n_same / len(out), same_sentences / len(out)))
+
+
+def main():
+    parser = argparse.ArgumentParser("Compare the output and speed of the fast tokenizer to NltkAndPunctTokenizer")
+    parser.add_argument("--squad", default=config.SQUAD_DEV)
+    parser.add_argument("--triviaqa", default=join(config.TRIVIA_QA, "evidence"))
+    parser.add_argument("-n", "--n_files", type=int, default=200, help="Number of TriviaQA evidence documents to use")
+    args = parser.parse_args()
+
+    tokenizers = [(name, get_tokenizer(name)) for name in TOKENIZERS]
+    if exists(args.squad):
+        run("SQuAD", squad_paragraphs(args.squad), tokenizers)
+    if exists(args.triviaqa):
+        run("TriviaQA", triviaqa_paragraphs(args.triviaqa, args.n_files), tokenizers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import argparse
+from os.path import join, exists
+
+from docqa.config import VEC_DIR
+from docqa.data_processing.word_vectors import convert_word_vector_file, BINARY_SUFFIX
+
+
+def main():
+    parser = argparse.ArgumentParser("Convert a text word vector file to a memory-mappable binary format, "
+                                     "which `load_word_vectors` will use in place of the text file")
+    parser.add_argument("vecs", help="Name of the vectors in the vector directory (e.g. glove.840B.300d)")
+    parser.add_argument("-o", "--output", help="Output directory, defaults to the vector directory")
+    args = parser.parse_args()
+
+    vec_path = join(VEC_DIR, args.vecs)
+    output = args.output if args.output else vec_path + BINARY_SUFFIX
+    if exists(vec_path + ".txt"):
+        source = vec_path + ".txt"
+    elif exists(vec_path + ".txt.gz"):
+        source = vec_path + ".txt.gz"
+    else:
+        raise ValueError("No text file found for vectors %s" % args.vecs)
+    convert_word_vector_file(source, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import time
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+import tensorflow as tf
+
+from docqa.data_processing.qa_training_data import ContextAndQuestion
+from docqa.model import Model
+
+"""
+Inference that only computes the question-independent part of a model once for each unique
+context, and re-uses it for every question asked about that context
+"""
+
+
+class SharedContextRunner(object):
+    """
+    Runs a model's predictions by first computing `model.get_context_encoding()` for any contexts
+    in the batch it has not seen recently, and then feeding the cached encodings in while running
+    the question-dependent rest of the graph. `model.get_predictions_for` must have already been called.
+    """
+
+    def __init__(self, model: Model, cache_size: int=1024):
+        self.model = model
+        self.context_encoding = model.get_context_encoding()
+        if self.context_encoding is None:
+            raise ValueError("Model %s does not support sharing context encodings" % model.name)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # context tokens -> (n_words, dim) encoding
+
+        # Statistics
+        self.n_questions = 0
+        self.n_contexts_encoded = 0
+        self.context_words_requested = 0
+        self.context_words_encoded = 0
+        self.context_time = 0
+        self.question_time = 0
+
+    def run(self, sess: tf.Session, fetches, batch: List[ContextAndQuestion]):
+        """ Equivalent to sess.run(fetches, model.encode(batch, False)) """
+        feed_dict = self.model.encode(batch, is_train=False)
+        context_len = feed_dict[self.model.encoder.context_len]
+
+        keys = [tuple(x.get_context()) for x in batch]
+        to_encode = OrderedDict()
+        for i, key in enumerate(keys):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            elif key not in to_encode:
+                to_encode[key] = i
+
+        if len(to_encode) > 0:
+            t0 = time.perf_counter()
+            ixs = list(to_encode.values())
+            encoded = sess.run(self.context_encoding,
+                               feed_dict=self.model.encode([batch[i] for i in ixs], is_train=False))
+            for row, (key, i) in enumerate(to_encode.items()):
+                self._cache[key] = encoded[row, :context_len[i]]
+                self.context_words_encoded += int(context_len[i])
+            self.n_contexts_encoded += len(to_encode)
+            self.context_time += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        batch_size = self.model.encoder.batch_size
+        batch_size = len(batch) if batch_size is None else batch_size
+        first = self._cache[keys[0]]
+        context_encoding = np.zeros((batch_size, context_len.max(), first.shape[1]), dtype=first.dtype)
+        for i, key in enumerate(keys):
+            context_encoding[i, :context_len[i]] = self._cache[key]
+        feed_dict[self.context_encoding] = context_encoding
+        out = sess.run(fetches, feed_dict=feed_dict)
+        self.question_time += time.perf_counter() - t0
+
+        self.n_questions += len(batch)
+        self.context_words_requested += int(context_len.sum())
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return out
+
+    def get_stats(self):
+        """ Work saved relative to encoding the context once per question """
+        if self.context_words_encoded == 0:
+            return dict(questions=self.n_questions, contexts_encoded=0)
+        # The context encoder's FLOPs are linear in the number of words it encodes
+        flops_saved = 1 - self.context_words_encoded / self.context_words_requested
+        return dict(
+            questions=self.n_questions,
+            contexts_encoded=self.n_contexts_encoded,
+            context_words_encoded=self.context_words_encoded,
+            context_words_requested=self.context_words_requested,
+            context_flops_saved=flops_saved,
+            context_seconds=self.context_time,
+            question_seconds=self.question_time,
+            est_seconds_saved=self.context_time * (self.context_words_requested / self.context_words_encoded - 1)
+        )
+
+    def print_stats(self):
+        stats = self.get_stats()
+        if stats["contexts_encoded"] == 0:
+            return
+        print("Encoded %d contexts for %d questions, %d/%d context words (%.1f%% of the context encoder's "
+              "FLOPs saved)" % (stats["contexts_encoded"], stats["questions"], stats["context_words_encoded"],
+                                stats["context_words_requested"], stats["context_flops_saved"] * 100))
+        print("Context encoding took %.2fs, questions took %.2fs, an estimated %.2fs was saved" % (
+            stats["context_seconds"], stats["question_seconds"], stats["est_seconds_saved"]))
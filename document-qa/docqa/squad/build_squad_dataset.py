@@ -3,14 +3,18 @@ import json
 import urllib
 from os import listdir, mkdir
 from os.path import expanduser, join, exists
-from typing import List
+from typing import Iterable
+
+import numpy as np
 
 from tqdm import tqdm
 
 from docqa import config
 from docqa.squad.squad_data import Question, WeightedQuestion, Document, Paragraph, SquadCorpus
 from docqa.data_processing.span_data import ParagraphSpan, ParagraphSpans
-from docqa.data_processing.text_utils import get_word_span, space_re, NltkAndPunctTokenizer
+from docqa.data_processing.fast_tokenizer import TOKENIZERS, get_tokenizer
+from docqa.data_processing.text_utils import get_word_span, space_re
+from docqa.data_processing.tokenizer_cache import CachedTokenizer
 from docqa.utils import flatten_iterable
 
 """
@@ -23,109 +27,133 @@ def clean_title(title):
     return urllib.parse.unquote(title).replace("_", " ")
 
 
-def parse_squad_data(source, name, tokenizer, use_tqdm=True, weighted_samples=False) -> List[Document]:
+def parse_squad_data(source, name, tokenizer, use_tqdm=True, weighted_samples=False,
+                     n_processes: int=1, chunk_size: int=8) -> Iterable[Document]:
+    """
+    Yields a `Document` for each article in `source`. If `n_processes` > 1 articles are tokenized by a pool of
+    processes, `chunk_size` articles at a time, and still yielded in the order they appear in `source`
+    """
     with open(source, 'r') as f:
         source_data = json.load(f)
 
-    if use_tqdm:
-        iter_files = tqdm(source_data['data'], ncols=80)
+    articles = source_data['data']
+    if n_processes == 1:
+        docs = (_parse_article(article_ix, article, name, tokenizer, weighted_samples)
+                for article_ix, article in enumerate(articles))
+        if use_tqdm:
+            docs = tqdm(docs, total=len(articles), ncols=80)
+        yield from docs
     else:
-        iter_files = source_data['data']
-
-    for article_ix, article in enumerate(iter_files):
-        article_ix = "%s-%d" % (name, article_ix)
-
-        paragraphs = []
-
-        for para_ix, para in enumerate(article['paragraphs']):
-            questions = []
-            context = para['context']
-
-            tokenized = tokenizer.tokenize_with_inverse(context)
-            # list of sentences + mapping from words -> original text index
-            text, text_spans = tokenized.text, tokenized.spans
-            flat_text = flatten_iterable(text)
-
-            n_words = sum(len(sentence) for sentence in text)
-
-            for question_ix, question in enumerate(para['qas']):
-                # There are actually some multi-sentence questions, so we should have used
-                # tokenizer.tokenize_paragraph_flat here which would have produced slighy better
-                # results in a few cases. However all the results we report were
-                # done using `tokenize_sentence` so I am just going to leave this way
-                question_text = tokenizer.tokenize_sentence(question['question'])
-
-                answer_spans = []
-                for answer_ix, answer in enumerate(question['answers']):
-                    answer_raw = answer['text']
-
-                    answer_start = answer['answer_start']
-                    answer_stop = answer_start + len(answer_raw)
-
-                    word_ixs = get_word_span(text_spans, answer_start, answer_stop)
-
-                    first_word = flat_text[word_ixs[0]]
-                    first_word_span = text_spans[word_ixs[0]]
-                    last_word = flat_text[word_ixs[-1]]
-                    last_word_span = text_spans[word_ixs[-1]]
-
-                    char_start = answer_start - first_word_span[0]
-                    char_end = answer_stop - last_word_span[0]
-
-                    # Sanity check to ensure we can rebuild the answer using the word and char indices
-                    # Since we might not be able to "undo" the tokenizing exactly we might not be able to exactly
-                    # rebuild 'answer_raw', so just we check that we can rebuild the answer minus spaces
-                    if len(word_ixs) == 1:
-                        if first_word[char_start:char_end] != answer_raw:
-                            raise ValueError()
-                    else:
-                        rebuild = first_word[char_start:]
-                        for word_ix in word_ixs[1:-1]:
-                            rebuild += flat_text[word_ix]
-                        rebuild += last_word[:char_end]
-                        if rebuild != space_re.sub("", tokenizer.clean_text(answer_raw)):
-                            raise ValueError(rebuild + " " + answer_raw)
-
-                    # Find the sentence with in-sentence offset
-                    sent_start, sent_end, word_start, word_end = None, None, None, None
-                    on_word = 0
-                    for sent_ix, sent in enumerate(text):
-                        next_word = on_word + len(sent)
-                        if on_word <= word_ixs[0] < next_word:
-                            sent_start = sent_ix
-                            word_start = word_ixs[0] - on_word
-                        if on_word <= word_ixs[-1] < next_word:
-                            sent_end = sent_ix
-                            word_end = word_ixs[-1] - on_word
-                            break
-                        on_word = next_word
-
-                    # Sanity check these as well
-                    if text[sent_start][word_start] != flat_text[word_ixs[0]]:
-                        raise RuntimeError()
-                    if text[sent_end][word_end] != flat_text[word_ixs[-1]]:
-                        raise RuntimeError()
-
-                    span = ParagraphSpan(
-                        sent_start, word_start, char_start,
-                        sent_end, word_end, char_end,
-                        word_ixs[0], word_ixs[-1],
-                        answer_raw)
-                    if span.para_word_end >= n_words or \
-                                    span.para_word_start >= n_words:
-                        raise RuntimeError()
-                    answer_spans.append(span)
-
-                if weighted_samples:
-                    question = WeightedQuestion(question['id'], question_text, ParagraphSpans(answer_spans), question['weight'])
-                else:
-                    question = Question(question['id'], question_text, ParagraphSpans(answer_spans))
+        from multiprocessing import Pool
+        with Pool(n_processes, initializer=_init_worker, initargs=[name, tokenizer, weighted_samples]) as pool:
+            docs = pool.imap(_parse_article_t, enumerate(articles), chunksize=chunk_size)
+            if use_tqdm:
+                docs = tqdm(docs, total=len(articles), ncols=80)
+            yield from docs
+
+
+# Per-process arguments for `_parse_article_t`, so the tokenizer is only sent once to each worker
+_WORKER_ARGS = None
+
+
+def _init_worker(name, tokenizer, weighted_samples):
+    global _WORKER_ARGS
+    _WORKER_ARGS = (name, tokenizer, weighted_samples)
+
+
+def _parse_article_t(x):
+    article_ix, article = x
+    return _parse_article(article_ix, article, *_WORKER_ARGS)
+
+
+def _parse_article(article_ix, article, name, tokenizer, weighted_samples) -> Document:
+    article_ix = "%s-%d" % (name, article_ix)
 
-                questions.append(question)
+    paragraphs = []
 
-            paragraphs.append(Paragraph(text, questions, article_ix, para_ix, context, text_spans))
+    for para_ix, para in enumerate(article['paragraphs']):
+        questions = []
+        context = para['context']
 
-        yield Document(article_ix, article["title"], paragraphs)
+        tokenized = tokenizer.tokenize_with_inverse(context)
+        # list of sentences + mapping from words -> original text index
+        text, text_spans = tokenized.text, tokenized.spans
+        flat_text = flatten_iterable(text)
+
+        n_words = sum(len(sentence) for sentence in text)
+        # index of the first word of each sentence
+        sent_starts = np.cumsum([0] + [len(sentence) for sentence in text[:-1]])
+
+        for question_ix, question in enumerate(para['qas']):
+            # There are actually some multi-sentence questions, so we should have used
+            # tokenizer.tokenize_paragraph_flat here which would have produced slighy better
+            # results in a few cases. However all the results we report were
+            # done using `tokenize_sentence` so I am just going to leave this way
+            question_text = tokenizer.tokenize_sentence(question['question'])
+
+            answer_spans = []
+            for answer_ix, answer in enumerate(question['answers']):
+                answer_raw = answer['text']
+
+                answer_start = answer['answer_start']
+                answer_stop = answer_start + len(answer_raw)
+
+                word_ixs = get_word_span(text_spans, answer_start, answer_stop)
+
+                first_word = flat_text[word_ixs[0]]
+                first_word_span = text_spans[word_ixs[0]]
+                last_word = flat_text[word_ixs[-1]]
+                last_word_span = text_spans[word_ixs[-1]]
+
+                char_start = answer_start - first_word_span[0]
+                char_end = answer_stop - last_word_span[0]
+
+                # Sanity check to ensure we can rebuild the answer using the word and char indices
+                # Since we might not be able to "undo" the tokenizing exactly we might not be able to exactly
+                # rebuild 'answer_raw', so just we check that we can rebuild the answer minus spaces
+                if len(word_ixs) == 1:
+                    if first_word[char_start:char_end] != answer_raw:
+                        raise ValueError()
+                else:
+                    rebuild = first_word[char_start:]
+                    for word_ix in word_ixs[1:-1]:
+                        rebuild += flat_text[word_ix]
+                    rebuild += last_word[:char_end]
+                    if rebuild != space_re.sub("", tokenizer.clean_text(answer_raw)):
+                        raise ValueError(rebuild + " " + answer_raw)
+
+                # Find the sentence with in-sentence offset
+                sent_start = int(np.searchsorted(sent_starts, word_ixs[0], side="right")) - 1
+                word_start = word_ixs[0] - int(sent_starts[sent_start])
+                sent_end = int(np.searchsorted(sent_starts, word_ixs[-1], side="right")) - 1
+                word_end = word_ixs[-1] - int(sent_starts[sent_end])
+
+                # Sanity check these as well
+                if text[sent_start][word_start] != flat_text[word_ixs[0]]:
+                    raise RuntimeError()
+                if text[sent_end][word_end] != flat_text[word_ixs[-1]]:
+                    raise RuntimeError()
+
+                span = ParagraphSpan(
+                    sent_start, word_start, char_start,
+                    sent_end, word_end, char_end,
+                    word_ixs[0], word_ixs[-1],
+                    answer_raw)
+                if span.para_word_end >= n_words or \
+                                span.para_word_start >= n_words:
+                    raise RuntimeError()
+                answer_spans.append(span)
+
+            if weighted_samples:
+                question = WeightedQuestion(question['id'], question_text, ParagraphSpans(answer_spans), question['weight'])
+            else:
+                question = Question(question['id'], question_text, ParagraphSpans(answer_spans))
+
+            questions.append(question)
+
+        paragraphs.append(Paragraph(text, questions, article_ix, para_ix, context, text_spans))
+
+    return Document(article_ix, article["title"], paragraphs)
 
 
 def main():
@@ -133,6 +161,13 @@ def main():
     parser.add_argument("--train_file", default=config.SQUAD_TRAIN)
     parser.add_argument("--dev_file", default=config.SQUAD_DEV)
     parser.add_argument("--weighted-questions", action='store_true')
+    parser.add_argument("-n", "--n_processes", type=int, default=1,
+                        help="Number of processes to use when tokenizing")
+    parser.add_argument("--tokenizer", choices=TOKENIZERS, default="nltk",
+                        help="nltk is the reference, fast-punkt gives the same output faster, "
+                             "fast-regex is the fastest but can split sentences differently")
+    parser.add_argument("--tokenizer_cache", default=None,
+                        help="Directory to cache tokenized contexts in, so later builds can re-use them")
 
     if not exists(config.CORPUS_DIR):
         mkdir(config.CORPUS_DIR)
@@ -142,13 +177,16 @@ def main():
         raise ValueError("Files already exist in " + target_dir)
 
     args = parser.parse_known_args()[0]
-    tokenizer = NltkAndPunctTokenizer()
+    tokenizer = get_tokenizer(args.tokenizer)
+    if args.tokenizer_cache is not None:
+        tokenizer = CachedTokenizer(tokenizer, args.tokenizer_cache)
 
     print("Parsing train...")
-    train = list(parse_squad_data(args.train_file, "train", tokenizer, weighted_samples=args.weighted_questions))
+    train = list(parse_squad_data(args.train_file, "train", tokenizer, weighted_samples=args.weighted_questions,
+                                  n_processes=args.n_processes))
 
     print("Parsing dev...")
-    dev = list(parse_squad_data(args.dev_file, "dev", tokenizer))
+    dev = list(parse_squad_data(args.dev_file, "dev", tokenizer, n_processes=args.n_processes))
 
     print("Saving...")
     SquadCorpus.make_corpus(train, dev)
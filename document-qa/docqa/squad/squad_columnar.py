@@ -0,0 +1,125 @@
+import argparse
+import pickle
+from os.path import join, exists
+from typing import List, Optional
+
+import numpy as np
+
+from docqa.config import CORPUS_DIR
+from docqa.data_processing.columnar import ColumnarReader, ColumnarWriter, lazy_field
+from docqa.data_processing.span_data import ParagraphSpans, ParagraphSpan
+from docqa.squad.squad_data import Document, Paragraph, Question, WeightedQuestion, SquadCorpus
+
+"""
+Columnar storage for the document files of `SquadCorpus`, so they can be loaded without
+unpickling every document, paragraph and question up front
+"""
+
+
+def columnar_dir(filename: str):
+    """ Directory for the columnar version of the pickle `filename` """
+    if filename.endswith(".pkl"):
+        filename = filename[:-4]
+    return filename + "_columnar"
+
+
+def write_documents(docs: List[Document], directory: str, source: Optional[str]=None):
+    writer = ColumnarWriter(directory)
+    paragraphs = [para for doc in docs for para in doc.paragraphs]
+    questions = [q for para in paragraphs for q in para.questions]
+    for q in questions:
+        if not isinstance(q.answer, ParagraphSpans):
+            raise ValueError("Can't store answers of type %s" % q.answer.__class__.__name__)
+
+    writer.add_json("doc_meta", [[doc.doc_id, doc.title] for doc in docs])
+    writer.add_offsets("doc_paragraph_offsets", [len(doc.paragraphs) for doc in docs])
+
+    writer.add_json("para_meta", [[para.article_id, para.paragraph_num] for para in paragraphs])
+    writer.add_tokens("context", [[w for sent in para.text for w in sent] for para in paragraphs])
+    writer.add_ragged("sentence_lens", [[len(s) for s in para.text] for para in paragraphs], np.int32)
+    writer.add_strings("original_text", [para.original_text for para in paragraphs])
+    writer.add_ragged("token_spans", [para.spans for para in paragraphs], np.int32, (2,))
+    writer.add_offsets("paragraph_question_offsets", [len(para.questions) for para in paragraphs])
+
+    writer.add_strings("question_id", [q.question_id for q in questions])
+    writer.add_tokens("question", [q.words for q in questions])
+    writer.add_array("weight", np.array([q.weight if isinstance(q, WeightedQuestion) else np.nan
+                                         for q in questions], dtype=np.float64))
+    writer.add_ragged("answer_spans", [[x.as_tuple()[:-1] for x in q.answer] for q in questions], np.int64, (8,))
+    writer.add_json("answer_text", [[x.text for x in q.answer] for q in questions])
+    writer.finish(dict(n_docs=len(docs), n_paragraphs=len(paragraphs), n_questions=len(questions)), source)
+
+
+def _load_question(reader: ColumnarReader, ix: int) -> Question:
+    answer = ParagraphSpans([ParagraphSpan(*span, text) for span, text in
+                             zip(reader.ragged("answer_spans", ix).tolist(), reader.json("answer_text", ix))])
+    question_id = reader.strings("question_id")[ix]
+    words = reader.tokens("question", ix)
+    weight = reader.array("weight")[ix]
+    if np.isnan(weight):
+        return Question(question_id, words, answer)
+    return WeightedQuestion(question_id, words, answer, float(weight))
+
+
+def _load_paragraph(reader: ColumnarReader, ix: int) -> Paragraph:
+    words = reader.tokens("context", ix)
+    text = []
+    on_word = 0
+    for sent_len in reader.ragged("sentence_lens", ix).tolist():
+        text.append(words[on_word:on_word + sent_len])
+        on_word += sent_len
+    q_offsets = reader.array("paragraph_question_offsets")
+    questions = [_load_question(reader, i) for i in range(q_offsets[ix], q_offsets[ix + 1])]
+    article_id, paragraph_num = reader.json("para_meta", ix)
+    return Paragraph(text, questions, article_id, paragraph_num, reader.strings("original_text")[ix],
+                     np.array(reader.ragged("token_spans", ix)))
+
+
+def _load_paragraphs(doc):
+    reader = doc._reader
+    offsets = reader.array("doc_paragraph_offsets")
+    return [_load_paragraph(reader, i) for i in range(offsets[doc._ix], offsets[doc._ix + 1])]
+
+
+class LazyDocument(Document):
+    """
+    `Document` that reads its fields from a `ColumnarReader` when they are first used, pickles
+    as a regular `Document`
+    """
+
+    def __init__(self, reader: ColumnarReader, ix: int):
+        self._reader = reader
+        self._ix = ix
+        self._loaded = {}
+
+    _meta = lazy_field("_meta", lambda doc: doc._reader.json("doc_meta", doc._ix))
+    doc_id = lazy_field("doc_id", lambda doc: doc._meta[0])
+    title = lazy_field("title", lambda doc: doc._meta[1])
+    paragraphs = lazy_field("paragraphs", _load_paragraphs)
+
+    def __reduce__(self):
+        return Document, (self.doc_id, self.title, self.paragraphs)
+
+
+def load_documents(directory: str) -> List[Document]:
+    """ Lazy documents from a directory built by `write_documents`, only the index is read up front """
+    reader = ColumnarReader(directory)
+    return [LazyDocument(reader, i) for i in range(reader.index["n_docs"])]
+
+
+def main():
+    parser = argparse.ArgumentParser("Convert the pickled SQuAD corpus to the columnar format")
+    parser.parse_args()
+    corpus_dir = join(CORPUS_DIR, SquadCorpus.NAME)
+    for name in [SquadCorpus.TRAIN_FILE, SquadCorpus.DEV_FILE]:
+        source = join(corpus_dir, name)
+        if not exists(source):
+            continue
+        print("Converting %s" % source)
+        with open(source, "rb") as f:
+            docs = pickle.load(f)
+        write_documents(docs, columnar_dir(source), source)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from typing import List, Optional
 
 import numpy as np
 from docqa.config import CORPUS_DIR
+from docqa.data_processing.columnar import use_columnar
 from docqa.data_processing.text_utils import ParagraphWithInverse
 from docqa.utils import ResourceLoader, flatten_iterable
 
@@ -209,6 +210,9 @@ class SquadCorpus(Configurable):
         return []
 
     def _load(self, file) -> List[Document]:
+        from docqa.squad.squad_columnar import columnar_dir, load_documents
+        if use_columnar(columnar_dir(file), file):
+            return load_documents(columnar_dir(file))
         if not exists(file):
             return []
         with open(file, "rb") as f:
@@ -0,0 +1,34 @@
+"""Small random corpora shared by the paragraph selection tests"""
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from docqa.configurable import Configurable
+from docqa.data_processing.document_splitter import ShallowOpenWebRanker
+
+VOCAB = ["the", "a", "of", "cat", "dog", "fish", "red", "blue", "green", "sat", "ran", "swam"]
+
+
+class FixedStopWords(Configurable):
+    """ Stand-in for `StopWords` that does not need the NLTK data """
+    @property
+    def words(self):
+        return ["a", "of", "the"]
+
+
+def open_web_ranker(n_to_select: int) -> ShallowOpenWebRanker:
+    """ `ShallowOpenWebRanker` that uses `FixedStopWords` instead of NLTK's stop words """
+    ranker = ShallowOpenWebRanker.__new__(ShallowOpenWebRanker)
+    ranker.n_to_select = n_to_select
+    ranker._stop = set(FixedStopWords().words)
+    ranker._tfidf = TfidfVectorizer(strip_accents="unicode", stop_words=list(ranker._stop))
+    return ranker
+
+
+def random_words(rng: np.random.RandomState, n_words: int, vocab=VOCAB):
+    return list(rng.choice(vocab, n_words))
+
+
+def random_document(rng: np.random.RandomState, n_paragraphs: int, max_sentence_len: int, vocab=VOCAB):
+    """ Document as a list of paragraphs, each a list of one or two tokenized sentences """
+    return [[random_words(rng, rng.randint(1, max_sentence_len), vocab) for _ in range(rng.randint(1, 3))]
+            for _ in range(n_paragraphs)]
@@ -0,0 +1,105 @@
+import unittest
+from copy import deepcopy
+
+import numpy as np
+
+from docqa.triviaqa.answer_detection import FastNormalizedAnswerDetector, AutomatonAnswerDetector, \
+    evaluate_question_detector, CarefulAnswerDetector, compute_answer_spans, compute_answer_spans_par
+from docqa.triviaqa.read_data import TriviaQaQuestion, SearchDoc, FreeForm
+
+
+class InMemoryEvidence(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def get_document(self, doc_id, n_tokens=None, flat=False):
+        return self.docs.get(doc_id)
+
+
+class SplitTokenizer(object):
+    def tokenize_paragraph_flat(self, text):
+        return text.split()
+
+
+def build_questions(seed, n_docs, n_questions):
+    rng = np.random.RandomState(seed)
+    words = ["a", "the", "cat", "Cat", "cats", "sat", "new", "york", "New", "."]
+    docs = {"doc%d" % i: [[list(rng.choice(words, 10)) for _ in range(2)] for _ in range(3)] for i in range(n_docs)}
+    questions = []
+    for i in range(n_questions):
+        answer = FreeForm("", "", [], ["cat", "new york", "the cat sat"], None)
+        doc_ids = rng.choice(n_docs, rng.randint(1, 4), replace=False)
+        questions.append(TriviaQaQuestion("q %d" % i, "q%d" % i, answer, [],
+                                          [SearchDoc("", "", 0, "doc%d" % j) for j in doc_ids]))
+    return InMemoryEvidence(docs), questions
+
+
+class TestAutomatonDetector(unittest.TestCase):
+
+    def test_same_spans(self):
+        rng = np.random.RandomState(0)
+        words = ["a", "an", "the", "", "cat", "Cat", "dog", "new", "York", "'", "big", "The", "x"]
+        alias_words = ["a", "the", "cat", "dog", "new", "york", "big", "an"]
+        reference, detector = FastNormalizedAnswerDetector(), AutomatonAnswerDetector()
+        n_spans = 0
+        for _ in range(2000):
+            aliases = [list(rng.choice(alias_words, rng.randint(1, 5))) for _ in range(rng.randint(1, 6))]
+            para = [list(rng.choice(words, rng.randint(1, 15))) for _ in range(rng.randint(1, 3))]
+            reference.set_question(aliases)
+            detector.set_question(aliases)
+            expected = reference.any_found(para)
+            n_spans += len(expected)
+            # Same order as well, since `compute_answer_spans` stores the spans in this order
+            self.assertEqual(expected, detector.any_found(para))
+        self.assertGreater(n_spans, 1000)
+
+    def test_harness(self):
+        rng = np.random.RandomState(1)
+        words = ["a", "the", "cat", "Cat", "sat", "new", "york", "New", "."]
+        docs = {"doc%d" % i: [[list(rng.choice(words, 10))] for _ in range(3)] for i in range(5)}
+        questions = []
+        for i in range(10):
+            answer = FreeForm("", "", [], ["cat", "new york", "the cat sat"], None)
+            questions.append(TriviaQaQuestion("q", "q%d" % i, answer, [], [SearchDoc("", "", 0, "doc%d" % (i % 5))]))
+        self.assertEqual(0, evaluate_question_detector(questions, InMemoryEvidence(docs), str.split,
+                                                       AutomatonAnswerDetector(), FastNormalizedAnswerDetector(),
+                                                       require_identical=True))
+
+
+class TestComputeAnswerSpans(unittest.TestCase):
+
+    def _check_same(self, expected, actual):
+        n_found = 0
+        self.assertEqual([q.question_id for q in expected], [q.question_id for q in actual])
+        for q1, q2 in zip(expected, actual):
+            self.assertEqual(q1.question, q2.question)
+            for d1, d2 in zip(q1.all_docs, q2.all_docs):
+                self.assertEqual(d1.answer_spans.tolist(), d2.answer_spans.tolist())
+                n_found += len(d1.answer_spans)
+        self.assertGreater(n_found, 0)
+
+    def test_cache(self):
+        corpus, questions = build_questions(2, 6, 40)
+        for detector in [FastNormalizedAnswerDetector(), AutomatonAnswerDetector(), CarefulAnswerDetector()]:
+            expected = deepcopy(questions)
+            compute_answer_spans(expected, corpus, str.split, detector)
+            for cache_size in [1, 3, 100]:
+                actual = deepcopy(questions)
+                compute_answer_spans(actual, corpus, str.split, detector, cache_size)
+                self._check_same(expected, actual)
+
+    def test_par_keeps_order(self):
+        corpus, questions = build_questions(3, 10, 30)
+        expected = deepcopy(questions)
+        compute_answer_spans(expected, corpus, str.split, AutomatonAnswerDetector())
+        for n_processes in [1, 2]:
+            actual = deepcopy(questions)
+            out = compute_answer_spans_par(actual, corpus, SplitTokenizer(),
+                                           AutomatonAnswerDetector(), n_processes, chunk_size=3, cache_size=4)
+            # Results are written back into the caller's list
+            self.assertIs(actual, out)
+            self._check_same(expected, actual)
+
+
+if __name__ == '__main__':
+    unittest.main()
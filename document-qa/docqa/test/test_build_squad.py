@@ -0,0 +1,109 @@
+import json
+import re
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from docqa.data_processing.text_utils import ParagraphWithInverse, get_word_span
+from docqa.squad.build_squad_dataset import parse_squad_data
+
+
+def _describe(x):
+    if isinstance(x, list):
+        return [_describe(y) for y in x]
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if hasattr(x, "__dict__"):
+        return type(x).__name__, {k: _describe(v) for k, v in x.__dict__.items()}
+    return x
+
+
+class WhitespaceTokenizer(object):
+    """ Splits sentences on periods and words on whitespace, so we don't need NLTK's models """
+
+    def clean_text(self, word):
+        return word
+
+    def tokenize_sentence(self, sent):
+        return sent.split()
+
+    def tokenize_with_inverse(self, paragraph: str, is_sentence: bool=False) -> ParagraphWithInverse:
+        text, spans = [], []
+        for sent in re.finditer("[^.]+\\.?", paragraph):
+            words = list(re.finditer("\\S+", sent.group()))
+            if len(words) > 0:
+                text.append([w.group() for w in words])
+                spans += [(sent.start() + w.start(), sent.start() + w.end()) for w in words]
+        return ParagraphWithInverse(text, paragraph, np.array(spans, dtype=np.int32).reshape((-1, 2)))
+
+
+class TestBuildSquad(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        words = ["the", "cat", "sat", "on", "mat", "a", "dog"]
+        articles = []
+        for article_ix in range(12):
+            paragraphs = []
+            for para_ix in range(rng.randint(1, 3)):
+                context = "  ".join(" ".join(rng.choice(words, rng.randint(1, 6))) + "."
+                                    for _ in range(rng.randint(1, 4)))
+                spans = [m.span() for m in re.finditer("\\S+", context)]
+                qas = []
+                for q_ix in range(rng.randint(1, 3)):
+                    start = rng.randint(len(spans))
+                    end = min(len(spans) - 1, start + rng.randint(0, 3))
+                    answer = context[spans[start][0]:spans[end][1]]
+                    qas.append(dict(id="%d-%d-%d" % (article_ix, para_ix, q_ix), question="what is it ?",
+                                    answers=[dict(text=answer, answer_start=spans[start][0])]))
+                paragraphs.append(dict(context=context, qas=qas))
+            articles.append(dict(title="article%d" % article_ix, paragraphs=paragraphs))
+        self.source = join(self.dir, "squad.json")
+        with open(self.source, "w") as f:
+            json.dump(dict(data=articles), f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_answer_spans(self):
+        docs = list(parse_squad_data(self.source, "train", WhitespaceTokenizer(), use_tqdm=False))
+        self.assertEqual(12, len(docs))
+        n_answers = 0
+        for doc in docs:
+            for para in doc.paragraphs:
+                flat = [w for sent in para.text for w in sent]
+                for q in para.questions:
+                    for span in q.answer:
+                        n_answers += 1
+                        words = flat[span.para_word_start:span.para_word_end + 1]
+                        self.assertEqual(span.text.split(), words)
+                        self.assertEqual(para.text[span.sent_start][span.word_start], words[0])
+                        self.assertEqual(para.text[span.sent_end][span.word_end], words[-1])
+        self.assertGreater(n_answers, 10)
+
+    def test_parallel_same_order(self):
+        expected = list(parse_squad_data(self.source, "train", WhitespaceTokenizer(), use_tqdm=False))
+        actual = list(parse_squad_data(self.source, "train", WhitespaceTokenizer(), use_tqdm=False,
+                                       n_processes=2, chunk_size=2))
+        self.assertEqual([x.doc_id for x in expected], [x.doc_id for x in actual])
+        self.assertEqual(_describe(expected), _describe(actual))
+
+
+class TestGetWordSpan(unittest.TestCase):
+
+    def test_get_word_span(self):
+        spans = np.array([[0, 3], [4, 7], [7, 8], [10, 12]], dtype=np.int32)
+        self.assertEqual([0], get_word_span(spans, 0, 3))
+        self.assertEqual([0, 1], get_word_span(spans, 2, 5))
+        self.assertEqual([1, 2], get_word_span(spans, 4, 8))
+        self.assertEqual([], get_word_span(spans, 8, 10))
+        self.assertEqual([3], get_word_span(spans, 9, 20))
+        self.assertEqual([], get_word_span(np.zeros((0, 2), dtype=np.int32), 0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from docqa.data_processing.char_encoding import CharIdTable
+from docqa.elmo.data import Batcher
+
+
+class TestCharIdTable(unittest.TestCase):
+
+    def test_fill(self):
+        char_to_ix = {c: i + 2 for i, c in enumerate("abcdeé€")}
+        table = CharIdTable(char_to_ix, 1)
+        sequences = [["abc", "zebra", "été", "€€€€€€"], [], ["a"], ["", "b", "\U0001F600x", "dd", "e"]]
+        for word_dim, char_dim in [(4, 5), (2, 3), (6, 1)]:
+            expected_chars = np.zeros((5, word_dim, char_dim), dtype=np.int32)
+            expected_lens = np.zeros((5, word_dim), dtype=np.int32)
+            for i, seq in enumerate(sequences):
+                for j, word in enumerate(seq[:word_dim]):
+                    expected_lens[i, j] = min(len(word), char_dim)
+                    for k, c in enumerate(word[:char_dim]):
+                        expected_chars[i, j, k] = char_to_ix.get(c, 1)
+            chars = np.zeros_like(expected_chars)
+            lens = np.zeros_like(expected_lens)
+            table.fill(sequences, chars, lens)
+            self.assertTrue(np.array_equal(expected_chars, chars))
+            self.assertTrue(np.array_equal(expected_lens, lens))
+
+
+class TestElmoBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.vocab_file = join(self.dir, "vocab.txt")
+        with open(self.vocab_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(["<S>", "</S>", "<UNK>", "the", "cat", "été", "supercalifragilistic"]))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_batch_sentences(self):
+        max_len = 8
+        batcher = Batcher(self.vocab_file, max_len)
+        vocab = batcher._lm_vocab
+
+        def encode_word(word):
+            code = np.full(max_len, vocab.pad_char)
+            word = word.encode("utf-8", "ignore")[:max_len - 2]
+            code[0] = vocab.bow_char
+            code[1:len(word) + 1] = list(word)
+            code[len(word) + 1] = vocab.eow_char
+            return code
+
+        sentences = [["the", "cat"], ["été", "unknownword", "supercalifragilistic", "ü"], ["x"]]
+        expected = np.zeros((3, 6, max_len), dtype=np.int64)
+        for i, sent in enumerate(sentences):
+            rows = [vocab.bos_chars] + [encode_word(w) for w in sent] + [vocab.eos_chars]
+            expected[i, :len(rows)] = np.array(rows) + 1
+        self.assertTrue(np.array_equal(expected, batcher.batch_sentences(sentences)))
+        self.assertTrue(np.array_equal(vocab.word_to_char_ids("cat"), encode_word("cat")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import pickle
+import shutil
+import tempfile
+import unittest
+from os import remove
+from os.path import join
+
+import numpy as np
+
+from docqa.data_processing.columnar import use_columnar
+from docqa.data_processing.span_data import ParagraphSpans, ParagraphSpan
+from docqa.squad.squad_columnar import write_documents, load_documents
+from docqa.squad.squad_data import Document, Paragraph, Question, WeightedQuestion
+from docqa.triviaqa.read_data import TriviaQaQuestion, SearchDoc, TagMeEntityDoc, SearchEntityDoc, \
+    WikipediaEntity, FreeForm, Numerical
+from docqa.triviaqa.span_corpus_columnar import write_questions, load_questions
+
+
+def _describe(x):
+    """ Comparable representation of an object graph """
+    if x is None or isinstance(x, (str, int, float, bool)):
+        return x
+    if isinstance(x, (list, tuple)):
+        return [_describe(y) for y in x]
+    if isinstance(x, np.ndarray):
+        return "array", x.dtype.kind, x.tolist()
+    if hasattr(x, "__slots__"):
+        fields = {k: getattr(x, k) for k in x.__slots__}
+    else:
+        fields = dict(x.__dict__)
+    return type(x).__name__, {k: _describe(v) for k, v in fields.items()}
+
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_squad(self):
+        rng = np.random.RandomState(0)
+        words = ["The", "cat", "sat", "dög", "東京", ".", ","]
+        docs = []
+        for doc_ix in range(5):
+            paragraphs = []
+            for para_ix in range(rng.randint(0, 4)):
+                text = [list(rng.choice(words, rng.randint(1, 6))) for _ in range(rng.randint(1, 4))]
+                n_words = sum(len(s) for s in text)
+                questions = []
+                for q_ix in range(rng.randint(0, 3)):
+                    spans = [ParagraphSpan(0, 0, 0, 0, 1, 5, 0, 1, "The cat") for _ in range(rng.randint(0, 3))]
+                    if q_ix == 1:
+                        questions.append(WeightedQuestion("q%d-%d" % (para_ix, q_ix), ["why", "?"],
+                                                          ParagraphSpans(spans), 0.5))
+                    else:
+                        questions.append(Question("q%d-%d" % (para_ix, q_ix), ["who"], ParagraphSpans(spans)))
+                paragraphs.append(Paragraph(text, questions, doc_ix, para_ix, "original text é",
+                                            rng.randint(0, 100, (n_words, 2)).astype(np.int32)))
+            docs.append(Document(doc_ix, "title%d" % doc_ix, paragraphs))
+
+        write_documents(docs, self.dir)
+        lazy = load_documents(self.dir)
+        self.assertEqual(len(docs), len(lazy))
+        self.assertEqual([x.title for x in docs], [x.title for x in lazy])
+        for doc, lazy_doc in zip(docs, lazy):
+            loaded = pickle.loads(pickle.dumps(lazy_doc))
+            self.assertIs(type(loaded), Document)
+            self.assertEqual(_describe(doc), _describe(loaded))
+            self.assertEqual(_describe(doc.paragraphs), _describe(lazy_doc.paragraphs))
+
+    def test_squad_unsupported_answer(self):
+        para = Paragraph([["The", "cat"]], [Question("q", ["who"], None)], 0, 0, "The cat",
+                         np.zeros((2, 2), dtype=np.int32))
+        with self.assertRaises(ValueError):
+            write_documents([Document(0, "title", [para])], self.dir)
+
+    def test_triviaqa(self):
+        questions = []
+        for i in range(6):
+            web_doc = SearchDoc("title", "description", i, "url%d" % i)
+            web_doc.answer_spans = np.array([[1, 2], [3, 4]][:i % 3], dtype=np.int32).reshape((-1, 2))
+            entity_doc = TagMeEntityDoc(0.5, 0.25, "entity")
+            entity_doc.trivia_qa_selected = True
+            search_doc = SearchEntityDoc("search")
+            if i % 2 == 0:
+                answer = WikipediaEntity("v", "v", ["a"], ["a"], "w", "w", None)
+            elif i == 3:
+                answer = None
+            elif i == 5:
+                answer = Numerical(4.0, ["four"], ["four"], "4", "", "4", None, ["4"])
+            else:
+                answer = FreeForm("x", "x", [], ["x"], ["human"])
+            questions.append(TriviaQaQuestion("raw text" if i == 0 else ["what", "?"], "q%d" % i, answer,
+                                              [entity_doc, search_doc], [web_doc] if i % 2 == 0 else None))
+
+        write_questions(questions, self.dir)
+        lazy = load_questions(self.dir)
+        self.assertEqual([q.question_id for q in questions], [q.question_id for q in lazy])
+        for q, lazy_q in zip(questions, lazy):
+            loaded = pickle.loads(pickle.dumps(lazy_q))
+            self.assertIs(type(loaded), TriviaQaQuestion)
+            self.assertEqual(_describe(q), _describe(loaded))
+            self.assertEqual(len(q.all_docs), len(lazy_q.all_docs))
+
+        # Assignments stick
+        lazy[1].question = ["changed"]
+        lazy[1].entity_docs[0].trivia_qa_selected = False
+        self.assertEqual(["changed"], lazy[1].question)
+        self.assertFalse(lazy[1].entity_docs[0].trivia_qa_selected)
+
+    def test_stale_copy(self):
+        source = join(self.dir, "train.pkl")
+        columnar = join(self.dir, "train_columnar")
+        with open(source, "wb") as f:
+            pickle.dump([], f)
+        write_questions([], columnar)
+        self.assertFalse(use_columnar(columnar, source))  # No record of what it was built from
+
+        write_questions([], columnar, source)
+        self.assertTrue(use_columnar(columnar, source))
+
+        # Source is rebuilt
+        with open(source, "wb") as f:
+            pickle.dump([1, 2, 3], f)
+        self.assertFalse(use_columnar(columnar, source))
+
+        remove(source)
+        self.assertTrue(use_columnar(columnar, source))
+        self.assertFalse(use_columnar(join(self.dir, "missing"), source))
+
+
+if __name__ == '__main__':
+    unittest.main()
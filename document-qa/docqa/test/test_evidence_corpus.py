@@ -0,0 +1,121 @@
+import shutil
+import tempfile
+import unittest
+from os import makedirs, remove, utime, stat
+from os.path import join, exists
+
+from docqa.configurable import Configurable
+from docqa.triviaqa.evidence_corpus import build_tokenized_corpus, load_manifest, corpus_fingerprint
+
+
+class WhitespaceTokenizer(Configurable):
+    """ Splits sentences on periods and words on whitespace, and counts the files it tokenizes """
+
+    def __init__(self, lower=False):
+        self.lower = lower
+        self.n_calls = 0
+
+    def tokenize_paragraph(self, paragraph: str):
+        self.n_calls += 1
+        if self.lower:
+            paragraph = paragraph.lower()
+        return [x.split() for x in paragraph.split(".") if len(x.strip()) > 0]
+
+    def __getstate__(self):
+        return dict(lower=self.lower)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class TestIncrementalBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        makedirs(join(self.source_dir, "web"))
+        makedirs(join(self.source_dir, "wikipedia"))
+        for i in range(10):
+            self.write("web/doc%d.txt" % i, "The cat %d sat. On a mat\nA dog" % i)
+        self.write("wikipedia/Cat.txt", "Cats are small.\n\nThe cat sat")
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.output_dir)
+
+    def write(self, filename, text):
+        with open(join(self.source_dir, filename), "w") as f:
+            f.write(text)
+
+    def build(self, tokenizer, rebuild=False):
+        build_tokenized_corpus(self.source_dir, tokenizer, self.output_dir, rebuild=rebuild)
+        with open(join(self.output_dir, "vocab.txt")) as f:
+            return f.read().split("\n")[:-1]
+
+    def test_build(self):
+        tokenizer = WhitespaceTokenizer()
+        voc = self.build(tokenizer)
+        self.assertEqual(sorted(["The", "cat", "sat", "On", "a", "mat", "A", "dog", "Cats", "are", "small"] +
+                                [str(i) for i in range(10)]), voc)
+        self.assertEqual(22, tokenizer.n_calls)
+        with open(join(self.output_dir, "web", "doc3.txt")) as f:
+            self.assertEqual("The cat 3 sat\nOn a mat\n\nA dog", f.read())
+
+        # Nothing changed, so nothing is re-tokenized
+        tokenizer = WhitespaceTokenizer()
+        self.assertEqual(voc, self.build(tokenizer))
+        self.assertEqual(0, tokenizer.n_calls)
+
+        # Touched files are hashed, but not re-tokenized
+        st = stat(join(self.source_dir, "web", "doc0.txt"))
+        utime(join(self.source_dir, "web", "doc0.txt"), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertEqual(voc, self.build(tokenizer))
+        self.assertEqual(0, tokenizer.n_calls)
+
+    def test_incremental_update(self):
+        self.build(WhitespaceTokenizer())
+        self.write("web/doc1.txt", "A bird")
+        self.write("web/new.txt", "A fish. ok")
+        remove(join(self.source_dir, "web", "doc2.txt"))
+
+        tokenizer = WhitespaceTokenizer()
+        voc = self.build(tokenizer)
+        self.assertEqual(2, tokenizer.n_calls)
+        self.assertFalse(exists(join(self.output_dir, "web", "doc2.txt")))
+        with open(join(self.output_dir, "web", "new.txt")) as f:
+            self.assertEqual("A fish\nok", f.read())
+        self.assertIn("bird", voc)
+        self.assertNotIn("1", voc)
+        self.assertNotIn("2", voc)
+
+        # Same as building from scratch
+        expected_counts = load_manifest(self.output_dir)["vocab"]
+        self.assertEqual(voc, self.build(WhitespaceTokenizer(), rebuild=True))
+        self.assertEqual(expected_counts, load_manifest(self.output_dir)["vocab"])
+
+    def test_missing_output(self):
+        self.build(WhitespaceTokenizer())
+        remove(join(self.output_dir, "web", "doc4.txt"))
+        self.write("web/doc5.txt", "A bird")
+        tokenizer = WhitespaceTokenizer()
+        voc = self.build(tokenizer)
+        self.assertEqual(3, tokenizer.n_calls)
+        self.assertEqual(voc, self.build(WhitespaceTokenizer(), rebuild=True))
+        self.assertIn("4", voc)
+        self.assertNotIn("5", voc)
+
+    def test_fingerprint(self):
+        self.build(WhitespaceTokenizer())
+        fingerprint = corpus_fingerprint(self.output_dir)
+        self.build(WhitespaceTokenizer())
+        self.assertEqual(fingerprint, corpus_fingerprint(self.output_dir))
+        self.write("web/doc1.txt", "A bird")
+        self.build(WhitespaceTokenizer())
+        self.assertNotEqual(fingerprint, corpus_fingerprint(self.output_dir))
+
+    def test_tokenizer_changed(self):
+        self.build(WhitespaceTokenizer())
+        tokenizer = WhitespaceTokenizer(lower=True)
+        voc = self.build(tokenizer)
+        self.assertEqual(22, tokenizer.n_calls)
+        self.assertNotIn("The", voc)
@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+import unittest
+from copy import deepcopy
+from os import makedirs
+from os.path import join
+
+import numpy as np
+
+from docqa.triviaqa.answer_detection import compute_answer_spans, FastNormalizedAnswerDetector, \
+    AutomatonAnswerDetector
+from docqa.triviaqa.evidence_corpus import TriviaQaEvidenceCorpusTxt
+from docqa.triviaqa.evidence_corpus_ids import TriviaQaEvidenceCorpusIds, encode_corpus
+from docqa.triviaqa.read_data import TriviaQaQuestion, SearchDoc, FreeForm
+
+
+class TestEncodedCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.encoded_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        words = ["a", "the", "The", "cat", "Cat", "sat", "dög", "東京", ".", ",", "'", "cat's", "", "new", "York"]
+        self.docs = {}
+        for i in range(30):
+            paragraphs = [[list(rng.choice(words, rng.randint(1, 8))) for _ in range(rng.randint(1, 4))]
+                          for _ in range(rng.randint(1, 8))]
+            self.docs["doc%d" % i] = "\n\n".join("\n".join(" ".join(s) for s in p) for p in paragraphs)
+        makedirs(self.source_dir, exist_ok=True)
+        makedirs(join(self.source_dir, "web"))
+        for name, text in self.docs.items():
+            with open(join(self.source_dir, "web", name + ".txt"), "w") as f:
+                f.write(text)
+        # Only part of the vocabulary, the rest should be added when encoding
+        with open(join(self.source_dir, "vocab.txt"), "w") as f:
+            f.write("cat\nsat\n東京\n")
+        self.source = TriviaQaEvidenceCorpusTxt({k: join("web", k) for k in self.docs})
+        self.source.directory = self.source_dir
+        no_map = TriviaQaEvidenceCorpusTxt()
+        no_map.directory = self.source_dir
+        encode_corpus(no_map, self.encoded_dir)
+        self.encoded = TriviaQaEvidenceCorpusIds({k: join("web", k) for k in self.docs}, self.encoded_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.encoded_dir)
+
+    def test_same_documents(self):
+        self.assertEqual(self.encoded.vocab.words[:3], ["cat", "sat", "東京"])
+        for doc in self.docs:
+            n_words = len(self.source.get_document(doc, flat=True))
+            for flat in [True, False]:
+                self.assertEqual(self.source.get_document(doc, flat=flat), self.encoded.get_document(doc, flat=flat))
+                for n_tokens in range(0, n_words + 3):
+                    self.assertEqual(self.source.get_document(doc, n_tokens, flat),
+                                     self.encoded.get_document(doc, n_tokens, flat))
+        self.assertIsNone(self.encoded.get_document("missing"))
+
+    def test_answer_spans(self):
+        rng = np.random.RandomState(1)
+        aliases = ["cat", "the cat", "new york", "cat's", "dog", "東京 cat"]
+        questions = []
+        for i in range(20):
+            docs = [SearchDoc(x, "", 0, x) for x in rng.choice(sorted(self.docs), 3, replace=False)]
+            answer = FreeForm("", "", [], list(rng.choice(aliases, 2, replace=False)), None)
+            questions.append(TriviaQaQuestion("q %d" % i, "q%d" % i, answer, [], docs))
+        expected = deepcopy(questions)
+        compute_answer_spans(expected, self.source, str.split, FastNormalizedAnswerDetector())
+        for detector in [FastNormalizedAnswerDetector(), AutomatonAnswerDetector()]:
+            actual = deepcopy(questions)
+            compute_answer_spans(actual, self.encoded, str.split, detector)
+            n_found = 0
+            for q1, q2 in zip(expected, actual):
+                for d1, d2 in zip(q1.all_docs, q2.all_docs):
+                    self.assertEqual(d1.answer_spans.tolist(), d2.answer_spans.tolist())
+                    n_found += len(d1.answer_spans)
+            self.assertGreater(n_found, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import shutil
+import tempfile
+import unittest
+from os import makedirs
+from os.path import join
+
+import numpy as np
+
+from docqa.triviaqa.evidence_corpus import TriviaQaEvidenceCorpusTxt, is_built_from
+from docqa.triviaqa.evidence_corpus_packed import TriviaQaEvidenceCorpusPacked, pack_corpus
+
+
+class TestPackedCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.packed_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        words = ["a", "cat", "sat", "dög", "東京", ".", ","]
+        self.docs = {}
+        for i in range(40):
+            paragraphs = []
+            for _ in range(rng.randint(0, 8)):
+                sents = [" ".join(rng.choice(words, rng.randint(1, 8))) for _ in range(rng.randint(1, 4))]
+                paragraphs.append("\n".join(sents))
+            # Include some of the irregular separators found in the real corpus
+            text = "".join(p + rng.choice(["\n\n", "\n\n\n", "\n\n"]) for p in paragraphs)
+            if rng.random_sample() < 0.5:
+                text = text.rstrip("\n")
+            self.docs[join("dir%d" % (i % 3), "doc%d" % i)] = text
+        for i in range(3):
+            makedirs(join(self.source_dir, "dir%d" % i))
+        for name, text in self.docs.items():
+            with open(join(self.source_dir, name + ".txt"), "w") as f:
+                f.write(text)
+        self.source = TriviaQaEvidenceCorpusTxt()
+        self.source.directory = self.source_dir
+        pack_corpus(self.source, self.packed_dir, shard_size=500)
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.packed_dir)
+
+    def test_same_documents(self):
+        packed = TriviaQaEvidenceCorpusPacked(directory=self.packed_dir)
+        self.assertEqual(sorted(self.source.list_documents()), sorted(packed.list_documents()))
+        for doc in self.docs:
+            n_words = len(self.source.get_document(doc, flat=True))
+            for flat in [True, False]:
+                self.assertEqual(self.source.get_document(doc, flat=flat), packed.get_document(doc, flat=flat))
+                for n_tokens in list(range(0, n_words + 3)):
+                    self.assertEqual(self.source.get_document(doc, n_tokens, flat),
+                                     packed.get_document(doc, n_tokens, flat))
+        self.assertIsNone(packed.get_document("missing"))
+
+    def test_file_map(self):
+        packed = TriviaQaEvidenceCorpusPacked({"id": "dir1/doc1"}, self.packed_dir)
+        self.assertEqual(self.source.get_document("dir1/doc1"), packed.get_document("id"))
+        self.assertIsNone(packed.get_document("dir1/doc1"))
+
+    def test_out_of_date(self):
+        # Packed before the source had a fingerprint or vocab
+        self.assertFalse(is_built_from(self.packed_dir, self.source_dir))
+
+        with open(join(self.source_dir, "fingerprint.txt"), "w") as f:
+            f.write("v1")
+        pack_corpus(self.source, self.packed_dir, shard_size=500)
+        self.assertTrue(is_built_from(self.packed_dir, self.source_dir))
+
+        # Source is rebuilt
+        with open(join(self.source_dir, "fingerprint.txt"), "w") as f:
+            f.write("v2")
+        self.assertFalse(is_built_from(self.packed_dir, self.source_dir))
+        self.assertTrue(is_built_from(self.packed_dir, join(self.source_dir, "missing")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from docqa.data_processing.document_splitter import MergeParagraphs, DocParagraphWithAnswers
+from docqa.triviaqa.evidence_index import build_index, EvidenceIndex, Bm25Ranker
+
+
+class InMemoryEvidence(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def list_documents(self):
+        return list(self.docs)
+
+    def get_document(self, doc_id, n_tokens=None):
+        return self.docs.get(doc_id)
+
+
+class TestEvidenceIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.vocab = ["The", "the", "a", "of", "Cat", "cat", "dog", "fish", "red", "blue", "green", "sat", "ran",
+                      "swam", "big", "small", "tree", "house", ",", "."]
+        p = np.array([4, 4, 2, 2] + [1] * 14 + [3, 3], dtype=np.float64)
+        p /= p.sum()
+        self.docs = {}
+        for doc_ix in range(30):
+            self.docs["doc%d" % doc_ix] = [[list(rng.choice(self.vocab, rng.randint(1, 10), p=p))
+                                            for _ in range(rng.randint(1, 3))] for _ in range(rng.randint(1, 10))]
+        self.splitter = MergeParagraphs(12)
+        self.stop = {"the", "a", "of"}
+        build_index(InMemoryEvidence(self.docs), self.splitter, self.dir, stop=self.stop)
+        self.questions = [list(rng.choice(self.vocab, rng.randint(1, 6))) for _ in range(30)] + [["unseen"], []]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _brute_force(self, question, k1=1.2, b=0.75):
+        paragraphs = []
+        for doc_id in sorted(self.docs):
+            for para in self.splitter.split(self.docs[doc_id]):
+                counts = Counter(w.lower() for s in para.text for w in s)
+                paragraphs.append((doc_id, para, counts))
+        avg_len = np.mean([p.n_context_words for _, p, _ in paragraphs])
+        q_counts = Counter(w.lower() for w in question
+                           if w.lower() not in self.stop and any(c.isalnum() for c in w))
+        scores = []
+        for _, para, counts in paragraphs:
+            score = 0
+            for word, q_count in q_counts.items():
+                df = sum(c[word] > 0 for _, _, c in paragraphs)
+                if df == 0 or counts[word] == 0:
+                    continue
+                idf = np.log(1 + (len(paragraphs) - df + 0.5) / (df + 0.5))
+                tf = counts[word]
+                score += q_count * idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * para.n_context_words / avg_len))
+            scores.append(score)
+        return paragraphs, np.array(scores)
+
+    def test_search(self):
+        index = EvidenceIndex(self.dir)
+        for q in self.questions:
+            _, expected = self._brute_force(q)
+            for k in [1, 3, 10]:
+                ids, scores = index.search(q, k)
+                expected_top = np.sort(expected[expected > 0])[::-1][:k]
+                self.assertTrue(np.allclose(expected_top, scores[:len(expected_top)]))
+                self.assertTrue(np.allclose(expected[ids[:len(expected_top)]], expected_top))
+
+    def test_prune(self):
+        ranker = Bm25Ranker(self.dir, 3)
+        rng = np.random.RandomState(1)
+        for q in self.questions:
+            paragraphs, expected = self._brute_force(q)
+            ixs = rng.choice(len(paragraphs), 15, replace=False)
+            candidates = [DocParagraphWithAnswers(paragraphs[i][1].text, paragraphs[i][1].start,
+                                                  paragraphs[i][1].end, None, paragraphs[i][0]) for i in ixs]
+            # Not in the index, so it has to be scored from its text
+            candidates.append(DocParagraphWithAnswers([q, q], 0, len(q) * 2, None, "other-doc"))
+            scores = ranker.score_paragraphs(q, candidates)
+            self.assertTrue(np.allclose(scores[:-1], expected[ixs]))
+
+            pruned = ranker.prune(q, candidates)
+            order = np.lexsort((np.arange(len(candidates)), -scores))[:3]
+            self.assertEqual([candidates[i] for i in order], pruned)
+
+
+if __name__ == '__main__':
+    unittest.main()
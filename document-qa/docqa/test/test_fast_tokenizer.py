@@ -0,0 +1,120 @@
+import pickle
+import random
+import unittest
+
+import nltk
+import numpy as np
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+from docqa.data_processing.fast_tokenizer import FastNltkAndPunctTokenizer, RegexSentenceSplitter, scan_tokens, \
+    get_tokenizer
+from docqa.data_processing.text_utils import NltkAndPunctTokenizer
+
+
+class UntrainedNltkAndPunctTokenizer(NltkAndPunctTokenizer):
+    """ `NltkAndPunctTokenizer` with an untrained Punkt model, so we don't need NLTK's data files """
+
+    def __init__(self):
+        self.sent_tokenzier = PunktSentenceTokenizer()
+        self.word_tokenizer = nltk.TreebankWordTokenizer()
+
+
+class UntrainedFastTokenizer(FastNltkAndPunctTokenizer):
+
+    def __init__(self):
+        self.sentence_splitter = "punkt"
+        self._sent_tokenizer = PunktSentenceTokenizer()
+
+
+SENTENCES = [
+    "The Normans (Norman: Nourmands; French: Normands; Latin: Normanni) were the people who gave their name "
+    "to Normandy, a region in France.",
+    "They were descended from Norse (\"Norman\" comes from \"Norseman\") raiders and pirates.",
+    "It's said they didn't pay $3,000 in 1066 -- or was it 2.5 million?",
+    "Mr. Smith's book (pp. 12-14) can't say; e.g. the U.S. wasn't involved!",
+    "``I cannot,'' he said, ``I'm gonna wait 'til 10:30.''",
+    "The __init__ method calls foo_bar and _private, see http://example.com/a_b?x=1&y=2.",
+    "Temperatures of 20°C—30°C − a range – are ‘common’ in “June”.",
+    "'Tis the season; 'twas the night before... Christmas.",
+    "Prices rose 5% [see Table 2] to £400/€450 {approx.} <est.>",
+    "She said \"I'll go,\" but they'd already left...",
+    "Is it 1,000,000 or 1,000? Yes: a lot!",
+    "Ends with a quote.\"",
+    "Ends with a bracket.)",
+]
+
+
+class TestScanTokens(unittest.TestCase):
+
+    def test_sentences(self):
+        reference = UntrainedNltkAndPunctTokenizer()
+        for sent in SENTENCES:
+            expected = reference.tokenize_with_inverse(sent, True)
+            tokens, spans = scan_tokens(sent)
+            self.assertEqual(expected.text[0], tokens)
+            self.assertEqual(expected.spans.tolist(), [list(x) for x in spans])
+            self.assertEqual(reference.tokenize_sentence(sent), tokens)
+
+    def test_random_agreement(self):
+        # There are a few contrived cases we don't handle (like "'tisn't" or "```_"), so only
+        # check the output is nearly always identical
+        reference = UntrainedNltkAndPunctTokenizer()
+        rng = random.Random(0)
+        alphabet = list("abcnNt'T  .,:;-_\"`()?!$1 23/&") + \
+            ["n't", "can", "not", "gon", "na", "...", "--", "''", "``", "U.S.", "wanna", "'tis", "—", "’"]
+        n_same = 0
+        n_total = 0
+        for _ in range(2000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 15)))
+            try:
+                expected = reference.tokenize_with_inverse(text, True)
+            except ValueError:
+                continue  # `convert_to_spans` can fail on a few odd quote sequences
+            tokens, spans = scan_tokens(text)
+            n_total += 1
+            n_same += expected.text[0] == tokens and expected.spans.tolist() == [list(x) for x in spans]
+        self.assertGreater(n_same / n_total, 0.99)
+
+
+class TestFastTokenizer(unittest.TestCase):
+
+    def test_same_as_nltk(self):
+        paragraph = "  ".join(SENTENCES)
+        expected = UntrainedNltkAndPunctTokenizer().tokenize_with_inverse(paragraph)
+        tokenizer = UntrainedFastTokenizer()
+        actual = tokenizer.tokenize_with_inverse(paragraph)
+        self.assertEqual(expected.text, actual.text)
+        self.assertTrue(np.array_equal(expected.spans, actual.spans))
+        self.assertEqual(expected.text, tokenizer.tokenize_paragraph(paragraph))
+        self.assertEqual(expected.get_context(), tokenizer.tokenize_paragraph_flat(paragraph))
+
+    def test_empty(self):
+        tokenizer = FastNltkAndPunctTokenizer()
+        self.assertEqual([], tokenizer.tokenize_paragraph("  "))
+        self.assertEqual((0, 2), tokenizer.tokenize_with_inverse("").spans.shape)
+        self.assertEqual([[]], tokenizer.tokenize_with_inverse("", True).text)
+
+    def test_regex_sentences(self):
+        text = "Mr. Smith went to Washington. He arrived at 5 p.m. The next day...  J. K. Rowling " \
+               "wrote it! (Really?) It was 1990. then"
+        sentences = [text[s:e] for s, e in RegexSentenceSplitter().span_tokenize(text)]
+        self.assertEqual(["Mr. Smith went to Washington.", "He arrived at 5 p.m.", "The next day...",
+                          "J. K. Rowling wrote it!", "(Really?)", "It was 1990. then"], sentences)
+
+    def test_pickle(self):
+        tokenizer = pickle.loads(pickle.dumps(FastNltkAndPunctTokenizer()))
+        self.assertEqual("regex", tokenizer.sentence_splitter)
+        self.assertEqual([["A", "test", "."]], tokenizer.tokenize_paragraph("A test."))
+
+    def test_get_tokenizer(self):
+        self.assertEqual("regex", get_tokenizer("fast-regex").sentence_splitter)
+        self.assertRaises(ValueError, get_tokenizer, "fast")
+
+    def test_punkt_model(self):
+        try:
+            expected = NltkAndPunctTokenizer()
+        except LookupError:
+            self.skipTest("Punkt model is not installed")
+        tokenizer = FastNltkAndPunctTokenizer("punkt")
+        paragraph = "  ".join(SENTENCES)
+        self.assertEqual(expected.tokenize_paragraph(paragraph), tokenizer.tokenize_paragraph(paragraph))
@@ -0,0 +1,94 @@
+import shutil
+import tempfile
+import unittest
+from copy import copy
+
+import numpy as np
+
+from docqa.data_processing.document_splitter import MergeParagraphs, TopTfIdf, FirstN, ParagraphFilter
+from docqa.data_processing.multi_paragraph_qa import MultiParagraphQuestion
+from docqa.test.fixtures import FixedStopWords, open_web_ranker, random_document, random_words
+from docqa.triviaqa.evidence_index import build_index, Bm25Ranker
+from docqa.triviaqa.read_data import TriviaQaQuestion, SearchDoc, FreeForm
+from docqa.triviaqa.training_data import ExtractSingleParagraph, ExtractMultiParagraphs
+
+
+class CopyingFilter(ParagraphFilter):
+    """ Returns copies of the paragraphs another filter selects """
+    def __init__(self, para_filter: ParagraphFilter):
+        self.para_filter = para_filter
+
+    def prune(self, question, paragraphs, doc_id=None):
+        return [copy(p) for p in self.para_filter.prune(question, paragraphs, doc_id)]
+
+
+class InMemoryEvidence(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.n_reads = 0
+
+    def list_documents(self):
+        return list(self.docs)
+
+    def get_document(self, doc_id, n_tokens=None):
+        self.n_reads += 1
+        return self.docs[doc_id]
+
+
+class TestGroupByDoc(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        docs = {}
+        for doc_ix in range(6):
+            docs["doc%d" % doc_ix] = random_document(rng, rng.randint(1, 10), 8)
+        self.evidence = InMemoryEvidence(docs)
+        self.questions = []
+        for q_ix in range(15):
+            q_docs = []
+            for doc_id in rng.choice(sorted(docs), rng.randint(1, 4), replace=False):
+                n_tokens = sum(len(s) for p in docs[doc_id] for s in p)
+                starts = rng.randint(0, n_tokens, rng.randint(0, 5))
+                doc = SearchDoc(doc_id, "", 0, doc_id)
+                doc.answer_spans = np.stack([starts, starts], axis=1).astype(np.int32)
+                q_docs.append(doc)
+            self.questions.append(TriviaQaQuestion(random_words(rng, 3), "q%d" % q_ix,
+                                                   FreeForm("cat", "cat", ["cat"], ["cat"], None), [], q_docs))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    @staticmethod
+    def _describe(x):
+        if isinstance(x, MultiParagraphQuestion):
+            return x.question_id, x.question, x.answer_text, \
+                   [(p.doc_id, p.start, p.end, p.rank, p.text, p.answer_spans.tolist()) for p in x.paragraphs]
+        else:
+            return x.question_id, x.doc_id, x.para_range, x.question, x.context, x.answer.answer_spans.tolist()
+
+    def _check(self, expected, actual):
+        self.assertEqual(expected.true_len, actual.true_len)
+        self.assertEqual([self._describe(x) for x in expected.data], [self._describe(x) for x in actual.data])
+
+    def test_same_output(self):
+        splitter = MergeParagraphs(10)
+        build_index(self.evidence, splitter, self.dir, stop=set(FixedStopWords().words))
+        self.evidence.n_reads = 0
+        # Every filter triviaqa_full_document_eval accepts, and one that returns copies
+        filters = [TopTfIdf(FixedStopWords(), 2), TopTfIdf(FixedStopWords(), 3, True), FirstN(2),
+                   open_web_ranker(2), Bm25Ranker(self.dir, 2), CopyingFilter(FirstN(3)), None]
+        for para_filter in filters:
+            for require in [True, False]:
+                for cls in [ExtractSingleParagraph, ExtractMultiParagraphs]:
+                    prep = cls(splitter, para_filter, None, False, require)
+                    expected = prep.preprocess(self.questions, self.evidence)
+                    self.evidence.n_reads = 0
+                    prep.group_by_doc = True
+                    actual = prep.preprocess(self.questions, self.evidence)
+                    self.assertLessEqual(self.evidence.n_reads, len(self.evidence.docs))
+                    self._check(expected, actual)
+
+
+if __name__ == '__main__':
+    unittest.main()
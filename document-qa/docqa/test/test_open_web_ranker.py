@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+from sklearn.metrics import pairwise_distances
+
+from docqa.data_processing.document_splitter import ShallowOpenWebRanker, ExtractedParagraph
+from docqa.test.fixtures import VOCAB, open_web_ranker, random_document, random_words
+
+
+def reference_scores(ranker: ShallowOpenWebRanker, question, paragraphs):
+    """ The per-token loop `ShallowOpenWebRanker.score_paragraphs` used before it was vectorized """
+    tfidf = ranker._tfidf
+    text = []
+    for para in paragraphs:
+        text.append(" ".join(" ".join(s) for s in para.text))
+    try:
+        para_features = tfidf.fit_transform(text)
+        q_features = tfidf.transform([" ".join(question)])
+    except ValueError:
+        return []
+
+    q_words = {x for x in question if x.lower() not in ranker._stop}
+    q_words_lower = {x.lower() for x in q_words}
+    word_matches_features = np.zeros((len(paragraphs), 2))
+    for para_ix, para in enumerate(paragraphs):
+        found = set()
+        found_lower = set()
+        for sent in para.text:
+            for word in sent:
+                if word in q_words:
+                    found.add(word)
+                elif word.lower() in q_words_lower:
+                    found_lower.add(word.lower())
+        word_matches_features[para_ix, 0] = len(found)
+        word_matches_features[para_ix, 1] = len(found_lower)
+
+    tfidf = pairwise_distances(q_features, para_features, "cosine").ravel()
+    starts = np.array([p.start for p in paragraphs])
+    log_word_start = np.log(starts/400.0 + 1)
+    first = starts == 0
+    return tfidf * ranker.TFIDF_W + ranker.LOG_WORD_START_W * log_word_start + ranker.FIRST_W * first +\
+        ranker.LOWER_WORD_W * word_matches_features[:, 1] + ranker.WORD_W * word_matches_features[:, 0]
+
+
+class TestShallowOpenWebRanker(unittest.TestCase):
+
+    def setUp(self):
+        self.ranker = open_web_ranker(3)
+
+        rng = np.random.RandomState(0)
+        # Mixed case, so words can match exactly, only after lowercasing, or both
+        vocab = VOCAB + [x.title() for x in VOCAB] + ["CAT", "Dog", "RED"]
+        self.docs = []
+        for _ in range(10):
+            paragraphs = []
+            on_token = 0
+            for sents in random_document(rng, rng.randint(1, 12), 8, vocab):
+                n_tokens = sum(len(s) for s in sents)
+                paragraphs.append(ExtractedParagraph(sents, on_token, on_token + n_tokens))
+                on_token += n_tokens
+            self.docs.append(paragraphs)
+        self.questions = [random_words(rng, rng.randint(1, 6), vocab) for _ in range(20)]
+        # Repeated words, in several cases and only stop words
+        self.questions += [["cat", "Cat", "CAT", "cat"], ["Red", "red", "dog", "Dog", "dog"],
+                           ["The", "the", "of"], ["unseen", "Unseen"]]
+
+    def test_same_as_loop(self):
+        for paragraphs in self.docs:
+            batch = self.ranker.score_paragraphs_batch(self.questions, paragraphs)
+            self.assertEqual(len(self.questions), len(batch))
+            for question, batch_scores in zip(self.questions, batch):
+                expected = reference_scores(self.ranker, question, paragraphs)
+                self.assertEqual(list(expected), list(self.ranker.score_paragraphs(question, paragraphs)))
+                self.assertEqual(list(expected), list(batch_scores))
+
+    def test_prune_batch(self):
+        for paragraphs in self.docs:
+            expected = [self.ranker.prune(q, paragraphs) for q in self.questions]
+            self.assertEqual(expected, self.ranker.prune_batch(self.questions, paragraphs))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+import numpy as np
+
+from docqa.data_processing.pre_encoded import EncodedTokenSequences
+
+
+class TestEncodedTokenSequences(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = [["the", "cat", "sat"], [], ["a", "supercalifragilistic", "word", "the", "cat"],
+                          ["x"], ["the", "dog"]]
+        self.word_to_ix = lambda w: len(w) * 10 + ord(w[0]) % 7
+        self.char_to_ix = lambda c: ord(c) - ord("a") + 2
+
+    def fill_naive(self, ixs, word_dim, char_dim, max_chars):
+        words = np.zeros((len(ixs) + 2, word_dim), dtype=np.int32)
+        chars = np.zeros((len(ixs) + 2, word_dim, char_dim), dtype=np.int32)
+        word_lens = np.zeros((len(ixs) + 2, word_dim), dtype=np.int32)
+        for i, ix in enumerate(ixs):
+            for j, word in enumerate(self.sequences[ix][:word_dim]):
+                words[i, j] = self.word_to_ix(word)
+                word = word[:min(max_chars, char_dim)]
+                word_lens[i, j] = len(word)
+                for k, c in enumerate(word):
+                    chars[i, j, k] = self.char_to_ix(c)
+        return words, chars, word_lens
+
+    def test_fill(self):
+        for max_chars in [4, 30]:
+            enc = EncodedTokenSequences.build(self.sequences, self.word_to_ix, self.char_to_ix, max_chars)
+            self.assertEqual(len(enc), len(self.sequences))
+            for ixs in [[0, 1, 2, 3, 4], [2, 2, 0], [1], [4, 3]]:
+                ixs = np.array(ixs)
+                self.assertEqual(list(enc.lengths(ixs)), [len(self.sequences[i]) for i in ixs])
+                for word_dim, char_dim in [(5, 30), (3, 3), (7, 5)]:
+                    expected = self.fill_naive(ixs, word_dim, char_dim, max_chars)
+                    # Arrays have extra rows, as they would when the last batch is smaller
+                    actual = tuple(np.zeros_like(x) for x in expected)
+                    enc.fill(ixs, *actual)
+                    for e, a in zip(expected, actual):
+                        self.assertTrue(np.array_equal(e, a))
+
+    def test_words_only(self):
+        enc = EncodedTokenSequences.build(self.sequences, self.word_to_ix, None, 10)
+        words = np.zeros((2, 4), dtype=np.int32)
+        enc.fill(np.array([2, 0]), words, None, None)
+        expected = self.fill_naive([2, 0], 4, 1, 10)[0][:2]
+        self.assertTrue(np.array_equal(expected, words))
+
+
+class TestEncoderState(unittest.TestCase):
+
+    def test_old_version(self):
+        try:
+            from docqa.encoder import DocumentAndQuestionEncoder, SingleSpanAnswerEncoder
+        except ImportError:
+            self.skipTest("Tensorflow is not installed")
+        # State as saved by a version 2 encoder, which is restored without calling `__init__`
+        state = dict(version=2, state=dict(answer_encoder=SingleSpanAnswerEncoder(), doc_size_th=None,
+                                           word_featurizer=None))
+        encoder = DocumentAndQuestionEncoder.__new__(DocumentAndQuestionEncoder)
+        encoder.__setstate__(state)
+        self.assertIsNone(encoder._get_pre_encoded_rows([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from docqa.utils import CachingResourceLoader
+
+
+class TestCachingResourceLoader(unittest.TestCase):
+
+    def setUp(self):
+        words = ["the", "The", "cat", "dog", "fish", "bird"]
+        self.vecs = {w: np.full(4, i, dtype=np.float32) for i, w in enumerate(words)}
+        self.requests = []
+
+    def load(self, vec_name, voc=None):
+        self.requests.append(None if voc is None else set(voc))
+        if voc is None:
+            return dict(self.vecs)
+        voc = set(x.lower() for x in voc)
+        return {k: v for k, v in self.vecs.items() if k.lower() in voc}
+
+    @staticmethod
+    def partial(vec_name):
+        return vec_name != "text"
+
+    def test_fetch_missing(self):
+        loader = CachingResourceLoader(self.load, can_load_partial=self.partial)
+        self.assertEqual(set(loader.load_word_vec("v", ["THE", "cat"]).keys()), {"the", "The", "cat"})
+        self.assertEqual(set(loader.load_word_vec("v", ["cat", "dog", "unk"]).keys()), {"cat", "dog"})
+        self.assertEqual(set(loader.load_word_vec("v", ["unk", "the"]).keys()), {"the", "The"})
+        self.assertEqual(self.requests, [{"the", "cat"}, {"dog", "unk"}])
+        stats = loader.get_stats()
+        self.assertEqual(stats["misses"], 4)
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["resident_bytes"], 4 * 16)
+
+    def test_evict(self):
+        loader = CachingResourceLoader(self.load, max_bytes=2 * 16, can_load_partial=self.partial)
+        loader.load_word_vec("v", ["cat"])
+        loader.load_word_vec("v", ["dog"])
+        loader.load_word_vec("v", ["fish"])
+        self.assertLessEqual(loader.resident_bytes(), 2 * 16)
+        out = loader.load_word_vec("v", ["cat", "bird", "fish"])
+        self.assertEqual(set(out.keys()), {"cat", "bird", "fish"})
+        self.assertEqual(self.requests[-1], {"cat", "bird"})
+        self.assertTrue(np.array_equal(out["bird"], self.vecs["bird"]))
+
+    def test_full_load(self):
+        loader = CachingResourceLoader(self.load, can_load_partial=self.partial)
+        self.assertEqual(set(loader.load_word_vec("v").keys()), set(self.vecs.keys()))
+        self.assertEqual(set(loader.load_word_vec("v", ["cat"]).keys()), {"cat"})
+        self.assertEqual(self.requests, [None])
+
+    def test_text_vectors(self):
+        # Vectors we can't partially load are read once, and not evicted
+        loader = CachingResourceLoader(self.load, max_bytes=16, can_load_partial=self.partial)
+        self.assertEqual(set(loader.load_word_vec("text", ["cat"]).keys()), {"cat"})
+        self.assertEqual(set(loader.load_word_vec("text", ["dog", "unk"]).keys()), {"dog"})
+        self.assertEqual(set(loader.load_word_vec("text").keys()), set(self.vecs.keys()))
+        self.assertEqual(self.requests, [None])
+        self.assertEqual(loader.resident_bytes(), len(self.vecs) * 16)
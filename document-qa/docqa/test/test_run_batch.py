@@ -0,0 +1,94 @@
+import json
+import sys
+import unittest
+import zlib
+from argparse import Namespace
+from os.path import dirname, join, abspath
+
+import numpy as np
+
+from docqa.data_processing.qa_training_data import ParagraphAndQuestion
+
+# run_batch.py is a script that imports `util` from its own directory
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), "run"))
+import run_batch
+
+
+FETCHES = ["start_logits", "end_logits", "none_logit", "context_rep", "m1", "m2"]
+
+
+class StubModel(object):
+    def encode(self, batch, is_train):
+        return dict(batch=batch)
+
+
+class StubSession(object):
+    """
+    Returns padded outputs that only depend on each example's own words, padding is filled with
+    large values so they would show up in the beam or the pooled vector if they were not sliced off
+    """
+    dim = 3
+
+    @staticmethod
+    def _word_vec(word):
+        return np.random.RandomState(zlib.crc32(word.encode("utf-8"))).normal(size=StubSession.dim + 2)
+
+    def run(self, fetches, feed_dict):
+        batch = feed_dict["batch"]
+        max_len = max(len(x.context) for x in batch)
+        start = np.full((len(batch), max_len), 1000.0)
+        end = np.full((len(batch), max_len), 1000.0)
+        rep = np.full((len(batch), max_len, self.dim), 1000.0)
+        none_logit = np.zeros(len(batch))
+        for i, x in enumerate(batch):
+            q_bias = sum(self._word_vec(w)[0] for w in x.question)
+            for j, word in enumerate(x.context):
+                vec = self._word_vec(word)
+                start[i, j] = vec[0] + q_bias
+                end[i, j] = vec[1]
+                rep[i, j] = vec[2:]
+            none_logit[i] = q_bias
+        out = dict(start_logits=start, end_logits=end, none_logit=none_logit,
+                   context_rep=rep, m1=rep * 2, m2=rep - 1)
+        # A fetch of (name, 0) is the 0-th example, like the single line fetches in `run_batch.main`
+        return [out[f] if isinstance(f, str) else out[f[0]][f[1]] for f in fetches]
+
+
+class TestRunBatched(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        words = ["the", "cat", "sat", "on", "a", "mat", "dog", "ran", "red", "blue"]
+        self.window = []
+        for line_ix in range(11):
+            tokens = list(rng.choice(words, rng.randint(1, 15)))
+            question = list(rng.choice(words, rng.randint(1, 4)))
+            doc_raw = " ".join(tokens)
+            if line_ix % 3 == 0:
+                token_spans = None  # Found by searching the document, as with a text preprocessor
+            else:
+                starts = np.cumsum([0] + [len(w) + 1 for w in tokens[:-1]])
+                token_spans = np.stack([starts, starts + [len(w) for w in tokens]], axis=1)
+            ex = [ParagraphAndQuestion(tokens, question, None, "user-question0")]
+            self.window.append((doc_raw, " ".join(question) + " %d?" % line_ix, [tokens], ex, token_spans))
+
+    def tearDown(self):
+        run_batch.OPTS = None
+
+    def _lines(self, results):
+        return [json.dumps(x) + "\n" for x in results]
+
+    def test_same_as_single(self):
+        for beam_size, max_span_len, no_vec in [(5, None, False), (0, 3, False), (2, 4, True)]:
+            for batch_size in [1, 3, 4, 20]:
+                run_batch.OPTS = Namespace(beam_size=beam_size, max_span_len=max_span_len, no_vec=no_vec,
+                                           batch_size=batch_size)
+                expected = run_batch.run_single(StubSession(), StubModel(), [(x, 0) for x in FETCHES], self.window)
+                actual = run_batch.run_batched(StubSession(), StubModel(), FETCHES, self.window)
+                # In input order, not sorted by context length
+                self.assertEqual([x[1] for x in self.window], [x["question"] for x in actual])
+                self.assertEqual(self._lines(expected), self._lines(actual))
+
+
+if __name__ == '__main__':
+    unittest.main()
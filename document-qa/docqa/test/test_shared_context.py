@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from docqa.data_processing.qa_training_data import ParagraphAndQuestion, ParagraphAndQuestionSpec
+from docqa.doc_qa_models import Attention
+from docqa.encoder import DocumentAndQuestionEncoder, SingleSpanAnswerEncoder
+from docqa.evaluator import EvaluatorRunner, SharedContextEvaluatorRunner
+from docqa.nn.attention import BiAttention
+from docqa.nn.embedder import FixedWordEmbedder
+from docqa.nn.layers import NullBiMapper, NullMapper, ChainConcat
+from docqa.nn.recurrent_layers import BiRecurrentMapper, LstmCellSpec
+from docqa.nn.similarity_layers import TriLinear
+from docqa.nn.span_prediction import BoundsPredictor
+from docqa.shared_context import SharedContextRunner
+from docqa.utils import ResourceLoader
+
+
+class TestSharedContextRunner(unittest.TestCase):
+
+    def setUp(self):
+        tf.reset_default_graph()
+        rng = np.random.RandomState(0)
+        words = ["the", "a", "cat", "dog", "sat", "ran", "on", "mat", "who", "what", "?"]
+        vecs = {w: rng.normal(size=8).astype(np.float32) for w in words}
+        loader = ResourceLoader(lambda name, voc=None: vecs)
+
+        self.model = Attention(
+            encoder=DocumentAndQuestionEncoder(SingleSpanAnswerEncoder()),
+            preprocess=None,
+            word_embed=FixedWordEmbedder(vec_name="test", word_vec_init_scale=0, learn_unk=False),
+            word_embed_layer=None,
+            char_embed=None,
+            embed_mapper=BiRecurrentMapper(LstmCellSpec(6)),
+            question_mapper=None,
+            context_mapper=None,
+            memory_builder=NullBiMapper(),
+            attention=BiAttention(TriLinear(bias=True), True),
+            match_encoder=NullMapper(),
+            predictor=BoundsPredictor(ChainConcat(
+                start_layer=BiRecurrentMapper(LstmCellSpec(6)),
+                end_layer=BiRecurrentMapper(LstmCellSpec(6))))
+        )
+        self.model.set_input_spec(ParagraphAndQuestionSpec(batch_size=None), set(words), loader)
+        self.prediction = self.model.get_prediction()
+        self.sess = tf.Session()
+        self.sess.run(tf.global_variables_initializer())
+
+        contexts = [list(rng.choice(words, n)) for n in [12, 5, 9]]
+        self.batches = []
+        for batch_ix in range(3):
+            batch = []
+            for i in range(4):
+                # Questions often share a context, both within and across batches
+                context = contexts[rng.randint(0, len(contexts))]
+                question = list(rng.choice(words, rng.randint(2, 6)))
+                batch.append(ParagraphAndQuestion(context, question, None, "q%d-%d" % (batch_ix, i)))
+            self.batches.append(batch)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def assert_same_logits(self, batch, expected, actual):
+        for i, x in enumerate(batch):
+            n = x.n_context_words
+            for e, a in zip(expected, actual):
+                self.assertTrue(np.allclose(e[i, :n], a[i, :n], atol=1e-5))
+
+    def test_same_as_sess_run(self):
+        fetches = [self.prediction.start_logits, self.prediction.end_logits]
+        runner = SharedContextRunner(self.model, cache_size=2)
+        for batch in self.batches:
+            expected = self.sess.run(fetches, feed_dict=self.model.encode(batch, False))
+            self.assert_same_logits(batch, expected, runner.run(self.sess, fetches, batch))
+        stats = runner.get_stats()
+        self.assertEqual(12, stats["questions"])
+        self.assertLess(stats["contexts_encoded"], 12)
+
+    def test_evaluator_runner(self):
+        fetches = [self.prediction.start_logits, self.prediction.end_logits]
+        expected_runner = EvaluatorRunner([], self.model)
+        expected_runner.set_input(self.prediction)
+        shared_runner = SharedContextEvaluatorRunner([], self.model)
+        shared_runner.set_input(self.prediction)
+        for batch in self.batches:
+            self.assert_same_logits(batch, expected_runner._run_batch(self.sess, fetches, batch),
+                                    shared_runner._run_batch(self.sess, fetches, batch))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from docqa.data_processing.text_utils import NltkAndPunctTokenizer
+
+
+class TestConvertToSpans(unittest.TestCase):
+
+    def test_quotes(self):
+        raw = "He said ``hi'' and \"bye\"  ''ok''"
+        sentences = [["He", "said", "``", "hi", "''"], ["and", "``", "bye", "''", "''", "ok", "``"]]
+        spans = NltkAndPunctTokenizer.convert_to_spans(raw, sentences)
+        self.assertEqual([[raw[s:e] for s, e in sent] for sent in spans],
+                         [["He", "said", "``", "hi", "''"], ["and", "\"", "bye", "\"", "''", "ok", "''"]])
+
+    def test_missing_token(self):
+        with self.assertRaises(ValueError):
+            NltkAndPunctTokenizer.convert_to_spans("a b", [["a", "c"]])
+        with self.assertRaises(ValueError):
+            NltkAndPunctTokenizer.convert_to_spans("a b", [["a", "b", "``"]])
+        with self.assertRaises(ValueError):
+            NltkAndPunctTokenizer.convert_to_spans("b a", [["a", "b"]])
+
+    def test_long_document(self):
+        tokens = ["\"" if i % 3 == 0 else "word%d" % i for i in range(20000)]
+        raw = " ".join(tokens)
+        spans = NltkAndPunctTokenizer.convert_to_spans(raw, [tokens[:100], tokens[100:]])
+        self.assertEqual(tokens, [raw[s:e] for sent in spans for s, e in sent])
+
@@ -0,0 +1,82 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from docqa.data_processing.document_splitter import TopTfIdf, ExtractedParagraph
+from docqa.test.fixtures import FixedStopWords, random_document, random_words
+
+
+class TestTfIdfCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.docs = {}
+        for doc_ix in range(5):
+            paragraphs = []
+            on_token = 0
+            for sents in random_document(rng, rng.randint(2, 8), 6):
+                n_tokens = sum(len(s) for s in sents)
+                paragraphs.append(ExtractedParagraph(sents, on_token, on_token + n_tokens))
+                on_token += n_tokens
+            # Identical paragraphs, so we exercise the tie-breaking
+            paragraphs.append(ExtractedParagraph(paragraphs[0].text, on_token, on_token + paragraphs[0].n_context_words))
+            self.docs["doc%d" % doc_ix] = paragraphs
+        self.questions = [random_words(rng, rng.randint(1, 5)) for _ in range(20)] + [["unseen"]]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assert_same(self, expected: TopTfIdf, actual: TopTfIdf):
+        for doc_id, paragraphs in self.docs.items():
+            for q in self.questions:
+                self.assertEqual([x.start for x in expected.prune(q, paragraphs)],
+                                 [x.start for x in actual.prune(q, paragraphs, doc_id)])
+                self.assertEqual([(x.start, d) for x, d in expected.dists(q, paragraphs)],
+                                 [(x.start, d) for x, d in actual.dists(q, paragraphs, doc_id)])
+
+    def test_cached_ranking(self):
+        for filter_dist_one in [True, False]:
+            expected = TopTfIdf(FixedStopWords(), 3, filter_dist_one)
+            cached = TopTfIdf(FixedStopWords(), 3, filter_dist_one)
+            cached.enable_cache(max_docs=2)
+            self.assert_same(expected, cached)
+
+    def test_persisted(self):
+        expected = TopTfIdf(FixedStopWords(), 4)
+        cached = TopTfIdf(FixedStopWords(), 4)
+        cached.enable_cache(cache_dir=self.dir)
+        self.assert_same(expected, cached)
+
+        # Only the cache's settings are pickled, the new copy has to read the persisted indices
+        cached = pickle.loads(pickle.dumps(cached))
+        self.assertEqual(len(cached._cache._cache), 0)
+        self.assertEqual(cached._cache.cache_dir, self.dir)
+        self.assert_same(expected, cached)
+
+    def test_disk_only(self):
+        expected = TopTfIdf(FixedStopWords(), 4)
+        cached = TopTfIdf(FixedStopWords(), 4)
+        cached.enable_cache(max_docs=0, cache_dir=self.dir)
+        self.assert_same(expected, cached)
+        self.assertEqual(len(cached._cache._cache), 0)
+        self.assertEqual(len(self.docs), len(os.listdir(self.dir)))
+
+    def test_retokenized(self):
+        cached = TopTfIdf(FixedStopWords(), 1)
+        cached.enable_cache(cache_dir=self.dir)
+        doc = [ExtractedParagraph([["red", "cat"]], 0, 2), ExtractedParagraph([["blue", "dog"]], 2, 4)]
+        self.assertEqual(0, cached.prune(["cat"], doc, "doc")[0].start)
+
+        # Same bounds but different text, e.g., after the corpus was re-tokenized
+        changed = [ExtractedParagraph([["red", "fish"]], 0, 2), ExtractedParagraph([["blue", "cat"]], 2, 4)]
+        cached = pickle.loads(pickle.dumps(cached))
+        self.assertEqual(2, cached.prune(["cat"], changed, "doc")[0].start)
+
+
+if __name__ == '__main__':
+    unittest.main()
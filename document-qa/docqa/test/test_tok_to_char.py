@@ -0,0 +1,42 @@
+import re
+import unittest
+
+from docqa.data_processing.document_splitter import Truncate
+from docqa.data_processing.text_utils import NltkAndPunctTokenizer
+from docqa.run.util import make_tok_to_char, spans_to_tok_to_char, tokenize_document, get_paragraph_spans
+from docqa.utils import flatten_iterable
+
+
+class TestTokToChar(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.tokenizer = NltkAndPunctTokenizer()
+        except LookupError:
+            self.skipTest("NLTK's punkt tokenizer is not installed")
+
+    def test_matches_search(self):
+        docs = [
+            "He said ``hello'' to me -- twice.  It cost $5−3 in 1999—2000.\n\n"
+            "  Second paragraph: \"quoted\" text's end.",
+            "Hyphen-ated words/slashes ~ and 50° degrees. ‘Single’ quotes” ok!\n"
+            "Last_line __wow___ here",
+            "One line\n",
+            "   Leading space. And   multiple   spaces here ."
+        ]
+        for doc in docs:
+            doc_toks, spans = tokenize_document(self.tokenizer, doc)
+            self.assertEqual(doc_toks, [self.tokenizer.tokenize_paragraph(p)
+                                        for p in re.split(r"\s*\n\s*", doc)])
+            tokens = flatten_iterable(flatten_iterable(doc_toks))
+            self.assertEqual(make_tok_to_char(doc, tokens), spans_to_tok_to_char(spans))
+
+            # Also after truncating
+            para = Truncate(5).split(doc_toks)[0]
+            tokens = flatten_iterable(para.text)
+            self.assertEqual(make_tok_to_char(doc, tokens),
+                             spans_to_tok_to_char(get_paragraph_spans(spans, para)))
+
+
+if __name__ == '__main__':
+    unittest.main()
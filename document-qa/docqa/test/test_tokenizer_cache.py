@@ -0,0 +1,108 @@
+import pickle
+import re
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from docqa.data_processing.text_utils import ParagraphWithInverse
+from docqa.data_processing.tokenizer_cache import CachedTokenizer
+
+
+class CountingTokenizer(object):
+    """ Splits sentences on periods and words on whitespace, and counts how often it is called """
+
+    def __init__(self):
+        self.n_calls = 0
+
+    def clean_text(self, word):
+        return word
+
+    def tokenize_sentence(self, sent):
+        return sent.split()
+
+    def tokenize_with_inverse(self, paragraph: str, is_sentence: bool=False) -> ParagraphWithInverse:
+        self.n_calls += 1
+        text, spans = [], []
+        for sent in re.finditer("[^.]+\\.?", paragraph):
+            words = list(re.finditer("\\S+", sent.group()))
+            if len(words) > 0:
+                text.append([w.group() for w in words])
+                spans += [(sent.start() + w.start(), sent.start() + w.end()) for w in words]
+        return ParagraphWithInverse(text, paragraph, np.array(spans, dtype=np.int32).reshape((-1, 2)))
+
+    def tokenize_paragraph(self, paragraph: str):
+        return self.tokenize_with_inverse(paragraph).text
+
+
+class TestCachedTokenizer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        words = ["the", "a", "cat.", "sat", "on", "mat.", "dog", "ran", "été"]
+        self.paragraphs = [" ".join(rng.choice(words, rng.randint(1, 40))) for _ in range(30)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_output(self):
+        tokenizer = CountingTokenizer()
+        cached = CachedTokenizer(CountingTokenizer())
+        for _ in range(2):
+            for para in self.paragraphs:
+                expected = tokenizer.tokenize_with_inverse(para)
+                actual = cached.tokenize_with_inverse(para)
+                self.assertEqual(expected.text, actual.text)
+                self.assertEqual(expected.spans.tolist(), actual.spans.tolist())
+                self.assertEqual(para, actual.original_text)
+                self.assertEqual(tokenizer.tokenize_paragraph(para), cached.tokenize_paragraph(para))
+        self.assertEqual(len(self.paragraphs) * 2, cached.tokenizer.n_calls)
+        self.assertEqual(len(self.paragraphs) * 2, cached.hits)
+
+    def test_copies_are_independent(self):
+        cached = CachedTokenizer(CountingTokenizer())
+        para = self.paragraphs[0]
+        out = cached.tokenize_with_inverse(para)
+        out.text[0][0] = "modified"
+        out.spans[0] = -1
+        again = cached.tokenize_with_inverse(para)
+        self.assertNotEqual("modified", again.text[0][0])
+        self.assertTrue(np.all(again.spans >= 0))
+
+    def test_disk_cache(self):
+        cached = CachedTokenizer(CountingTokenizer(), self.tmp_dir)
+        for para in self.paragraphs:
+            cached.tokenize_with_inverse(para)
+
+        # A new instance, i.e., a later run or another process, reads from the database
+        other = CachedTokenizer(CountingTokenizer(), self.tmp_dir)
+        for para in self.paragraphs:
+            self.assertEqual(cached.tokenize_with_inverse(para).text, other.tokenize_with_inverse(para).text)
+        self.assertEqual(0, other.tokenizer.n_calls)
+        self.assertEqual(len(self.paragraphs), other.hits)
+
+    def test_pickle(self):
+        cached = CachedTokenizer(CountingTokenizer(), self.tmp_dir, max_memory_mb=16)
+        cached.tokenize_with_inverse(self.paragraphs[0])
+        restored = pickle.loads(pickle.dumps(cached))
+        self.assertEqual(self.tmp_dir, restored.cache_dir)
+        self.assertEqual(16, restored.max_memory_mb)
+        self.assertEqual(0, len(restored._memory))
+        self.assertEqual(cached.tokenize_paragraph(self.paragraphs[0]),
+                         restored.tokenize_paragraph(self.paragraphs[0]))
+
+    def test_memory_limit(self):
+        cached = CachedTokenizer(CountingTokenizer(), max_memory_mb=200 / 2**20)
+        for para in self.paragraphs:
+            cached.tokenize_with_inverse(para)
+        self.assertLessEqual(cached._memory_bytes, 200)
+        self.assertLess(len(cached._memory), len(self.paragraphs))
+
+        # Most recently used paragraph is still cached
+        n_calls = cached.tokenizer.n_calls
+        cached.tokenize_with_inverse(self.paragraphs[-1])
+        self.assertEqual(n_calls, cached.tokenizer.n_calls)
+        cached.tokenize_with_inverse(self.paragraphs[0])
+        self.assertEqual(n_calls + 1, cached.tokenizer.n_calls)
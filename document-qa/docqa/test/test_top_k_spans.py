@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+from scipy.special import logsumexp
+
+from docqa.data_processing.span_data import top_k_spans
+from docqa.run.util import logits_to_probs
+
+
+class TestTopKSpans(unittest.TestCase):
+
+    def brute_force(self, start, end, none_logit, bound):
+        scores = {}
+        for i in range(len(start)):
+            for j in range(i, len(end)):
+                if bound is None or j - i < bound:
+                    scores[(i, j)] = start[i] + end[j]
+        if none_logit is not None:
+            scores[(-1, -1)] = none_logit
+        return logsumexp(list(scores.values())), scores
+
+    def test_against_brute_force(self):
+        rng = np.random.RandomState(0)
+        for trial in range(200):
+            n = rng.randint(1, 25)
+            start = rng.normal(size=n) * 3
+            end = rng.normal(size=n) * 3
+            if trial % 4 == 0:
+                # Lots of ties
+                start, end = np.round(start), np.round(end)
+            bound = None if trial % 2 == 0 else rng.randint(1, 8)
+            none_logit = None if trial % 3 == 0 else rng.normal() * 3
+            k = None if trial % 5 == 0 else rng.randint(1, 15)
+
+            log_z, scores = self.brute_force(start, end, none_logit, bound)
+            (out_log_z, spans, log_probs), = top_k_spans([start], [end], [n], k, [none_logit], bound)
+
+            self.assertAlmostEqual(log_z, out_log_z, places=9)
+            expected = sorted(scores.values(), reverse=True)
+            if k is not None:
+                expected = expected[:k]
+            self.assertTrue(np.allclose(expected, log_probs + log_z))
+            self.assertTrue(np.allclose([scores[tuple(x)] for x in spans], log_probs + log_z))
+            self.assertEqual(len(set(tuple(x) for x in spans)), len(spans))
+
+    def test_stable(self):
+        logits = np.array([1000.0, -1000.0, 2000.0, 0.0])
+        log_z, spans, log_probs = top_k_spans([logits], [logits], [4], 2, [0.0])[0]
+        self.assertAlmostEqual(log_z, 4000.0)
+        self.assertEqual([tuple(x) for x in spans], [(2, 2), (0, 2)])
+        self.assertAlmostEqual(log_probs[0], 0.0)
+
+    def test_padded_batch(self):
+        rng = np.random.RandomState(1)
+        start, end = rng.normal(size=(3, 10)), rng.normal(size=(3, 10))
+        lens = [10, 4, 7]
+        batch = top_k_spans(start, end, lens, 5, np.zeros(3), 3)
+        for i, n in enumerate(lens):
+            single = top_k_spans([start[i, :n]], [end[i, :n]], [n], 5, [0.0], 3)[0]
+            self.assertAlmostEqual(batch[i][0], single[0])
+            self.assertTrue(np.array_equal(batch[i][1], single[1]))
+            self.assertTrue(np.all(batch[i][1] < n))
+
+
+class TestLogitsToProbs(unittest.TestCase):
+
+    def test_unlimited_beam(self):
+        document = "a bb c"
+        tokens = ["a", "bb", "c"]
+        token_spans = np.array([[0, 1], [2, 4], [5, 6]])
+        start, end = np.array([0.5, -1.0, 2.0]), np.array([1.0, 0.0, -0.5])
+        for beam_size in [None, 0]:
+            beam, p_na = logits_to_probs(document, tokens, start, end, 0.0,
+                                         beam_size=beam_size, max_span_len=0,
+                                         token_spans=token_spans)
+            # All 6 spans with start <= end, plus the no-answer option
+            self.assertEqual(7, len(beam))
+            self.assertAlmostEqual(1.0, sum(p for _, p in beam))
+            self.assertIn("a bb c", [phrase for phrase, _ in beam])
+        beam, _ = logits_to_probs(document, tokens, start, end, 0.0, beam_size=2,
+                                  token_spans=token_spans)
+        self.assertEqual(2, len(beam))
+
+
+if __name__ == '__main__':
+    unittest.main()
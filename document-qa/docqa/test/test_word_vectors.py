@@ -0,0 +1,40 @@
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from docqa.data_processing.word_vectors import load_word_vector_file, convert_word_vector_file
+
+
+class TestBinaryWordVectors(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        words = ["the", "The", "THE", "cat", "Cat", "été", "Été", "zebra", "a", "cat"]
+        self.text_file = join(self.dir, "vecs.txt")
+        with open(self.text_file, "w", encoding="utf-8") as f:
+            for word in words:
+                vec = rng.uniform(-1, 1, 4).astype(np.float32)
+                f.write(word + " " + " ".join(str(x) for x in vec) + "\n")
+        self.binary_dir = join(self.dir, "vecs.vecs")
+        convert_word_vector_file(self.text_file, self.binary_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assert_same(self, expected, actual):
+        self.assertEqual(set(expected.keys()), set(actual.keys()))
+        for k, v in expected.items():
+            self.assertTrue(np.array_equal(v, actual[k]))
+
+    def test_full(self):
+        self.assert_same(load_word_vector_file(self.text_file),
+                         load_word_vector_file(self.binary_dir))
+
+    def test_subset(self):
+        for voc in [["the"], ["CAT", "dog"], ["ÉTÉ", "zebra", "a"], []]:
+            self.assert_same(load_word_vector_file(self.text_file, voc),
+                             load_word_vector_file(self.binary_dir, voc))
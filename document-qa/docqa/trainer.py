@@ -17,7 +17,8 @@ from docqa import configurable
 from docqa.configurable import Configurable
 from docqa.data_processing.preprocessed_corpus import PreprocessedData
 from docqa.dataset import TrainingData, Dataset
-from docqa.evaluator import Evaluator, Evaluation, AysncEvaluatorRunner, EvaluatorRunner
+from docqa.evaluator import Evaluator, Evaluation, AysncEvaluatorRunner, EvaluatorRunner, \
+    SharedContextEvaluatorRunner
 from docqa.model import Model
 from docqa.model_dir import ModelDir
 
@@ -94,7 +95,8 @@ class TrainParams(Configurable):
                  eval_at_zero: bool = False,
                  monitor_ema: float = .999,
                  ema: Optional[float] = None,
-                 best_weights: Optional[Tuple[str, str]] = None
+                 best_weights: Optional[Tuple[str, str]] = None,
+                 pre_encode: bool = False
                  ):
         """
         :param opt: Optimizer to use
@@ -111,6 +113,7 @@ class TrainParams(Configurable):
         :param monitor_ema: EMA weights for monitor functions
         :param ema: EMA to use on the trainable parameters
         :param best_weights: Store the weights with the highest scores on the given eval dataset/metric
+        :param pre_encode: Map the text of the datasets to ids once before training, instead of every batch
         """
         self.async_encoding = async_encoding
         self.regularization_weight = regularization_weight
@@ -126,6 +129,13 @@ class TrainParams(Configurable):
         self.save_period = save_period
         self.eval_samples = eval_samples
         self.best_weights = best_weights
+        self.pre_encode = pre_encode
+
+    def __setstate__(self, state):
+        fields = state["state"] if "state" in state else state
+        if "pre_encode" not in fields:
+            fields["pre_encode"] = False
+        super().__setstate__(state)
 
 
 def save_train_start(out,
@@ -346,6 +356,8 @@ def _train(model: Model,
 
     print("Init model...")
     model.set_inputs([train] + list(eval_datasets.values()), loader)
+    if train_params.pre_encode:
+        model.pre_encode([train] + list(eval_datasets.values()))
 
     print("Setting up model prediction / tf...")
 
@@ -480,6 +492,8 @@ def _train_async(model: Model,
 
     # spec the model for the given datasets
     model.set_inputs([train] + list(eval_datasets.values()), loader)
+    if train_params.pre_encode:
+        model.pre_encode([train] + list(eval_datasets.values()))
     placeholders = model.get_placeholders()
 
     train_queue = tf.FIFOQueue(train_params.async_encoding, [x.dtype for x in placeholders], name="train_queue")
@@ -643,11 +657,16 @@ def _train_async(model: Model,
 
 
 def test(model: Model, evaluators, datasets: Dict[str, Dataset], loader, checkpoint,
-         ema=True, aysnc_encoding=None, sample=None) -> Dict[str, Evaluation]:
+         ema=True, aysnc_encoding=None, sample=None, share_contexts=False) -> Dict[str, Evaluation]:
     print("Setting up model")
     model.set_inputs(list(datasets.values()), loader)
 
-    if aysnc_encoding:
+    if share_contexts:
+        if aysnc_encoding:
+            raise ValueError("Can't share contexts when encoding asynchronously")
+        evaluator_runner = SharedContextEvaluatorRunner(evaluators, model)
+        inputs = model.get_placeholders()
+    elif aysnc_encoding:
         evaluator_runner = AysncEvaluatorRunner(evaluators, model, aysnc_encoding)
         inputs = evaluator_runner.dequeue_op
     else:
@@ -1,13 +1,15 @@
 import re
 import string
+from collections import OrderedDict
+from functools import lru_cache
 
 import numpy as np
 from tqdm import tqdm
-from typing import List
+from typing import List, Set, Tuple
 
 from docqa.triviaqa.read_data import TriviaQaQuestion
 from docqa.triviaqa.trivia_qa_eval import normalize_answer, f1_score
-from docqa.utils import flatten_iterable, split
+from docqa.utils import flatten_iterable, group
 
 """
 Tools for turning the aliases and answer strings from TriviaQA into labelled spans
@@ -87,11 +89,43 @@ class FastNormalizedAnswerDetector(object):
     def set_question(self, normalized_aliases):
         self.answer_tokens = normalized_aliases
 
+    def normalize_word(self, word: str) -> str:
+        return word.lower().strip(self.strip)
+
+    def normalize_paragraph(self, para) -> List[str]:
+        """ Flat list of normalized words, independent of the question so it can be cached """
+        strip = self.strip
+        return [w.lower().strip(strip) for w in flatten_iterable(para)]
+
+    def normalize_paragraph_ids(self, para_ids: np.ndarray, vocab) -> List[int]:
+        """ `normalize_paragraph` for a paragraph given as a flat array of ids from `vocab`, an `EvidenceVocab`,
+        each word in the vocabulary is only normalized once """
+        normalized_ids, _ = vocab.map_words(self.normalize_word)
+        return normalized_ids[para_ids].tolist()
+
+    def find_normalized(self, words: List[str]):
+        return self._find(words, self.answer_tokens, self.skip)
+
+    def find_normalized_ids(self, words: List[int], vocab):
+        _, normalized_ix = vocab.map_words(self.normalize_word)
+        skip = {normalized_ix[x] for x in self.skip if x in normalized_ix}
+        answer_ids = []
+        for answer in self.answer_tokens:
+            if all(x in normalized_ix for x in answer):
+                answer_ids.append([normalized_ix[x] for x in answer])
+        return self._find(words, answer_ids, skip)
+
+    def any_found_ids(self, para_ids: np.ndarray, vocab):
+        """ `any_found` for a paragraph given as a flat array of ids from `vocab` """
+        return self.find_normalized_ids(self.normalize_paragraph_ids(para_ids, vocab), vocab)
+
     def any_found(self, para):
-        # Normalize the paragraph
-        words = [w.lower().strip(self.strip) for w in flatten_iterable(para)]
+        return self.find_normalized(self.normalize_paragraph(para))
+
+    @staticmethod
+    def _find(words, answer_tokens, skip):
         occurances = []
-        for answer_ix, answer in enumerate(self.answer_tokens):
+        for answer_ix, answer in enumerate(answer_tokens):
             # Locations where the first word occurs
             word_starts = [i for i, w in enumerate(words) if answer[0] == w]
             n_tokens = len(answer)
@@ -105,7 +139,7 @@ class FastNormalizedAnswerDetector(object):
                     if answer[ans_token] == next:
                         ans_token += 1
                         end += 1
-                    elif next in self.skip:
+                    elif next in skip:
                         end += 1
                     else:
                         break
@@ -114,6 +148,116 @@ class FastNormalizedAnswerDetector(object):
         return list(set(occurances))
 
 
+class AliasAutomaton(object):
+    """
+    Trie over the token sequences of a set of aliases that finds every occurrence of all of them in one pass
+    over a paragraph, with the same semantics as `FastNormalizedAnswerDetector`: an occurrence must start
+    with the alias's first token, and while matching, tokens in `skip` can be passed over unless they are
+    the alias's next token.
+
+    Each partial match is tracked as (start, trie node, excluded tokens), where `excluded` are the children
+    of the node that aliases already advanced into from this state, so the aliases still at that node are
+    the ones that skipped over those tokens.
+    """
+
+    def __init__(self, aliases: List[List], skip: Set):
+        self.skip = skip
+        self.children = [{}]
+        self.terminals = [[]]  # indices of the aliases that end at each node
+        for alias_ix, alias in enumerate(aliases):
+            node = 0
+            for token in alias:
+                child = self.children[node].get(token)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][token] = child
+                    self.children.append({})
+                    self.terminals.append([])
+                node = child
+            self.terminals[node].append(alias_ix)
+        if len(self.terminals[0]) > 0:
+            raise ValueError("Empty alias")
+
+    def find(self, words: List) -> List[Tuple[int, int]]:
+        children = self.children
+        terminals = self.terminals
+        skip = self.skip
+        root = children[0]
+        found = []  # (alias, start, end)
+        no_exclusions = frozenset()
+        active = []
+        for i, word in enumerate(words):
+            next_active = []
+            for start, node, excluded in active:
+                child = children[node].get(word)
+                if child is not None and word not in excluded:
+                    for alias_ix in terminals[child]:
+                        found.append((alias_ix, start, i + 1))
+                    if len(children[child]) > 0:
+                        next_active.append((start, child, no_exclusions))
+                    if word in skip:
+                        # The other aliases at this node can skip `word`
+                        excluded = excluded | {word}
+                        if len(children[node]) > len(excluded):
+                            next_active.append((start, node, excluded))
+                elif word in skip:
+                    next_active.append((start, node, excluded))
+            child = root.get(word)
+            if child is not None:
+                for alias_ix in terminals[child]:
+                    found.append((alias_ix, i, i + 1))
+                if len(children[child]) > 0:
+                    next_active.append((i, child, no_exclusions))
+            active = next_active
+
+        # Build the output set in the order `FastNormalizedAnswerDetector` adds to it, so
+        # iterating over it gives the spans in the same order
+        found.sort()
+        return list(set((s, e) for _, s, e in found))
+
+
+class AutomatonAnswerDetector(FastNormalizedAnswerDetector):
+    """ `FastNormalizedAnswerDetector` that matches all the aliases at once with an `AliasAutomaton` """
+
+    def __init__(self):
+        super().__init__()
+        self._automaton = None
+        self._id_automaton = None
+        self._id_vocab = None
+
+    def set_question(self, normalized_aliases):
+        super().set_question(normalized_aliases)
+        self._automaton = AliasAutomaton(normalized_aliases, self.skip)
+        self._id_automaton = None
+        self._id_vocab = None
+
+    def find_normalized(self, words: List[str]):
+        return self._automaton.find(words)
+
+    def find_normalized_ids(self, words: List[int], vocab):
+        if self._id_vocab is not vocab:
+            _, normalized_ix = vocab.map_words(self.normalize_word)
+            # Aliases with words no vocabulary word normalizes to can't be found
+            answer_ids = [[normalized_ix[x] for x in answer] if all(x in normalized_ix for x in answer) else [-1]
+                          for answer in self.answer_tokens]
+            skip = {normalized_ix[x] for x in self.skip if x in normalized_ix}
+            self._id_automaton = AliasAutomaton(answer_ids, skip)
+            self._id_vocab = vocab
+        return self._id_automaton.find(words)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_id_automaton"] = None
+        state["_id_vocab"] = None
+        return state
+
+
+@lru_cache(maxsize=100000)
+def _compile_ignore_case(pattern):
+    # Aliases repeat a lot across questions, so compile each token's regex once
+    return re.compile(pattern, re.IGNORECASE)
+
+
 class CarefulAnswerDetector(object):
     """
     There are some common false negatives in the above answer detection, in particular plurals of answers are
@@ -140,12 +284,17 @@ class CarefulAnswerDetector(object):
             if tokens[-1] == "s":
                 tokens[-1] = "s?"
 
-            answer_regex.append([re.compile(x, re.IGNORECASE) for x in tokens])
+            answer_regex.append([_compile_ignore_case(x) for x in tokens])
 
         self.answer_regex = answer_regex
 
+    def normalize_paragraph(self, para) -> List[str]:
+        return flatten_iterable(para)
+
     def any_found(self, para):
-        words = flatten_iterable(para)
+        return self.find_normalized(self.normalize_paragraph(para))
+
+    def find_normalized(self, words: List[str]):
         occurances = []
         for answer_ix, answer in enumerate(self.answer_regex):
             word_starts = [i for i, w in enumerate(words) if answer[0].fullmatch(w)]
@@ -167,15 +316,23 @@ class CarefulAnswerDetector(object):
         return list(set(occurances))
 
 
-def evaluate_question_detector(questions, corpus, word_tokenize, detector, reference_detector=None, compute_f1s=False):
-    """ Just for debugging """
+def evaluate_question_detector(questions, corpus, word_tokenize, detector, reference_detector=None,
+                               compute_f1s=False, require_identical=False):
+    """
+    Just for debugging, if `require_identical` is set checks that `detector` returns exactly
+    the same spans, in the same order, as `reference_detector` for every paragraph
+    """
     n_no_docs = 0
+    n_different = 0
+    n_paragraphs = 0
     answer_per_doc = []
     answer_f1s = []
 
     for question_ix, q in enumerate(tqdm(questions)):
         tokenized_aliases = [word_tokenize(x) for x in q.answer.normalized_aliases]
         detector.set_question(tokenized_aliases)
+        if require_identical:
+            reference_detector.set_question(tokenized_aliases)
 
         for doc in q.all_docs:
             doc = corpus.get_document(doc.doc_id)
@@ -185,10 +342,17 @@ def evaluate_question_detector(questions, corpus, word_tokenize, detector, refer
 
             output = []
             for i, para in enumerate(doc):
-                for s,e in detector.any_found(para):
+                found = detector.any_found(para)
+                if require_identical:
+                    n_paragraphs += 1
+                    expected = reference_detector.any_found(para)
+                    if found != expected:
+                        n_different += 1
+                        print("Different spans for question %s: %s vs %s" % (q.question_id, found, expected))
+                for s,e in found:
                     output.append((i, s, e))
 
-            if len(output) == 0 and reference_detector is not None:
+            if not require_identical and len(output) == 0 and reference_detector is not None:
                 if reference_detector is not None:
                     reference_detector.set_question(tokenized_aliases)
                     detected = []
@@ -222,70 +386,205 @@ def evaluate_question_detector(questions, corpus, word_tokenize, detector, refer
     print("%.4f docs have answers" % np.mean([len(x) > 0 for x in answer_per_doc]))
     if len(answer_f1s) > 0:
         print("Average f1 is %.4f" % np.mean(flatten_iterable(answer_f1s)))
+    if require_identical:
+        print("%d of %d paragraphs had different spans" % (n_different, n_paragraphs))
+    return n_different
 
 
-def compute_answer_spans(questions: List[TriviaQaQuestion], corpus, word_tokenize,
-                         detector):
+class NormalizedDocumentCache(object):
+    """
+    LRU cache of documents from `corpus` as a list of normalized paragraphs, as returned by
+    `detector.normalize_paragraph` (or `detector.normalize_paragraph_ids` if `use_ids` is set), so
+    questions citing the same document only read and normalize it once
+    """
 
-    for i, q in enumerate(questions):
-        if i % 500 == 0:
-            print("Completed question %d of %d (%.3f)" % (i, len(questions), i/len(questions)))
-        q.question = word_tokenize(q.question)
-        if q.answer is None:
-            continue
-        tokenized_aliases = [word_tokenize(x) for x in q.answer.all_answers]
-        if len(tokenized_aliases) == 0:
-            raise ValueError()
-        detector.set_question(tokenized_aliases)
-        for doc in q.all_docs:
+    def __init__(self, corpus, detector, use_ids: bool, max_size: int):
+        self.corpus = corpus
+        self.detector = detector
+        self.use_ids = use_ids
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_id):
+        paragraphs = self._cache.get(doc_id)
+        if paragraphs is not None:
+            self._cache.move_to_end(doc_id)
+            self.hits += 1
+            return paragraphs
+
+        self.misses += 1
+        if self.use_ids:
+            encoded = self.corpus.get_document_ids(doc_id)
+            if encoded is None:
+                return None
+            paragraphs = [self.detector.normalize_paragraph_ids(encoded.paragraph_ids(i), encoded.vocab)
+                          for i in range(encoded.n_paragraphs)]
+        else:
+            text = self.corpus.get_document(doc_id)
+            if text is None:
+                return None
+            paragraphs = [self.detector.normalize_paragraph(para) for para in text]
+        if self.max_size > 0:
+            self._cache[doc_id] = paragraphs
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return paragraphs
+
+
+def _get_document_cache(corpus, detector, cache_size: int):
+    if not hasattr(detector, "find_normalized"):
+        return None
+    # Work directly on token ids if the corpus and detector support it
+    use_ids = hasattr(corpus, "get_document_ids") and hasattr(detector, "any_found_ids")
+    return NormalizedDocumentCache(corpus, detector, use_ids, cache_size)
+
+
+def _compute_question_spans(q: TriviaQaQuestion, corpus, word_tokenize, detector, cache):
+    q.question = word_tokenize(q.question)
+    if q.answer is None:
+        return
+    tokenized_aliases = [word_tokenize(x) for x in q.answer.all_answers]
+    if len(tokenized_aliases) == 0:
+        raise ValueError()
+    detector.set_question(tokenized_aliases)
+    vocab = corpus.vocab if cache is not None and cache.use_ids else None
+    for doc in q.all_docs:
+        spans = []
+        offset = 0
+        if cache is not None:
+            paragraphs = cache.get(doc.doc_id)
+            if paragraphs is None:
+                raise ValueError()
+            for words in paragraphs:
+                found = detector.find_normalized(words) if vocab is None else detector.find_normalized_ids(words, vocab)
+                for s, e in found:
+                    spans.append((s+offset, e+offset-1))  # turn into inclusive span
+                offset += len(words)
+        else:
             text = corpus.get_document(doc.doc_id)
             if text is None:
                 raise ValueError()
-            spans = []
-            offset = 0
             for para_ix, para in enumerate(text):
                 for s, e in detector.any_found(para):
                     spans.append((s+offset, e+offset-1))  # turn into inclusive span
                 offset += sum(len(s) for s in para)
-            if len(spans) == 0:
-                spans = np.zeros((0, 2), dtype=np.int32)
-            else:
-                spans = np.array(spans, dtype=np.int32)
-            doc.answer_spans = spans
+        if len(spans) == 0:
+            spans = np.zeros((0, 2), dtype=np.int32)
+        else:
+            spans = np.array(spans, dtype=np.int32)
+        doc.answer_spans = spans
+
+
+def compute_answer_spans(questions: List[TriviaQaQuestion], corpus, word_tokenize,
+                         detector, cache_size: int=0):
+    """
+    Sets `answer_spans` for each document of each question. If the detector supports it, documents are
+    normalized once per question, or only once overall for documents that stay in an LRU cache of `cache_size`
+    documents, so it's best to order `questions` so those that share documents are close together.
+    """
+    cache = _get_document_cache(corpus, detector, cache_size)
+    for i, q in enumerate(questions):
+        if i % 500 == 0:
+            print("Completed question %d of %d (%.3f)" % (i, len(questions), i/len(questions)))
+        _compute_question_spans(q, corpus, word_tokenize, detector, cache)
+    if cache is not None and cache.max_size > 0:
+        print("Document cache hit rate %.3f" % (cache.hits / max(cache.hits + cache.misses, 1)))
+
+
+def group_by_document(questions: List[TriviaQaQuestion]) -> List[int]:
+    """
+    Order for `questions` that puts questions citing the same documents next to each other. Each question is
+    keyed by its most frequently cited document, so questions about common documents (e.g., popular Wikipedia
+    pages) are grouped together, ties are broken by doc id to keep the order deterministic
+    """
+    counts = {}
+    for q in questions:
+        for doc in q.all_docs:
+            counts[doc.doc_id] = counts.get(doc.doc_id, 0) + 1
 
+    def key(i):
+        docs = questions[i].all_docs
+        if len(docs) == 0:
+            return 0, "", i
+        anchor = min(docs, key=lambda d: (-counts[d.doc_id], d.doc_id)).doc_id
+        return -counts[anchor], anchor, i
+    return sorted(range(len(questions)), key=key)
 
-def _compute_answer_spans_chunk(questions, corpus, tokenizer, detector):
+
+# Per-process state for `iter_answer_spans_par`, so the corpus, tokenizer and detector are
+# only sent once to each worker and its document cache persists across chunks
+_WORKER_STATE = None
+
+
+def _init_worker(corpus, tokenizer, detector, cache_size):
+    global _WORKER_STATE
+    _WORKER_STATE = (corpus, tokenizer, detector, _get_document_cache(corpus, detector, cache_size))
+
+
+def _compute_answer_spans_chunk(chunk):
+    corpus, tokenizer, detector, cache = _WORKER_STATE
     # We use tokenize_paragraph since some questions can have multiple sentences,
     # but we still store the results as a flat list of tokens
     word_tokenize = tokenizer.tokenize_paragraph_flat
-    compute_answer_spans(questions, corpus, word_tokenize, detector)
-    return questions
+    for _, q in chunk:
+        _compute_question_spans(q, corpus, word_tokenize, detector, cache)
+    return chunk
 
 
-def compute_answer_spans_par(questions: List[TriviaQaQuestion], corpus,
-                             tokenizer, detector, n_processes: int):
+def iter_answer_spans_par(questions: List[TriviaQaQuestion], corpus, tokenizer, detector, n_processes: int,
+                          chunk_size: int=100, cache_size: int=256):
+    """
+    Computes answer spans for `questions` with a pool of `n_processes` workers, yielding lists of
+    (index in `questions`, question with `answer_spans` set) as each chunk completes, in no particular order.
+
+    Questions are grouped by document and handed out in small chunks, so idle workers pick up the next chunk
+    instead of waiting on a fixed share of the work, and chunks with shared documents hit the worker's cache.
+    """
+    from multiprocessing import Pool
+    order = group_by_document(questions)
+    # A generator so the pool's task thread only references questions that have not been sent yet
+    chunks = ([(i, questions[i]) for i in c] for c in group(order, chunk_size))
+    pbar = tqdm(total=len(questions), desc="answer spans", ncols=80)
+    with Pool(n_processes, initializer=_init_worker, initargs=[corpus, tokenizer, detector, cache_size]) as pool:
+        for chunk in pool.imap_unordered(_compute_answer_spans_chunk, chunks):
+            pbar.update(len(chunk))
+            yield chunk
+    pbar.close()
+
+
+def compute_answer_spans_par(questions: List[TriviaQaQuestion], corpus, tokenizer, detector, n_processes: int,
+                             chunk_size: int=100, cache_size: int=256):
+    """
+    `compute_answer_spans` over `n_processes` processes, see `iter_answer_spans_par`.
+    Each question in `questions` is replaced, in place, by the copy with its answer spans set,
+    so the original can be freed as soon as its result arrives. Returns `questions`.
+    """
     if n_processes == 1:
+        order = group_by_document(questions)
         word_tokenize = tokenizer.tokenize_paragraph_flat
-        compute_answer_spans(questions, corpus, word_tokenize, detector)
-        return questions
-    from multiprocessing import Pool
-    with Pool(n_processes) as p:
-        chunks = split(questions, n_processes)
-        questions = flatten_iterable(p.starmap(_compute_answer_spans_chunk,
-                                               [[c, corpus, tokenizer, detector] for c in chunks]))
+        compute_answer_spans([questions[i] for i in order], corpus, word_tokenize, detector, cache_size)
         return questions
+    for chunk in iter_answer_spans_par(questions, corpus, tokenizer, detector, n_processes, chunk_size, cache_size):
+        for i, q in chunk:
+            questions[i] = q
+    return questions
 
 
 def main():
-    from trivia_qa.build_span_corpus import TriviaQaWebDataset
-    from data_processing.text_utils import NltkAndPunctTokenizer
+    from docqa.triviaqa.build_span_corpus import TriviaQaWebDataset
+    from docqa.data_processing.text_utils import NltkAndPunctTokenizer
 
+    # Check `AutomatonAnswerDetector` against the per-alias scan it replaces on the dev set
     dataset = TriviaQaWebDataset()
-    qs = dataset.get_train()
-    qs = np.random.RandomState(0).choice(qs, 1000, replace=False)
-    evaluate_question_detector(qs, dataset.evidence, NltkAndPunctTokenizer().tokenize_paragraph_flat,
-                               FastNormalizedAnswerDetector())
+    qs = dataset.get_dev()
+    n_different = evaluate_question_detector(qs, dataset.evidence, NltkAndPunctTokenizer().tokenize_paragraph_flat,
+                                             AutomatonAnswerDetector(), FastNormalizedAnswerDetector(),
+                                             require_identical=True)
+    if n_different > 0:
+        raise RuntimeError()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,7 @@
 import argparse
 import json
 import pickle
+import shutil
 import unicodedata
 from itertools import islice
 from os import mkdir
@@ -9,10 +10,12 @@ from typing import List, Optional, Dict
 
 from docqa.config import CORPUS_DIR, TRIVIA_QA, TRIVIA_QA_UNFILTERED
 from docqa.configurable import Configurable
+from docqa.data_processing.columnar import ColumnarReader, use_columnar
 from docqa.data_processing.text_utils import NltkAndPunctTokenizer
-from docqa.triviaqa.answer_detection import compute_answer_spans_par, FastNormalizedAnswerDetector
-from docqa.triviaqa.evidence_corpus import TriviaQaEvidenceCorpusTxt
+from docqa.triviaqa.answer_detection import compute_answer_spans_par, AutomatonAnswerDetector
+from docqa.triviaqa.evidence_corpus_packed import get_evidence_corpus
 from docqa.triviaqa.read_data import iter_trivia_question, TriviaQaQuestion
+from docqa.triviaqa.span_corpus_columnar import columnar_dir, load_questions
 from docqa.utils import ResourceLoader
 
 """
@@ -51,8 +54,9 @@ def build_dataset(name: str, tokenizer, train_files: Dict[str, str],
                 q.entity_docs = [x for x in q.entity_docs if x.doc_id in file_map]
 
         print("Adding answers for %s question" % name)
-        corpus = TriviaQaEvidenceCorpusTxt(file_map)
-        questions = compute_answer_spans_par(questions, corpus, tokenizer, answer_detector, n_process)
+        # Answer detection reads complete documents, so it can use the token id corpus
+        corpus = get_evidence_corpus(file_map, encoded=True)
+        compute_answer_spans_par(questions, corpus, tokenizer, answer_detector, n_process)
         for q in questions:  # Sanity check, we should have answers for everything (even if of size 0)
             if q.answer is None:
                 continue
@@ -62,6 +66,9 @@ def build_dataset(name: str, tokenizer, train_files: Dict[str, str],
                         raise RuntimeError()
 
         print("Saving %s question" % name)
+        if exists(columnar_dir(out_dir, name)):
+            # Would be out of date with the pickle we are about to write
+            shutil.rmtree(columnar_dir(out_dir, name))
         with open(join(out_dir, name + ".pkl"), "wb") as f:
             pickle.dump(questions, f)
 
@@ -80,26 +87,28 @@ class TriviaQaSpanCorpus(Configurable):
             file_map = json.load(f)
         for k, v in file_map.items():
             file_map[k] = unicodedata.normalize("NFD", v)
-        self.evidence = TriviaQaEvidenceCorpusTxt(file_map)
+        self.evidence = get_evidence_corpus(file_map)
 
-    def get_train(self) -> List[TriviaQaQuestion]:
-        with open(join(self.dir, "train.pkl"), "rb") as f:
+    def _load_questions(self, split) -> List[TriviaQaQuestion]:
+        # Prefer the lazily loaded columnar format if it has been built from the current pickle
+        if use_columnar(columnar_dir(self.dir, split), join(self.dir, split + ".pkl")):
+            return load_questions(columnar_dir(self.dir, split))
+        with open(join(self.dir, split + ".pkl"), "rb") as f:
             return pickle.load(f)
 
+    def get_train(self) -> List[TriviaQaQuestion]:
+        return self._load_questions("train")
+
     def get_dev(self) -> List[TriviaQaQuestion]:
-        with open(join(self.dir, "dev.pkl"), "rb") as f:
-            return pickle.load(f)
+        return self._load_questions("dev")
 
     def get_test(self) -> List[TriviaQaQuestion]:
-        with open(join(self.dir, "test.pkl"), "rb") as f:
-            return pickle.load(f)
+        return self._load_questions("test")
 
     def get_verified(self) -> Optional[List[TriviaQaQuestion]]:
-        verified_dir = join(self.dir, "verified.pkl")
-        if not exists(verified_dir):
+        if not exists(join(self.dir, "verified.pkl")) and not ColumnarReader.exists(columnar_dir(self.dir, "verified")):
             return None
-        with open(verified_dir, "rb") as f:
-            return pickle.load(f)
+        return self._load_questions("verified")
 
     def get_resource_loader(self):
         return ResourceLoader()
@@ -136,7 +145,7 @@ def build_wiki_corpus(n_processes):
                       dev=join(TRIVIA_QA, "qa", "wikipedia-dev.json"),
                       train=join(TRIVIA_QA, "qa", "wikipedia-train.json"),
                   ),
-                  FastNormalizedAnswerDetector(), n_processes)
+                  AutomatonAnswerDetector(), n_processes)
 
 
 def build_web_corpus(n_processes):
@@ -147,7 +156,7 @@ def build_web_corpus(n_processes):
                       train=join(TRIVIA_QA, "qa", "web-train.json"),
                       test=join(TRIVIA_QA, "qa", "web-test-without-answers.json")
                   ),
-                  FastNormalizedAnswerDetector(), n_processes)
+                  AutomatonAnswerDetector(), n_processes)
 
 
 def build_sample_corpus(n_processes):
@@ -156,7 +165,7 @@ def build_sample_corpus(n_processes):
                       dev=join(TRIVIA_QA, "qa", "web-dev.json"),
                       train=join(TRIVIA_QA, "qa", "web-train.json"),
                   ),
-                  FastNormalizedAnswerDetector(), n_processes, sample=1000)
+                  AutomatonAnswerDetector(), n_processes, sample=1000)
 
 
 def build_unfiltered_corpus(n_processes):
@@ -166,7 +175,7 @@ def build_unfiltered_corpus(n_processes):
                       train=join(TRIVIA_QA_UNFILTERED, "unfiltered-web-train.json"),
                       test=join(TRIVIA_QA_UNFILTERED, "unfiltered-web-test-without-answers.json")
                   ),
-                  answer_detector=FastNormalizedAnswerDetector(),
+                  answer_detector=AutomatonAnswerDetector(),
                   n_process=n_processes)
 
 
@@ -1,16 +1,21 @@
 import argparse
+import json
 import pickle
 import re
 from collections import Counter
-from os import walk, mkdir, makedirs
+from functools import partial
+from hashlib import sha1
+from os import walk, mkdir, makedirs, stat, remove, replace
 from os.path import relpath, join, exists
-from typing import Set
+from typing import Iterable, List, Tuple, Optional
 
 from tqdm import tqdm
 
 from docqa import config
 from docqa.config import CORPUS_DIR
-from docqa.data_processing.text_utils import NltkAndPunctTokenizer
+from docqa.configurable import config_to_json
+from docqa.data_processing.fast_tokenizer import TOKENIZERS, get_tokenizer
+from docqa.data_processing.tokenizer_cache import CachedTokenizer
 from docqa.triviaqa.read_data import normalize_wiki_filename
 from docqa.utils import group, split, flatten_iterable
 
@@ -18,6 +23,8 @@ from docqa.utils import group, split, flatten_iterable
 Build and cache a tokenized version of the evidence corpus
 """
 
+MANIFEST_VERSION = 1
+
 
 def _gather_files(input_root, output_dir, skip_dirs, wiki_only):
     if not exists(output_dir):
@@ -39,16 +46,19 @@ def _gather_files(input_root, output_dir, skip_dirs, wiki_only):
     return all_files
 
 
-def build_tokenized_files(filenames, input_root, output_root, tokenizer, override=True) -> Set[str]:
+def _output_file(output_root, filename):
+    return join(output_root, normalize_wiki_filename(filename[:filename.rfind(".")]) + ".txt")
+
+
+def build_tokenized_files(filenames, input_root, output_root, tokenizer, override=True) -> Counter:
     """
     For each file in `filenames` loads the text, tokenizes it with `tokenizer, and
     saves the output to the same relative location in `output_root`.
-    @:return a set of all the individual words seen
+    @:return counts of all the individual words seen
     """
-    voc = set()
+    voc = Counter()
     for filename in filenames:
-        out_file = normalize_wiki_filename(filename[:filename.rfind(".")]) + ".txt"
-        out_file = join(output_root, out_file)
+        out_file = _output_file(output_root, filename)
         if not override and exists(out_file):
             continue
         with open(join(input_root, filename), "r") as in_file:
@@ -60,42 +70,227 @@ def build_tokenized_files(filenames, input_root, output_root, tokenizer, overrid
             for i, sent in enumerate(para):
                 voc.update(sent)
 
-        with open(join(output_root, out_file), "w") as in_file:
+        with open(out_file, "w") as in_file:
             in_file.write("\n\n".join("\n".join(" ".join(sent) for sent in para) for para in paragraphs))
     return voc
 
 
-def build_tokenized_corpus(input_root, tokenizer, output_dir, skip_dirs=False,
-                           n_processes=1, wiki_only=False):
-    if not exists(output_dir):
-        makedirs(output_dir)
+def tokenizer_fingerprint(tokenizer) -> str:
+    """ Hash of `tokenizer`'s config, files tokenized with a different config have to be rebuilt """
+    if isinstance(tokenizer, CachedTokenizer):
+        # Caching does not change the output
+        tokenizer = tokenizer.tokenizer
+    if hasattr(tokenizer, "get_config"):
+        tok_config = tokenizer.get_config()
+        key = "%s-v%s %s" % (tok_config.name, tok_config.version, config_to_json(tok_config.params))
+    else:
+        key = tokenizer.__class__.__name__
+    return sha1(key.encode("utf-8")).hexdigest()
 
-    all_files = _gather_files(input_root, output_dir, skip_dirs, wiki_only)
 
+def load_manifest(output_dir):
+    """
+    Load the manifest of a tokenized corpus. It maps the files in the source corpus to their
+    (size, modification time, sha1) when they were tokenized, and stores the tokenizer's fingerprint and
+    the counts of the words in all those files, so we can tell which files need to be re-tokenized and
+    update the vocab without reading the entire corpus
+    """
+    filename = join(output_dir, "manifest.pkl")
+    if not exists(filename):
+        return None
+    with open(filename, "rb") as f:
+        manifest = pickle.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, output_dir):
+    # Write then rename, so an interrupted build never leaves a truncated manifest
+    filename = join(output_dir, "manifest.pkl")
+    with open(filename + ".tmp", "wb") as f:
+        pickle.dump(manifest, f)
+    replace(filename + ".tmp", filename)
+
+
+def _hash_files(filenames) -> List[Tuple[str, str]]:
+    out = []
+    for filename in filenames:
+        h = sha1()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        out.append((filename, h.hexdigest()))
+    return out
+
+
+def _count_tokens(filenames) -> Counter:
+    voc = Counter()
+    for filename in filenames:
+        with open(filename, "r") as f:
+            voc.update(parse_document(f.read(), flat=True))
+    return voc
+
+
+def _map_chunks(fn, items, n_processes, chunk_size=500):
+    """ Yield (chunk, `fn`(chunk)) for chunks of `items`, in parallel if `n_processes` > 1 """
+    if len(items) == 0:
+        return
+    chunks = split(items, n_processes)
+    chunks = flatten_iterable(group(c, chunk_size) for c in chunks if len(c) > 0)
+    pbar = tqdm(total=len(chunks), ncols=80)
     if n_processes == 1:
-        voc = build_tokenized_files(tqdm(all_files, ncols=80), input_root, output_dir, tokenizer)
+        for c in chunks:
+            yield c, fn(c)
+            pbar.update(1)
     else:
-        voc = set()
         from multiprocessing import Pool
         with Pool(n_processes) as pool:
-            chunks = split(all_files, n_processes)
-            chunks = flatten_iterable(group(c, 500) for c in chunks)
-            pbar = tqdm(total=len(chunks), ncols=80)
-            for v in pool.imap_unordered(_build_tokenized_files_t,
-                                         [[c, input_root, output_dir, tokenizer] for c in chunks]):
-                voc.update(v)
+            for c, out in pool.imap_unordered(_apply_to_chunk, [(fn, c) for c in chunks]):
+                yield c, out
                 pbar.update(1)
-            pbar.close()
+    pbar.close()
+
+
+def _apply_to_chunk(arg):
+    fn, chunk = arg
+    return chunk, fn(chunk)
+
+
+def build_tokenized_corpus(input_root, tokenizer, output_dir, skip_dirs=False,
+                           n_processes=1, wiki_only=False, rebuild=False, checkpoint_every=100):
+    """
+    Tokenize the files in `input_root` into `output_dir` and write the vocab. Unless `rebuild` is set, the
+    manifest of a previous build is used to only tokenize files that are new or have changed, and to
+    remove the output of files that were deleted. The manifest is saved every `checkpoint_every` chunks,
+    so an interrupted build can be resumed.
+    """
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    all_files = _gather_files(input_root, output_dir, skip_dirs, wiki_only)
+
+    # Stores built from the corpus will see it as out of date until we write the new fingerprint
+    if exists(join(output_dir, "fingerprint.txt")):
+        remove(join(output_dir, "fingerprint.txt"))
+
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    manifest = None if rebuild else load_manifest(output_dir)
+    if manifest is not None and manifest["tokenizer"] != fingerprint:
+        print("Tokenizer has changed, re-tokenizing all files")
+        manifest = None
+    if manifest is None:
+        manifest = dict(version=MANIFEST_VERSION, tokenizer=fingerprint, files={}, vocab=Counter())
+    files = manifest["files"]
+
+    # Hash the files whose size or modification time changed, in case they were only touched
+    stats = {}
+    to_hash = []
+    for filename in all_files:
+        st = stat(join(input_root, filename))
+        stats[filename] = (st.st_size, st.st_mtime_ns)
+        entry = files.get(filename)
+        if entry is None or entry[:2] != stats[filename] or not exists(_output_file(output_dir, filename)):
+            to_hash.append(filename)
+
+    hashes = {}
+    if len(to_hash) > 0:
+        print("Hashing %d new or modified files" % len(to_hash))
+        for _, out in _map_chunks(_hash_files, [join(input_root, x) for x in to_hash], n_processes):
+            hashes.update(out)
+
+    changed = []
+    for filename in to_hash:
+        state = stats[filename] + (hashes[join(input_root, filename)],)
+        entry = files.get(filename)
+        if entry is not None and entry[2] == state[2] and exists(_output_file(output_dir, filename)):
+            files[filename] = state
+        else:
+            changed.append(filename)
+
+    if skip_dirs:
+        # We did not list the skipped directories, so we can't tell which files were deleted
+        removed = []
+    else:
+        all_files_set = set(all_files)
+        removed = [x for x in files if x not in all_files_set and (not wiki_only or "wikipedia/" in x)]
+
+    # Remove files we are about to replace or delete from the vocab before touching their output, so
+    # `vocab` always counts the words in the files that are in the manifest
+    stale = [x for x in changed if x in files] + removed
+    if len(stale) > 0:
+        print("Removing %d modified or deleted files from the vocab" % len(stale))
+        if all(exists(_output_file(output_dir, x)) for x in stale):
+            vocab = manifest["vocab"]
+            for _, counts in _map_chunks(_count_tokens, [_output_file(output_dir, x) for x in stale], n_processes):
+                vocab.subtract(counts)
+            for filename in stale:
+                del files[filename]
+        else:
+            # Some output was deleted, so we can't tell what words it had, recount the rest of the corpus
+            for filename in stale:
+                del files[filename]
+            vocab = Counter()
+            for _, counts in _map_chunks(_count_tokens, [_output_file(output_dir, x) for x in files], n_processes):
+                vocab.update(counts)
+        manifest["vocab"] = +vocab
+        for filename in removed:
+            if exists(_output_file(output_dir, filename)):
+                remove(_output_file(output_dir, filename))
+        save_manifest(manifest, output_dir)
+
+    print("Tokenizing %d files (%d unchanged)" % (len(changed), len(all_files) - len(changed)))
+    vocab = manifest["vocab"]
+    fn = partial(build_tokenized_files, input_root=input_root, output_root=output_dir, tokenizer=tokenizer)
+    for i, (chunk, counts) in enumerate(_map_chunks(fn, changed, n_processes)):
+        vocab.update(counts)
+        for filename in chunk:
+            files[filename] = stats[filename] + (hashes[join(input_root, filename)],)
+        if (i + 1) % checkpoint_every == 0:
+            save_manifest(manifest, output_dir)
+    save_manifest(manifest, output_dir)
 
     voc_file = join(output_dir, "vocab.txt")
     with open(voc_file, "w") as f:
-        for word in sorted(voc):
+        for word in sorted(vocab):
             f.write(word)
             f.write("\n")
 
+    # Identifies the tokenizer and source files the corpus was built from
+    h = sha1(manifest["tokenizer"].encode("utf-8"))
+    for filename in sorted(files):
+        h.update(("\n%s %s" % (filename, files[filename][2])).encode("utf-8"))
+    with open(join(output_dir, "fingerprint.txt"), "w") as f:
+        f.write(h.hexdigest())
 
-def _build_tokenized_files_t(arg):
-    return build_tokenized_files(*arg)
+
+def corpus_fingerprint(directory: str) -> Optional[str]:
+    """
+    Identifies the version of the tokenized corpus in `directory`, stores built from the corpus
+    record it so we can tell when they are out of date
+    """
+    filename = join(directory, "fingerprint.txt")
+    if exists(filename):
+        with open(filename, "r") as f:
+            return f.read().strip()
+    # Corpus was built before we tracked fingerprints, or a build is in progress
+    voc_file = join(directory, "vocab.txt")
+    if exists(voc_file):
+        st = stat(voc_file)
+        return "vocab-%d-%d" % (st.st_size, st.st_mtime_ns)
+    return None
+
+
+def is_built_from(store_dir: str, source_dir: str) -> bool:
+    """
+    If the store in `store_dir`, whose index.json records the `corpus_fingerprint` it was built from,
+    matches the current version of the tokenized corpus in `source_dir`
+    """
+    if not exists(source_dir):
+        return True  # The store is all we have
+    with open(join(store_dir, "index.json"), "r") as f:
+        built_from = json.load(f).get("source")
+    return built_from is not None and built_from == corpus_fingerprint(source_dir)
 
 
 def extract_voc(corpus, doc_ids):
@@ -147,9 +342,6 @@ class TriviaQaEvidenceCorpusTxt(object):
     Allows the text to be retrieved by document id
     """
 
-    _split_all = re.compile("[\n ]")
-    _split_para = re.compile("\n\n+")  # FIXME we should not have saved document w/extra spaces...
-
     def __init__(self, file_id_map=None):
         self.directory = join(CORPUS_DIR, "triviaqa/evidence")
         self.file_id_map = file_id_map
@@ -196,39 +388,52 @@ class TriviaQaEvidenceCorpusTxt(object):
 
         with open(file_id, "r") as f:
             if n_tokens is None:
-                text = f.read()
-                if flat:
-                    return [x for x in self._split_all.split(text) if len(x) > 0]
-                else:
-                    paragraphs = []
-                    for para in self._split_para.split(text):
-                        paragraphs.append([sent.split(" ") for sent in para.split("\n")])
-                    return paragraphs
+                return parse_document(f.read(), flat)
             else:
-                paragraphs = []
+                return parse_document_prefix(f, n_tokens, flat)
+
+
+_split_all = re.compile("[\n ]")
+_split_para = re.compile("\n\n+")  # FIXME we should not have saved document w/extra spaces...
+
+
+def parse_document(text: str, flat=False):
+    """ Parse the text of a tokenized document saved by `build_tokenized_files` """
+    if flat:
+        return [x for x in _split_all.split(text) if len(x) > 0]
+    else:
+        paragraphs = []
+        for para in _split_para.split(text):
+            paragraphs.append([sent.split(" ") for sent in para.split("\n")])
+        return paragraphs
+
+
+def parse_document_prefix(lines: Iterable[str], n_tokens: int, flat=False):
+    """ Parse the first `n_tokens` tokens from the lines of a tokenized document """
+    paragraphs = []
+    paragraph = []
+    cur_tokens = 0
+    for line in lines:
+        if line == "\n":
+            if not flat and len(paragraph) > 0:
+                paragraphs.append(paragraph)
                 paragraph = []
-                cur_tokens = 0
-                for line in f:
-                    if line == "\n":
-                        if not flat and len(paragraph) > 0:
-                            paragraphs.append(paragraph)
-                            paragraph = []
-                    else:
-                        sent = line.split(" ")
-                        sent[-1] = sent[-1].rstrip()
-                        if len(sent) + cur_tokens > n_tokens:
-                            if n_tokens != cur_tokens:
-                                paragraph.append(sent[:n_tokens-cur_tokens])
-                            break
-                        else:
-                            paragraph.append(sent)
-                            cur_tokens += len(sent)
-                if flat:
-                    return flatten_iterable(paragraph)
-                else:
-                    if len(paragraph) > 0:
-                        paragraphs.append(paragraph)
-                    return paragraphs
+        else:
+            sent = line.split(" ")
+            sent[-1] = sent[-1].rstrip()
+            if len(sent) + cur_tokens > n_tokens:
+                if n_tokens != cur_tokens:
+                    paragraph.append(sent[:n_tokens-cur_tokens])
+                break
+            else:
+                paragraph.append(sent)
+                cur_tokens += len(sent)
+    if flat:
+        return flatten_iterable(paragraph)
+    else:
+        if len(paragraph) > 0:
+            paragraphs.append(paragraph)
+        return paragraphs
 
 
 def main():
@@ -238,9 +443,19 @@ def main():
     # This is slow, using more processes is recommended
     parse.add_argument("-n", "--n_processes", type=int, default=1, help="Number of processes to use")
     parse.add_argument("--wiki_only", action="store_true")
+    parse.add_argument("--tokenizer", choices=TOKENIZERS, default="nltk",
+                       help="nltk is the reference, fast-punkt gives the same output faster, "
+                            "fast-regex is the fastest but can split sentences differently")
+    parse.add_argument("--tokenizer_cache", default=None,
+                       help="Directory to cache tokenized paragraphs in, so later builds can re-use them")
+    parse.add_argument("--rebuild", action="store_true",
+                       help="Re-tokenize every file, instead of only the files that changed since the last build")
     args = parse.parse_args()
-    build_tokenized_corpus(args.source, NltkAndPunctTokenizer(), args.output_dir,
-                           n_processes=args.n_processes, wiki_only=args.wiki_only)
+    tokenizer = get_tokenizer(args.tokenizer)
+    if args.tokenizer_cache is not None:
+        tokenizer = CachedTokenizer(tokenizer, args.tokenizer_cache)
+    build_tokenized_corpus(args.source, tokenizer, args.output_dir,
+                           n_processes=args.n_processes, wiki_only=args.wiki_only, rebuild=args.rebuild)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
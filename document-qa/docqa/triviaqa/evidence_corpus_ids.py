@@ -0,0 +1,267 @@
+import argparse
+import json
+from os import makedirs
+from os.path import join, exists, getsize
+from typing import List, Optional, Callable, Tuple, Dict
+
+import numpy as np
+from tqdm import tqdm
+
+from docqa.config import CORPUS_DIR
+from docqa.triviaqa.evidence_corpus import TriviaQaEvidenceCorpusTxt, corpus_fingerprint
+
+"""
+The tokenized evidence corpus stored as int32 token ids against a shared vocabulary, with
+sentence and paragraph boundary arrays, so consumers can work on ids and only build `str`
+tokens when they actually need them
+"""
+
+ENCODED_DIR = join(CORPUS_DIR, "triviaqa", "evidence-ids")
+
+# Stored as raw binary files so they can be written incrementally
+ARRAYS = dict(tokens=np.int32, sent_offsets=np.int64, para_offsets=np.int64, doc_offsets=np.int64)
+
+
+def _load_array(filename, dtype):
+    if getsize(filename) == 0:
+        return np.zeros(0, dtype=dtype)  # mmap can't map empty files
+    return np.memmap(filename, dtype=dtype, mode="r")
+
+
+class EvidenceVocab(object):
+    """ Token id -> word table, plus cached tables mapping each id through a word-level function """
+
+    def __init__(self, words: List[str]):
+        self.words = words
+        self._word_ix = None
+        self._mapped = {}
+
+    @staticmethod
+    def load(filename) -> 'EvidenceVocab':
+        with open(filename, "r", encoding="utf-8") as f:
+            words = f.read().split("\n")
+        if len(words) > 0 and words[-1] == "":
+            words.pop()
+        return EvidenceVocab(words)
+
+    @property
+    def word_ix(self) -> Dict[str, int]:
+        if self._word_ix is None:
+            self._word_ix = {w: i for i, w in enumerate(self.words)}
+        return self._word_ix
+
+    def decode(self, ids: np.ndarray) -> List[str]:
+        words = self.words
+        return [words[i] for i in ids.tolist()]
+
+    def map_words(self, fn: Callable[[str], str]) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Apply `fn` to every word in the vocabulary once. Returns an array mapping each token id to the id
+        of its transformed word, and the transformed word -> id map. Results are cached per function.
+        """
+        if fn not in self._mapped:
+            mapped_ix = {}
+            ids = np.array([mapped_ix.setdefault(fn(w), len(mapped_ix)) for w in self.words], dtype=np.int32)
+            self._mapped[fn] = (ids, mapped_ix)
+        return self._mapped[fn]
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getstate__(self):
+        return dict(words=self.words)
+
+    def __setstate__(self, state):
+        self.__init__(state["words"])
+
+
+class EncodedDocument(object):
+    """
+    Token ids of a document, sentence `i` is `ids[sent_offsets[i]:sent_offsets[i+1]]` and paragraph `j`
+    is made up of sentences `para_offsets[j]:para_offsets[j+1]`
+    """
+
+    def __init__(self, ids: np.ndarray, sent_offsets: np.ndarray, para_offsets: np.ndarray, vocab: EvidenceVocab):
+        self.ids = ids
+        self.sent_offsets = sent_offsets
+        self.para_offsets = para_offsets
+        self.vocab = vocab
+
+    @property
+    def n_paragraphs(self):
+        return len(self.para_offsets) - 1
+
+    def paragraph_ids(self, para_ix: int) -> np.ndarray:
+        """ Flat token ids of one paragraph """
+        return self.ids[self.sent_offsets[self.para_offsets[para_ix]]:self.sent_offsets[self.para_offsets[para_ix + 1]]]
+
+    def to_tokens(self, n_tokens: Optional[int]=None, flat=False):
+        """
+        Decode to the format returned by `TriviaQaEvidenceCorpusTxt.get_document`, only the
+        sentences needed for the first `n_tokens` tokens are decoded
+        """
+        if flat and n_tokens is None:
+            # Empty tokens are dropped when reading the complete document as a flat list
+            empty = self.vocab.word_ix.get("")
+            ids = self.ids if empty is None else self.ids[self.ids != empty]
+            return self.vocab.decode(ids)
+
+        sent_offsets = self.sent_offsets.tolist()
+        paragraphs = []
+        cur_tokens = 0
+        for para_ix in range(self.n_paragraphs):
+            paragraph = []
+            done = False
+            for sent_ix in range(self.para_offsets[para_ix], self.para_offsets[para_ix + 1]):
+                start, end = sent_offsets[sent_ix], sent_offsets[sent_ix + 1]
+                if n_tokens is not None and end - start + cur_tokens > n_tokens:
+                    if n_tokens != cur_tokens:
+                        paragraph.append(self.vocab.decode(self.ids[start:start + n_tokens - cur_tokens]))
+                    done = True
+                    break
+                paragraph.append(self.vocab.decode(self.ids[start:end]))
+                cur_tokens += end - start
+            if len(paragraph) > 0:
+                paragraphs.append(paragraph)
+            if done:
+                break
+        if flat:
+            return [w for para in paragraphs for sent in para for w in sent]
+        return paragraphs
+
+
+class TriviaQaEvidenceCorpusIds(TriviaQaEvidenceCorpusTxt):
+    """
+    Drop in replacement for `TriviaQaEvidenceCorpusTxt` that reads from a corpus built by `encode_corpus`.
+    All documents are stored in one memory mapped int32 array of token ids. The ids index `vocab.txt`,
+    which starts with the vocabulary of the source corpus.
+
+    Documents are stored as they are parsed when read completely. When reading only the first `n_tokens`, the
+    .txt corpus parses lines instead, which can differ for malformed files (e.g., with trailing blank lines).
+    """
+
+    def __init__(self, file_id_map=None, directory: str=ENCODED_DIR):
+        super().__init__(file_id_map)
+        self.directory = directory
+        self._vocab = None
+        self._doc_ix = None
+        self._arrays = None
+
+    def _load(self):
+        with open(join(self.directory, "docs.txt"), "r", encoding="utf-8") as f:
+            self._doc_ix = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self._arrays = {name: _load_array(join(self.directory, name + ".bin"), dtype)
+                        for name, dtype in ARRAYS.items()}
+
+    @property
+    def vocab(self) -> EvidenceVocab:
+        if self._vocab is None:
+            self._vocab = EvidenceVocab.load(join(self.directory, "vocab.txt"))
+        return self._vocab
+
+    def list_documents(self):
+        if self.file_id_map is not None:
+            return list(self.file_id_map.keys())
+        if self._doc_ix is None:
+            self._load()
+        return list(self._doc_ix)
+
+    def get_document_ids(self, doc_id) -> Optional[EncodedDocument]:
+        if self.file_id_map is None:
+            file_id = doc_id
+        else:
+            file_id = self.file_id_map.get(doc_id)
+        if file_id is None:
+            return None
+        if self._doc_ix is None:
+            self._load()
+        ix = self._doc_ix.get(file_id)
+        if ix is None:
+            return None
+
+        arrays = self._arrays
+        para_start, para_end = arrays["doc_offsets"][ix], arrays["doc_offsets"][ix + 1]
+        para_offsets = np.array(arrays["para_offsets"][para_start:para_end + 1])
+        sent_offsets = np.array(arrays["sent_offsets"][para_offsets[0]:para_offsets[-1] + 1])
+        ids = arrays["tokens"][sent_offsets[0]:sent_offsets[-1]]
+        return EncodedDocument(ids, sent_offsets - sent_offsets[0], para_offsets - para_offsets[0], self.vocab)
+
+    def get_document(self, doc_id, n_tokens=None, flat=False):
+        doc = self.get_document_ids(doc_id)
+        if doc is None:
+            return None
+        return doc.to_tokens(n_tokens, flat)
+
+    def __getstate__(self):
+        # Each process re-loads the memory maps and vocabulary
+        state = dict(self.__dict__)
+        state["_vocab"] = None
+        state["_doc_ix"] = None
+        state["_arrays"] = None
+        return state
+
+
+def encode_corpus(source: TriviaQaEvidenceCorpusTxt, output_dir: str):
+    """ Convert `source` to the int32 encoded format in `output_dir` """
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    source_fingerprint = corpus_fingerprint(source.directory)
+    voc_file = join(source.directory, "vocab.txt")
+    vocab = EvidenceVocab.load(voc_file) if exists(voc_file) else EvidenceVocab([])
+    word_ix = dict(vocab.word_ix)
+    words = list(vocab.words)
+
+    file_ids = sorted(source.list_documents())
+    out = {name: open(join(output_dir, name + ".bin"), "wb") for name in ARRAYS}
+    for name in ["sent_offsets", "para_offsets", "doc_offsets"]:
+        np.zeros(1, dtype=ARRAYS[name]).tofile(out[name])
+    n_tokens, n_sents, n_paras = 0, 0, 0
+    for file_id in tqdm(file_ids, ncols=80):
+        doc = source.get_document(file_id)
+        doc_ids = []
+        sent_offsets = []
+        para_offsets = []
+        for para in doc:
+            for sent in para:
+                for w in sent:
+                    ix = word_ix.get(w)
+                    if ix is None:
+                        ix = len(words)
+                        word_ix[w] = ix
+                        words.append(w)
+                    doc_ids.append(ix)
+                sent_offsets.append(n_tokens + len(doc_ids))
+            para_offsets.append(n_sents + len(sent_offsets))
+        n_tokens += len(doc_ids)
+        n_sents += len(sent_offsets)
+        n_paras += len(para_offsets)
+        np.array(doc_ids, dtype=ARRAYS["tokens"]).tofile(out["tokens"])
+        np.array(sent_offsets, dtype=ARRAYS["sent_offsets"]).tofile(out["sent_offsets"])
+        np.array(para_offsets, dtype=ARRAYS["para_offsets"]).tofile(out["para_offsets"])
+        np.array([n_paras], dtype=ARRAYS["doc_offsets"]).tofile(out["doc_offsets"])
+    for f in out.values():
+        f.close()
+
+    with open(join(output_dir, "docs.txt"), "w", encoding="utf-8") as f:
+        for file_id in file_ids:
+            f.write(file_id)
+            f.write("\n")
+    with open(join(output_dir, "vocab.txt"), "w", encoding="utf-8") as f:
+        for word in words:
+            f.write(word)
+            f.write("\n")
+    with open(join(output_dir, "index.json"), "w") as f:
+        json.dump(dict(n_docs=len(file_ids), n_tokens=n_tokens, source_vocab_size=len(vocab),
+                       vocab_size=len(words), source=source_fingerprint), f)
+
+
+def main():
+    parser = argparse.ArgumentParser("Encode the tokenized TriviaQA evidence corpus as token ids")
+    parser.add_argument("-o", "--output_dir", type=str, default=ENCODED_DIR)
+    args = parser.parse_args()
+    encode_corpus(TriviaQaEvidenceCorpusTxt(), args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import io
+import json
+import mmap
+import shutil
+from os import makedirs
+from os.path import join, exists
+from typing import Optional, Dict
+
+import numpy as np
+from tqdm import tqdm
+
+from docqa.config import CORPUS_DIR
+from docqa.triviaqa.evidence_corpus import TriviaQaEvidenceCorpusTxt, parse_document, parse_document_prefix, \
+    corpus_fingerprint, is_built_from
+from docqa.triviaqa.evidence_corpus_ids import TriviaQaEvidenceCorpusIds, ENCODED_DIR
+
+"""
+The tokenized evidence corpus packed into a few large shard files with an offset index, so
+documents can be read through `mmap` instead of opening hundreds of thousands of small files
+"""
+
+PACKED_DIR = join(CORPUS_DIR, "triviaqa", "evidence-packed")
+
+
+class TriviaQaEvidenceCorpusPacked(TriviaQaEvidenceCorpusTxt):
+    """
+    Drop in replacement for `TriviaQaEvidenceCorpusTxt` that reads from a corpus built by `pack_corpus`.
+    Document `i` is stored as the UTF-8 bytes `[doc_offset[i], doc_offset[i] + doc_length[i])` of shard
+    `doc_shard[i]`, in the same text format as the .txt files. For each document we also store the byte
+    offset where each of its paragraphs start and the number of tokens up to the end of each paragraph
+    (`para_bytes` and `para_tokens`, indexed through `para_offsets`), so that `get_document` only
+    has to read and parse the paragraphs needed to get `n_tokens` tokens.
+    """
+
+    def __init__(self, file_id_map=None, directory: str=PACKED_DIR):
+        super().__init__(file_id_map)
+        self.directory = directory
+        self._doc_ix = None
+        self._index = None
+        self._shards = {}
+
+    def _load(self):
+        with open(join(self.directory, "docs.txt"), "r", encoding="utf-8") as f:
+            self._doc_ix = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self._index = {name: np.load(join(self.directory, name + ".npy"), mmap_mode="r") for name in
+                       ["doc_shard", "doc_offset", "doc_length", "doc_tokens",
+                        "para_offsets", "para_bytes", "para_tokens"]}
+
+    def _get_shard(self, shard: int):
+        if shard not in self._shards:
+            with open(join(self.directory, "shard-%05d.bin" % shard), "rb") as f:
+                self._shards[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._shards[shard]
+
+    def list_documents(self):
+        if self.file_id_map is not None:
+            return list(self.file_id_map.keys())
+        if self._doc_ix is None:
+            self._load()
+        return list(self._doc_ix)
+
+    def get_document(self, doc_id, n_tokens=None, flat=False):
+        if self.file_id_map is None:
+            file_id = doc_id
+        else:
+            file_id = self.file_id_map.get(doc_id)
+        if file_id is None:
+            return None
+
+        if self._doc_ix is None:
+            self._load()
+        ix = self._doc_ix.get(file_id)
+        if ix is None:
+            return None
+
+        index = self._index
+        length = int(index["doc_length"][ix])
+        if n_tokens is not None and n_tokens < index["doc_tokens"][ix]:
+            lo, hi = index["para_offsets"][ix], index["para_offsets"][ix + 1]
+            # first paragraph that reaches `n_tokens`, we also read the following paragraph since the
+            # parser only stops once it sees the line after the last token it needs
+            end_para = lo + np.searchsorted(index["para_tokens"][lo:hi], n_tokens) + 2
+            if end_para < hi:
+                length = int(index["para_bytes"][end_para])
+
+        if length == 0:
+            text = ""
+        else:
+            start = int(index["doc_offset"][ix])
+            text = self._get_shard(int(index["doc_shard"][ix]))[start:start + length].decode("utf-8")
+        if n_tokens is None:
+            return parse_document(text, flat)
+        else:
+            return parse_document_prefix(io.StringIO(text), n_tokens, flat)
+
+    def __getstate__(self):
+        # Memory maps can't be pickled, each process will re-load the index
+        state = dict(self.__dict__)
+        state["_doc_ix"] = None
+        state["_index"] = None
+        state["_shards"] = {}
+        return state
+
+
+def get_evidence_corpus(file_id_map: Optional[Dict[str, str]]=None, encoded: bool=False):
+    """
+    The packed evidence corpus if it has been built, otherwise the .txt corpus. If `encoded` is set,
+    prefer the token id corpus, which only matches the others exactly when reading complete documents.
+    Stores built from an older version of the .txt corpus are not used.
+    """
+    source_dir = TriviaQaEvidenceCorpusTxt().directory
+    if encoded and _use_store(ENCODED_DIR, source_dir):
+        return TriviaQaEvidenceCorpusIds(file_id_map)
+    if _use_store(PACKED_DIR, source_dir):
+        return TriviaQaEvidenceCorpusPacked(file_id_map)
+    return TriviaQaEvidenceCorpusTxt(file_id_map)
+
+
+def _use_store(directory: str, source_dir: str) -> bool:
+    if not exists(join(directory, "docs.txt")):
+        return False
+    if not is_built_from(directory, source_dir):
+        print("WARNING: %s is out of date with %s, re-build it to use it" % (directory, source_dir))
+        return False
+    return True
+
+
+def _paragraph_bounds(text: str):
+    """ byte offset of the start of each paragraph and the number of tokens up to the end of each paragraph,
+    with tokens and paragraphs counted in the same way as `parse_document_prefix` """
+    para_bytes = []
+    para_tokens = []
+    on_byte = 0
+    cur_tokens = 0
+    prev_blank = True
+    for line in io.StringIO(text):
+        if line == "\n":
+            prev_blank = True
+        else:
+            if prev_blank:
+                para_bytes.append(on_byte)
+                para_tokens.append(cur_tokens)
+                prev_blank = False
+            cur_tokens += len(line.split(" "))
+            para_tokens[-1] = cur_tokens
+        on_byte += len(line.encode("utf-8"))
+    return para_bytes, para_tokens, cur_tokens
+
+
+def pack_corpus(source: TriviaQaEvidenceCorpusTxt, output_dir: str, shard_size: int=2**30):
+    """ Convert the .txt evidence corpus in `source.directory` to the packed format in `output_dir` """
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    source_fingerprint = corpus_fingerprint(source.directory)
+    file_ids = sorted(source.list_documents())
+    doc_shard = np.zeros(len(file_ids), dtype=np.int32)
+    doc_offset = np.zeros(len(file_ids), dtype=np.int64)
+    doc_length = np.zeros(len(file_ids), dtype=np.int64)
+    doc_tokens = np.zeros(len(file_ids), dtype=np.int64)
+    para_offsets = np.zeros(len(file_ids) + 1, dtype=np.int64)
+    para_bytes = []
+    para_tokens = []
+
+    shard = 0
+    out = open(join(output_dir, "shard-%05d.bin" % shard), "wb")
+    on_byte = 0
+    for i, file_id in enumerate(tqdm(file_ids, ncols=80)):
+        with open(join(source.directory, file_id + ".txt"), "r") as f:
+            text = f.read()
+        data = text.encode("utf-8")
+        if on_byte > 0 and on_byte + len(data) > shard_size:
+            out.close()
+            shard += 1
+            out = open(join(output_dir, "shard-%05d.bin" % shard), "wb")
+            on_byte = 0
+        out.write(data)
+        doc_shard[i] = shard
+        doc_offset[i] = on_byte
+        doc_length[i] = len(data)
+        on_byte += len(data)
+
+        bytes_, tokens, doc_tokens[i] = _paragraph_bounds(text)
+        para_bytes += bytes_
+        para_tokens += tokens
+        para_offsets[i + 1] = len(para_bytes)
+    out.close()
+
+    np.save(join(output_dir, "doc_shard.npy"), doc_shard)
+    np.save(join(output_dir, "doc_offset.npy"), doc_offset)
+    np.save(join(output_dir, "doc_length.npy"), doc_length)
+    np.save(join(output_dir, "doc_tokens.npy"), doc_tokens)
+    np.save(join(output_dir, "para_offsets.npy"), para_offsets)
+    np.save(join(output_dir, "para_bytes.npy"), np.array(para_bytes, dtype=np.int64))
+    np.save(join(output_dir, "para_tokens.npy"), np.array(para_tokens, dtype=np.int64))
+    with open(join(output_dir, "docs.txt"), "w", encoding="utf-8") as f:
+        for file_id in file_ids:
+            f.write(file_id)
+            f.write("\n")
+    with open(join(output_dir, "index.json"), "w") as f:
+        json.dump(dict(n_docs=len(file_ids), n_shards=shard + 1, source=source_fingerprint), f)
+
+    vocab = join(source.directory, "vocab.txt")
+    if exists(vocab):
+        shutil.copy(vocab, join(output_dir, "vocab.txt"))
+
+
+def main():
+    parser = argparse.ArgumentParser("Pack the tokenized TriviaQA evidence corpus into sharded files")
+    parser.add_argument("-o", "--output_dir", type=str, default=PACKED_DIR)
+    parser.add_argument("-s", "--shard_size", type=int, default=1024, help="Max shard size in MB")
+    args = parser.parse_args()
+    pack_corpus(TriviaQaEvidenceCorpusTxt(), args.output_dir, args.shard_size * 2**20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import json
+from collections import Counter
+from os import makedirs
+from os.path import join, exists
+from typing import List, Optional, Iterable, Dict
+
+import numpy as np
+from tqdm import tqdm
+
+from docqa import config
+from docqa.data_processing.document_splitter import ParagraphFilter, ExtractedParagraph, DocumentSplitter, \
+    MergeParagraphs
+from docqa.data_processing.text_utils import NltkPlusStopWords
+from docqa.triviaqa.evidence_corpus import TriviaQaEvidenceCorpusTxt
+
+"""
+Inverted index over the paragraphs of the tokenized evidence corpus, so paragraphs can be
+scored with BM25 at query time instead of re-fitting a tf-idf model to each question's candidates
+"""
+
+
+def normalize_term(word: str) -> str:
+    return word.lower()
+
+
+def _is_indexed(term: str, stop) -> bool:
+    return term not in stop and any(c.isalnum() for c in term)
+
+
+class EvidenceIndex(object):
+    """
+    Paragraph level inverted index stored as a collection of .npy files that are memory mapped
+    when loaded. The postings of term `t` are the paragraph ids `postings_paras[offsets[t]:offsets[t+1]]`
+    (sorted) and their term frequencies `postings_tfs[offsets[t]:offsets[t+1]]`. Paragraphs are
+    identified externally by their document and start token, as produced by the `DocumentSplitter`
+    used to build the index.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(join(directory, "index.json"), "r") as f:
+            self.info = json.load(f)
+        with open(join(directory, "terms.txt"), "r", encoding="utf-8") as f:
+            self.term_ix = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        with open(join(directory, "docs.txt"), "r", encoding="utf-8") as f:
+            self.doc_ix = {line.rstrip("\n"): i for i, line in enumerate(f)}
+
+        def load(name):
+            return np.load(join(directory, name + ".npy"), mmap_mode="r")
+
+        self.offsets = load("offsets")
+        self.postings_paras = load("postings_paras")
+        self.postings_tfs = load("postings_tfs")
+        self.doc_para_offsets = np.array(load("doc_para_offsets"))
+        self.para_starts = np.array(load("para_starts"))
+        self.para_ends = np.array(load("para_ends"))
+        self.para_lens = np.array(load("para_lens"))
+        self.n_paragraphs = len(self.para_lens)
+        self.avg_len = float(self.para_lens.mean()) if self.n_paragraphs > 0 else 0
+        self._max_tfs = {}  # term id -> (max tf, min paragraph length), for score upper bounds
+
+    @property
+    def n_terms(self):
+        return len(self.offsets) - 1
+
+    def df(self, term_id: int) -> int:
+        return int(self.offsets[term_id + 1] - self.offsets[term_id])
+
+    def idf(self, term_ids: np.ndarray) -> np.ndarray:
+        df = self.offsets[term_ids + 1] - self.offsets[term_ids]
+        return np.log(1 + (self.n_paragraphs - df + 0.5) / (df + 0.5))
+
+    def postings(self, term_id: int):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.postings_paras[start:end], self.postings_tfs[start:end]
+
+    def get_paragraph_ids(self, doc_ids: List[Optional[str]], starts: List[int], ends: List[int]) -> np.ndarray:
+        """ index of each paragraph, or -1 for paragraphs that were not indexed with the same bounds """
+        out = np.full(len(doc_ids), -1, dtype=np.int64)
+        for i, (doc_id, start, end) in enumerate(zip(doc_ids, starts, ends)):
+            doc = self.doc_ix.get(doc_id)
+            if doc is None:
+                continue
+            lo, hi = self.doc_para_offsets[doc], self.doc_para_offsets[doc + 1]
+            ix = lo + np.searchsorted(self.para_starts[lo:hi], start)
+            if ix < hi and self.para_starts[ix] == start and self.para_ends[ix] == end:
+                out[i] = ix
+        return out
+
+    def query_terms(self, question: List[str]) -> Dict[int, int]:
+        """ term id -> count for the indexed terms in `question` """
+        counts = Counter()
+        for word in question:
+            term = self.term_ix.get(normalize_term(word))
+            if term is not None:
+                counts[term] += 1
+        return counts
+
+    def term_upper_bound(self, term_id: int, k1: float, b: float) -> float:
+        """ Upper bound on the score any paragraph can get from one occurrence of `term_id` in a query """
+        if term_id not in self._max_tfs:
+            paras, tfs = self.postings(term_id)
+            if len(paras) == 0:
+                self._max_tfs[term_id] = (0, 1)
+            else:
+                self._max_tfs[term_id] = (int(tfs.max()), int(self.para_lens[paras].min()))
+        max_tf, min_len = self._max_tfs[term_id]
+        # BM25's tf component increases with tf and decreases with length, so this bounds it
+        norm = k1 * (1 - b + b * min_len / self.avg_len)
+        return float(self.idf(np.array([term_id]))[0] * max_tf * (k1 + 1) / (max_tf + norm))
+
+    def bm25(self, tfs: np.ndarray, lens: np.ndarray, idf: float, k1: float, b: float) -> np.ndarray:
+        tfs = tfs.astype(np.float64)
+        return idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lens / self.avg_len))
+
+    def search(self, question: List[str], k: int, k1: float=1.2, b: float=0.75,
+               candidates: Optional[np.ndarray]=None):
+        """
+        Top `k` paragraph ids and BM25 scores for `question`, optionally restricted to the sorted,
+        unique paragraph ids in `candidates`. Ties go to the lower paragraph id.
+        """
+        ids, scores = self.score_top(question, k, k1, b, candidates)
+        top = np.lexsort((ids, -scores))[:k]
+        return ids[top], scores[top]
+
+    def score_top(self, question: List[str], k: int, k1: float=1.2, b: float=0.75,
+                  candidates: Optional[np.ndarray]=None):
+        """
+        BM25 scores for a set of paragraphs that contains the top `k` for `question`, including any ties.
+        Uses max-score pruning: terms are visited from highest to lowest score upper bound, and once the
+        k-th best score exceeds the bound on what the remaining terms can add, only paragraphs that could
+        still reach the top k are scored against them. If `candidates` is given only those paragraphs
+        are considered, and any paragraphs that were not pruned are returned even if they have a zero score.
+        """
+        q_terms = self.query_terms(question)
+        terms = list(q_terms)
+        bounds = np.array([self.term_upper_bound(t, k1, b) * q_terms[t] for t in terms])
+        order = np.argsort(-bounds, kind="stable")
+        remaining = np.concatenate([np.cumsum(bounds[order][::-1])[::-1], [0]])
+
+        ids = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        if candidates is not None:
+            ids = np.asarray(candidates, dtype=np.int64)
+            scores = np.zeros(len(ids))
+        essential = candidates is None
+
+        for i, term_ix in enumerate(order):
+            term = terms[term_ix]
+            paras, tfs = self.postings(term)
+            idf = float(self.idf(np.array([term]))[0]) * q_terms[term]
+
+            if essential:
+                # Any paragraph containing this term could still make the top k, so merge its postings in
+                term_scores = self.bm25(tfs, self.para_lens[paras], idf, k1, b)
+                all_ids = np.concatenate([ids, np.asarray(paras, dtype=np.int64)])
+                all_scores = np.concatenate([scores, term_scores])
+                ids, inverse = np.unique(all_ids, return_inverse=True)
+                scores = np.bincount(inverse, all_scores, len(ids))
+            else:
+                # Only score the paragraphs we are already tracking
+                ix = np.searchsorted(paras, ids)
+                ix[ix == len(paras)] = 0
+                found = np.asarray(paras)[ix] == ids if len(paras) > 0 else np.zeros(len(ids), dtype=bool)
+                if np.any(found):
+                    scores[found] += self.bm25(np.asarray(tfs)[ix[found]], self.para_lens[ids[found]], idf, k1, b)
+
+            if len(ids) > k:
+                threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+                if essential and remaining[i + 1] < threshold:
+                    # Paragraphs that have not been seen yet can score at most `remaining[i + 1]`
+                    essential = False
+                if not essential:
+                    keep = scores + remaining[i + 1] >= threshold
+                    ids, scores = ids[keep], scores[keep]
+
+        return ids, scores
+
+
+class Bm25Ranker(ParagraphFilter):
+    """
+    Selects the paragraphs with the highest BM25 score, using an `EvidenceIndex` built with the same
+    `DocumentSplitter` so the candidates' statistics come from postings lists instead of re-reading
+    their text. Candidates missing from the index are scored from their text, with the index's
+    corpus statistics.
+    """
+
+    def __init__(self, index_dir: str, n_to_select: int, k1: float=1.2, b: float=0.75):
+        self.index_dir = index_dir
+        self.n_to_select = n_to_select
+        self.k1 = k1
+        self.b = b
+        self._index = None
+
+    @property
+    def index(self) -> EvidenceIndex:
+        if self._index is None:
+            self._index = EvidenceIndex(self.index_dir)
+        return self._index
+
+    def _get_paragraph_ids(self, paragraphs: List[ExtractedParagraph], doc_id):
+        return self.index.get_paragraph_ids([getattr(p, "doc_id", doc_id) for p in paragraphs],
+                                            [p.start for p in paragraphs], [p.end for p in paragraphs])
+
+    def _score_from_text(self, question, paragraphs: List[ExtractedParagraph]) -> np.ndarray:
+        index = self.index
+        q_terms = index.query_terms(question)
+        scores = np.zeros(len(paragraphs))
+        for i, para in enumerate(paragraphs):
+            counts = Counter(index.term_ix.get(normalize_term(w)) for s in para.text for w in s)
+            length = np.array([para.n_context_words])
+            for term, q_count in q_terms.items():
+                if counts[term] > 0:
+                    idf = float(index.idf(np.array([term]))[0]) * q_count
+                    scores[i] += index.bm25(np.array([counts[term]]), length, idf, self.k1, self.b)[0]
+        return scores
+
+    def _scores(self, question, paragraphs: List[ExtractedParagraph], doc_id, k: Optional[int]):
+        """
+        Returns the positions in `paragraphs` that were scored and their scores, if `k` is given
+        indexed paragraphs that score lower than the top `k` might be left out
+        """
+        para_ids = self._get_paragraph_ids(paragraphs, doc_id)
+        in_index = np.where(para_ids >= 0)[0]
+        missing = np.where(para_ids < 0)[0]
+
+        positions = [missing]
+        scores = [self._score_from_text(question, [paragraphs[i] for i in missing])]
+        if len(in_index) > 0:
+            candidates = np.unique(para_ids[in_index])
+            found, found_scores = self.index.score_top(question, len(candidates) if k is None else k,
+                                                       self.k1, self.b, candidates)
+            score_of = dict(zip(found.tolist(), found_scores.tolist()))
+            kept = np.array([i for i in in_index if para_ids[i] in score_of], dtype=np.int64)
+            positions.append(kept)
+            scores.append(np.array([score_of[para_ids[i]] for i in kept]))
+        return np.concatenate(positions), np.concatenate(scores)
+
+    def score_paragraphs(self, question, paragraphs: List[ExtractedParagraph], doc_id=None) -> np.ndarray:
+        positions, scores = self._scores(question, paragraphs, doc_id, None)
+        out = np.zeros(len(paragraphs))
+        out[positions] = scores
+        return out
+
+    def prune(self, question, paragraphs: List[ExtractedParagraph], doc_id=None):
+        if len(paragraphs) == 0:
+            return []
+        positions, scores = self._scores(question, paragraphs, doc_id, self.n_to_select)
+        sorted_ix = np.lexsort((positions, -scores))  # ties go to the earlier paragraph
+        return [paragraphs[positions[i]] for i in sorted_ix[:self.n_to_select]]
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_index"] = None
+        return state
+
+
+def build_index(corpus, splitter: DocumentSplitter, output_dir: str,
+                doc_ids: Optional[Iterable[str]]=None, stop=None):
+    """ Index the paragraphs `splitter` produces for each document in `corpus` """
+    if stop is None:
+        stop = NltkPlusStopWords(True).words
+    if not exists(output_dir):
+        makedirs(output_dir)
+    if doc_ids is None:
+        doc_ids = sorted(corpus.list_documents())
+
+    term_ix = {}
+    docs = []
+    doc_para_offsets = [0]
+    para_starts, para_ends, para_lens = [], [], []
+    term_chunks, para_chunks, tf_chunks = [], [], []
+    for doc_id in doc_ids:
+        text = corpus.get_document(doc_id, splitter.reads_first_n)
+        if text is None:
+            continue
+        docs.append(doc_id)
+        for para in splitter.split(text):
+            para_id = len(para_lens)
+            para_starts.append(para.start)
+            para_ends.append(para.end)
+            para_lens.append(para.n_context_words)
+            counts = Counter(normalize_term(w) for s in para.text for w in s)
+            terms = []
+            tfs = []
+            for term, count in counts.items():
+                if not _is_indexed(term, stop):
+                    continue
+                ix = term_ix.get(term)
+                if ix is None:
+                    ix = len(term_ix)
+                    term_ix[term] = ix
+                terms.append(ix)
+                tfs.append(count)
+            term_chunks.append(np.array(terms, dtype=np.int32))
+            tf_chunks.append(np.array(tfs, dtype=np.int32))
+            para_chunks.append(np.full(len(terms), para_id, dtype=np.int32))
+        doc_para_offsets.append(len(para_lens))
+
+    terms = np.concatenate(term_chunks) if len(term_chunks) > 0 else np.zeros(0, dtype=np.int32)
+    paras = np.concatenate(para_chunks) if len(para_chunks) > 0 else np.zeros(0, dtype=np.int32)
+    tfs = np.concatenate(tf_chunks) if len(tf_chunks) > 0 else np.zeros(0, dtype=np.int32)
+    # Stable, so the postings of each term stay sorted by paragraph id
+    order = np.argsort(terms, kind="stable")
+    offsets = np.zeros(len(term_ix) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=len(term_ix)), out=offsets[1:])
+
+    max_tf = tfs.max() if len(tfs) > 0 else 0
+    np.save(join(output_dir, "offsets.npy"), offsets)
+    np.save(join(output_dir, "postings_paras.npy"), paras[order])
+    np.save(join(output_dir, "postings_tfs.npy"), tfs[order].astype(np.uint16 if max_tf < 2**16 else np.int32))
+    np.save(join(output_dir, "doc_para_offsets.npy"), np.array(doc_para_offsets, dtype=np.int64))
+    np.save(join(output_dir, "para_starts.npy"), np.array(para_starts, dtype=np.int32))
+    np.save(join(output_dir, "para_ends.npy"), np.array(para_ends, dtype=np.int32))
+    np.save(join(output_dir, "para_lens.npy"), np.array(para_lens, dtype=np.int32))
+
+    terms_by_ix = sorted(term_ix, key=lambda x: term_ix[x])
+    with open(join(output_dir, "terms.txt"), "w", encoding="utf-8") as f:
+        for term in terms_by_ix:
+            f.write(term)
+            f.write("\n")
+    with open(join(output_dir, "docs.txt"), "w", encoding="utf-8") as f:
+        for doc_id in docs:
+            f.write(doc_id)
+            f.write("\n")
+    with open(join(output_dir, "index.json"), "w") as f:
+        json.dump(dict(splitter=str(splitter.get_config()), n_docs=len(docs),
+                       n_paragraphs=len(para_lens), n_terms=len(term_ix)), f)
+
+
+def main():
+    parser = argparse.ArgumentParser("Build a BM25 paragraph index of the tokenized TriviaQA evidence corpus")
+    parser.add_argument("-o", "--output_dir", type=str,
+                        default=join(config.CORPUS_DIR, "triviaqa", "evidence-index"))
+    parser.add_argument("-t", "--tokens", type=int, default=400,
+                        help="Max tokens per a paragraph, should match what the index will be used with")
+    args = parser.parse_args()
+
+    corpus = TriviaQaEvidenceCorpusTxt()
+    doc_ids = sorted(corpus.list_documents())
+    build_index(corpus, MergeParagraphs(args.tokens), args.output_dir, tqdm(doc_ids, ncols=80))
+
+
+if __name__ == "__main__":
+    main()
@@ -205,16 +205,7 @@ class TriviaQaQuestion(object):
     @staticmethod
     def from_compressed_json(text):
         question, quid, answer, entity_docs, web_docs = json.loads(text)
-        if answer[0] == "WikipediaEntity":
-            answer = WikipediaEntity(*answer[1:])
-        elif answer[0] == "Numerical":
-            answer = Numerical(*answer[1:])
-        elif answer[0] == "FreeForm":
-            answer = FreeForm(*answer[1:])
-        elif answer[0] == "Range":
-            answer = Range(*answer[1:])
-        else:
-            raise ValueError()
+        answer = answer_from_compressed_json(answer)
         for i, doc in enumerate(entity_docs):
             if doc[0] == "TagMeEntityDoc":
                 entity_docs[i] = TagMeEntityDoc(*doc[1:])
@@ -224,6 +215,20 @@ class TriviaQaQuestion(object):
         return TriviaQaQuestion(question, quid, answer, entity_docs, web_docs)
 
 
+def answer_from_compressed_json(answer):
+    """ Inverse of the `[class name] + slot values` list used to store answers as json """
+    if answer[0] == "WikipediaEntity":
+        return WikipediaEntity(*answer[1:])
+    elif answer[0] == "Numerical":
+        return Numerical(*answer[1:])
+    elif answer[0] == "FreeForm":
+        return FreeForm(*answer[1:])
+    elif answer[0] == "Range":
+        return Range(*answer[1:])
+    else:
+        raise ValueError()
+
+
 def iter_question_json(filename):
     """ Iterates over trivia-qa questions in a JSON file, useful if the file is too large to be
     parse all at once """
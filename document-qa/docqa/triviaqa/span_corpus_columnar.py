@@ -0,0 +1,153 @@
+import argparse
+import pickle
+from os.path import join, exists
+from typing import List, Optional
+
+import numpy as np
+
+from docqa.config import CORPUS_DIR
+from docqa.data_processing.columnar import ColumnarReader, ColumnarWriter, lazy_field
+from docqa.triviaqa.read_data import TriviaQaQuestion, TagMeEntityDoc, SearchEntityDoc, SearchDoc, \
+    answer_from_compressed_json
+
+"""
+Columnar storage for the question files of a `TriviaQaSpanCorpus`, so they can be loaded without
+unpickling every question, document and answer span up front
+"""
+
+SPLITS = ["train", "dev", "test", "verified"]
+
+# Constructor arguments for each document type, `trivia_qa_selected` and `answer_spans` are stored separately
+_DOC_FIELDS = {
+    "TagMeEntityDoc": (TagMeEntityDoc, ["rho", "link_probability", "title"]),
+    "SearchEntityDoc": (SearchEntityDoc, ["title"]),
+    "SearchDoc": (SearchDoc, ["title", "description", "rank", "url"]),
+}
+
+
+def columnar_dir(corpus_dir: str, split: str):
+    return join(corpus_dir, split + "_columnar")
+
+
+def _doc_to_json(doc):
+    return [doc.__class__.__name__] + [getattr(doc, x) for x in _DOC_FIELDS[doc.__class__.__name__][1]] + \
+           [doc.trivia_qa_selected]
+
+
+def _doc_from_json(doc):
+    doc_cls = _DOC_FIELDS[doc[0]][0]
+    out = doc_cls(*doc[1:-1])
+    out.trivia_qa_selected = doc[-1]
+    return out
+
+
+def _question_meta(q: TriviaQaQuestion):
+    meta = dict(
+        answer=None if q.answer is None else
+        [q.answer.__class__.__name__] + [getattr(q.answer, x) for x in q.answer.__slots__],
+        entity_docs=[_doc_to_json(x) for x in q.entity_docs],
+        web_docs=None if q.web_docs is None else [_doc_to_json(x) for x in q.web_docs]
+    )
+    if isinstance(q.question, str):
+        meta["question"] = q.question  # Not tokenized
+    return meta
+
+
+def write_questions(questions: List[TriviaQaQuestion], directory: str, source: Optional[str]=None):
+    writer = ColumnarWriter(directory)
+    writer.add_strings("question_id", [q.question_id for q in questions])
+    writer.add_tokens("question", [[] if isinstance(q.question, str) else q.question for q in questions])
+    writer.add_json("meta", [_question_meta(q) for q in questions])
+
+    # `all_docs` order, so web docs first
+    all_docs = [q.all_docs for q in questions]
+    writer.add_offsets("doc_offsets", [len(x) for x in all_docs])
+    docs = [doc for x in all_docs for doc in x]
+    writer.add_array("has_answer_spans", np.array([x.answer_spans is not None for x in docs], dtype=np.bool_))
+    writer.add_ragged("answer_spans", [np.zeros((0, 2)) if x.answer_spans is None else x.answer_spans for x in docs],
+                      np.int32, (2,))
+    writer.finish(dict(n_questions=len(questions), n_docs=len(docs)), source)
+
+
+def _load_meta(q):
+    return q._reader.json("meta", q._ix)
+
+
+def _load_question(q):
+    meta = q._meta
+    if "question" in meta:
+        return meta["question"]
+    return q._reader.tokens("question", q._ix)
+
+
+def _load_answer(q):
+    answer = q._meta["answer"]
+    return None if answer is None else answer_from_compressed_json(answer)
+
+
+def _load_docs(q):
+    reader = q._reader
+    meta = q._meta
+    web_docs = None if meta["web_docs"] is None else [_doc_from_json(x) for x in meta["web_docs"]]
+    entity_docs = [_doc_from_json(x) for x in meta["entity_docs"]]
+    doc_offsets = reader.array("doc_offsets")
+    has_spans = reader.array("has_answer_spans")
+    for doc_ix, doc in zip(range(doc_offsets[q._ix], doc_offsets[q._ix + 1]),
+                           (web_docs if web_docs is not None else []) + entity_docs):
+        if has_spans[doc_ix]:
+            doc.answer_spans = np.array(reader.ragged("answer_spans", doc_ix))
+    return entity_docs, web_docs
+
+
+class LazyTriviaQaQuestion(TriviaQaQuestion):
+    """
+    `TriviaQaQuestion` that reads its fields from a `ColumnarReader` when they are first used, pickles
+    as a regular `TriviaQaQuestion`
+    """
+    __slots__ = ["_reader", "_ix", "_loaded"]
+
+    def __init__(self, reader: ColumnarReader, ix: int):
+        self._reader = reader
+        self._ix = ix
+        self._loaded = {}
+
+    _meta = lazy_field("_meta", _load_meta)
+    question_id = lazy_field("question_id", lambda q: q._reader.strings("question_id")[q._ix])
+    question = lazy_field("question", _load_question)
+    answer = lazy_field("answer", _load_answer)
+    _docs = lazy_field("_docs", _load_docs)
+    entity_docs = lazy_field("entity_docs", lambda q: q._docs[0])
+    web_docs = lazy_field("web_docs", lambda q: q._docs[1])
+
+    def __reduce__(self):
+        return TriviaQaQuestion, (self.question, self.question_id, self.answer, self.entity_docs, self.web_docs)
+
+
+def load_questions(directory: str) -> List[TriviaQaQuestion]:
+    """ Lazy questions from a directory built by `write_questions`, only the index is read up front """
+    reader = ColumnarReader(directory)
+    return [LazyTriviaQaQuestion(reader, i) for i in range(reader.index["n_questions"])]
+
+
+def convert_corpus(corpus_dir: str):
+    """ Write a columnar version of each question pickle in `corpus_dir` """
+    for split in SPLITS:
+        source = join(corpus_dir, split + ".pkl")
+        if not exists(source):
+            continue
+        print("Converting %s" % source)
+        with open(source, "rb") as f:
+            questions = pickle.load(f)
+        write_questions(questions, columnar_dir(corpus_dir, split), source)
+
+
+def main():
+    parser = argparse.ArgumentParser("Convert the pickled question files of a TriviaQA span corpus "
+                                     "to the columnar format")
+    parser.add_argument("corpus", choices=["web", "wiki", "web-open", "web-sample"])
+    args = parser.parse_args()
+    convert_corpus(join(CORPUS_DIR, "triviaqa", args.corpus))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import sys
-from typing import List, Optional
+from collections import OrderedDict
+from typing import List, Optional, Dict, Tuple, Callable
 
 import numpy as np
 
 from docqa.data_processing.document_splitter import DocumentSplitter, ParagraphFilter, \
-    DocParagraphWithAnswers
+    DocParagraphWithAnswers, ExtractedParagraphWithAnswers
 from docqa.data_processing.multi_paragraph_qa import DocumentParagraph, MultiParagraphQuestion
 from docqa.data_processing.preprocessed_corpus import Preprocessor, FilteredData
 from docqa.data_processing.qa_training_data import ParagraphAndQuestion, Answer
@@ -19,6 +20,44 @@ into (question, paragraph) data we can train our model on.
 """
 
 
+def prune_by_document(questions: List[TriviaQaQuestion], evidence, splitter: DocumentSplitter,
+                      para_filter: Optional[ParagraphFilter],
+                      skip_doc: Optional[Callable[[object], bool]]=None
+                      ) -> Dict[Tuple[int, int], List[ExtractedParagraphWithAnswers]]:
+    """
+    Load and split each document once and rank its paragraphs for all the questions that use it in
+    a single call to `para_filter.prune_batch`. Returns the pruned, annotated paragraphs for each
+    (question index, document index) pair that was not skipped. This relies on `para_filter`
+    selecting from the paragraphs it is given without looking at their answer spans. Selected paragraphs
+    are matched to the annotated ones by their token range, so filters can return copies.
+    """
+    by_doc = OrderedDict()
+    for q_ix, q in enumerate(questions):
+        for d_ix, doc in enumerate(q.all_docs):
+            if skip_doc is None or not skip_doc(doc):
+                by_doc.setdefault(doc.doc_id, []).append((q_ix, d_ix))
+
+    output = {}
+    for doc_id, pairs in by_doc.items():
+        text = evidence.get_document(doc_id, splitter.reads_first_n)
+        if text is None:
+            raise ValueError("No evidence text found document: " + doc_id)
+        paragraphs = splitter.split(text)
+        if para_filter is not None:
+            selected = para_filter.prune_batch([questions[q_ix].question for q_ix, _ in pairs], paragraphs, doc_id)
+        else:
+            selected = [paragraphs] * len(pairs)
+
+        para_ix = {(p.start, p.end): i for i, p in enumerate(paragraphs)}
+        for (q_ix, d_ix), q_paragraphs in zip(pairs, selected):
+            spans = questions[q_ix].all_docs[d_ix].answer_spans
+            if spans is None:
+                spans = np.zeros((0, 2), dtype=np.int32)
+            annotated = splitter.annotate(paragraphs, spans)
+            output[(q_ix, d_ix)] = [annotated[para_ix[(p.start, p.end)]] for p in q_paragraphs]
+    return output
+
+
 class DocumentParagraphQuestion(ParagraphAndQuestion):
     def __init__(self, q_id: str, doc_id: str, para_range, question: List[str],
                  context: List[str], answer: Answer, rank=None):
@@ -36,27 +75,41 @@ class ExtractSingleParagraph(Preprocessor):
                  para_filter: Optional[ParagraphFilter],
                  text_preprocess: Optional[TextPreprocessor],
                  intern,
-                 require_answer=True):
+                 require_answer=True,
+                 group_by_doc: bool=False):
+        """
+        :param group_by_doc: Load, split and rank each document once for all the questions in a
+                             chunk that use it, rather than once per (question, document) pair
+        """
         self.splitter = splitter
         self.para_filter = para_filter
         self.text_preprocess = text_preprocess
         self.intern = intern
         self.require_answer = require_answer
+        self.group_by_doc = group_by_doc
 
     def preprocess(self, questions: List[TriviaQaQuestion], evidence) -> FilteredData:
         splitter = self.splitter
         paragraph_filter = self.para_filter
         output = []
         read_only = splitter.reads_first_n
-        for q in questions:
-            for doc in q.all_docs:
-                text = evidence.get_document(doc.doc_id, n_tokens=read_only)
-                if text is None:
-                    raise ValueError(doc.doc_id, doc.doc_id)
+        if self.group_by_doc:
+            questions = list(questions)
+            pruned = prune_by_document(questions, evidence, splitter, paragraph_filter)
+        else:
+            pruned = None
+        for q_ix, q in enumerate(questions):
+            for d_ix, doc in enumerate(q.all_docs):
+                if pruned is not None:
+                    paragraphs = pruned[(q_ix, d_ix)]
+                else:
+                    text = evidence.get_document(doc.doc_id, n_tokens=read_only)
+                    if text is None:
+                        raise ValueError(doc.doc_id, doc.doc_id)
 
-                paragraphs = splitter.split_annotated(text, doc.answer_spans)
-                if paragraph_filter is not None:
-                    paragraphs = paragraph_filter.prune(q.question, paragraphs)
+                    paragraphs = splitter.split_annotated(text, doc.answer_spans)
+                    if paragraph_filter is not None:
+                        paragraphs = paragraph_filter.prune(q.question, paragraphs, doc.doc_id)
                 if self.require_answer:
                     paragraphs = [x for x in paragraphs if len(x.answer_spans) > 0]
                 if len(paragraphs) == 0:
@@ -91,6 +144,9 @@ class ExtractSingleParagraph(Preprocessor):
         if "state" in state:
             if "require_answer" not in state["state"]:
                 state["state"]["require_answer"] = True
+        fields = state["state"] if "state" in state else state
+        if "group_by_doc" not in fields:
+            fields["group_by_doc"] = False
         super().__setstate__(state)
 
 
@@ -108,36 +164,52 @@ class ExtractMultiParagraphs(Preprocessor):
     """
 
     def __init__(self, splitter: DocumentSplitter, ranker: Optional[ParagraphFilter],
-                 text_process: Optional[TextPreprocessor], intern: bool=False, require_an_answer=True):
+                 text_process: Optional[TextPreprocessor], intern: bool=False, require_an_answer=True,
+                 group_by_doc: bool=False):
+        """
+        :param group_by_doc: Load, split and rank each document once for all the questions in a
+                             chunk that use it, rather than once per (question, document) pair
+        """
         self.intern = intern
         self.splitter = splitter
         self.ranker = ranker
         self.text_process = text_process
         self.require_an_answer = require_an_answer
+        self.group_by_doc = group_by_doc
 
     def preprocess(self, questions: List[TriviaQaQuestion], evidence):
         true_len = 0
         splitter = self.splitter
         para_filter = self.ranker
 
+        if self.group_by_doc:
+            questions = list(questions)
+            skip_doc = (lambda doc: len(doc.answer_spans) == 0) if self.require_an_answer else None
+            pruned = prune_by_document(questions, evidence, splitter, para_filter, skip_doc)
+        else:
+            pruned = None
+
         with_paragraphs = []
-        for q in questions:
+        for q_ix, q in enumerate(questions):
             true_len += len(q.all_docs)
-            for doc in q.all_docs:
+            for d_ix, doc in enumerate(q.all_docs):
                 if self.require_an_answer and len(doc.answer_spans) == 0:
                     continue
-                text = evidence.get_document(doc.doc_id, splitter.reads_first_n)
-                if text is None:
-                    raise ValueError("No evidence text found document: " + doc.doc_id)
-                if doc.answer_spans is not None:
-                    paras = splitter.split_annotated(text, doc.answer_spans)
+                if pruned is not None:
+                    paras = pruned[(q_ix, d_ix)]
                 else:
-                    # this is kind of a hack to make the rest of the pipeline work, only
-                    # needed for test cases
-                    paras = splitter.split_annotated(text, np.zeros((0, 2), dtype=np.int32))
-
-                if para_filter is not None:
-                    paras = para_filter.prune(q.question, paras)
+                    text = evidence.get_document(doc.doc_id, splitter.reads_first_n)
+                    if text is None:
+                        raise ValueError("No evidence text found document: " + doc.doc_id)
+                    if doc.answer_spans is not None:
+                        paras = splitter.split_annotated(text, doc.answer_spans)
+                    else:
+                        # this is kind of a hack to make the rest of the pipeline work, only
+                        # needed for test cases
+                        paras = splitter.split_annotated(text, np.zeros((0, 2), dtype=np.int32))
+
+                    if para_filter is not None:
+                        paras = para_filter.prune(q.question, paras, doc.doc_id)
 
                 if len(paras) == 0:
                     continue
@@ -168,6 +240,12 @@ class ExtractMultiParagraphs(Preprocessor):
         if self.intern:
             intern_mutli_question(q.data)
 
+    def __setstate__(self, state):
+        fields = state["state"] if "state" in state else state
+        if "group_by_doc" not in fields:
+            fields["group_by_doc"] = False
+        super().__setstate__(state)
+
 
 class ExtractMultiParagraphsPerQuestion(Preprocessor):
     """
@@ -1,9 +1,10 @@
 import argparse
+from collections import OrderedDict
 from datetime import datetime
 from os.path import join
-from typing import List, TypeVar, Iterable
+from typing import List, TypeVar, Iterable, Optional
 
-from docqa.data_processing.word_vectors import load_word_vectors
+from docqa.data_processing.word_vectors import load_word_vectors, has_binary_word_vectors
 
 
 class ResourceLoader(object):
@@ -27,16 +28,125 @@ class LoadFromPath(object):
         return load_word_vectors(join(self.path, vec_name), voc, True)
 
 
+class _CachedVectors(object):
+    def __init__(self, partial: bool):
+        # lower-cased word -> {word: vector} for each capitalization of that word we have a
+        # vector for, which is empty if we looked the word up and found nothing. Ordered from
+        # least to most recently requested
+        self.groups = OrderedDict()
+        self.complete = False  # Have we loaded every word in the vector set
+        self.partial = partial  # Can we load a subset of the words without reading the entire vector set
+        self.n_bytes = 0
+
+
 class CachingResourceLoader(ResourceLoader):
+    """
+    Caches the word vectors it has loaded for each vector set, on later calls only words not already
+    in the cache are loaded. If `max_bytes` is set, the least recently requested words are evicted
+    (across all vector sets) to keep the cached vectors under that size.
 
-    def __init__(self, load_vec_fn=load_word_vectors):
+    Loading a handful of missing words is only cheap if `can_load_partial(vec_name)` is true, as it is
+    for the binary vector format. Other vector sets would be re-scanned on every miss, so they are
+    loaded in full the first time they are used and are never evicted.
+    """
+
+    def __init__(self, load_vec_fn=load_word_vectors, max_bytes: Optional[int]=None,
+                 can_load_partial=has_binary_word_vectors):
         super().__init__(load_vec_fn)
-        self.word_vec = {}
+        self.max_bytes = max_bytes
+        self.can_load_partial = can_load_partial
+        self.word_vec = OrderedDict()  # vec_name -> _CachedVectors, least recently used first
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_loads = 0
+        self.n_evicted = 0
 
     def load_word_vec(self, vec_name, voc=None):
-        if vec_name not in self.word_vec:
-            self.word_vec[vec_name] = super().load_word_vec(vec_name)
-        return self.word_vec[vec_name]
+        cached = self.word_vec.get(vec_name)
+        if cached is None:
+            cached = _CachedVectors(self.can_load_partial(vec_name))
+            self.word_vec[vec_name] = cached
+        self.word_vec.move_to_end(vec_name)
+
+        if voc is None or not cached.partial:
+            if not cached.complete:
+                self._add(cached, super().load_word_vec(vec_name), None)
+                cached.complete = True
+        if voc is None:
+            keys = list(cached.groups.keys())
+        else:
+            keys = {x.lower() for x in voc}
+            if cached.complete:
+                missing = []
+            else:
+                missing = [x for x in keys if x not in cached.groups]
+            self.n_misses += len(missing)
+            self.n_hits += len(keys) - len(missing)
+            if len(missing) > 0:
+                self._add(cached, super().load_word_vec(vec_name, missing), missing)
+            for key in keys:
+                if key in cached.groups:
+                    cached.groups.move_to_end(key)
+
+        out = {}
+        for key in keys:
+            group = cached.groups.get(key)
+            if group is not None:
+                out.update(group)
+        self._evict(vec_name, keys)
+        return out
+
+    def _add(self, cached: _CachedVectors, word_to_vec, queried):
+        self.n_loads += 1
+        groups = cached.groups
+        if queried is not None:
+            for key in queried:
+                if key not in groups:
+                    groups[key] = {}
+        for word, vec in word_to_vec.items():
+            key = word.lower()
+            group = groups.get(key)
+            if group is None:
+                group = {}
+                groups[key] = group
+            if word not in group:
+                cached.n_bytes += vec.nbytes
+            group[word] = vec
+
+    def _evict(self, vec_name, protected):
+        if self.max_bytes is None:
+            return
+        protected = set(protected)
+        for name, cached in list(self.word_vec.items()):
+            if self.resident_bytes() <= self.max_bytes:
+                return
+            if not cached.partial:
+                continue  # Re-loading evicted words would mean reading the entire vector set again
+            groups = cached.groups
+            for key in list(groups.keys()):
+                if self.resident_bytes() <= self.max_bytes:
+                    break
+                if name == vec_name and key in protected:
+                    continue  # Don't evict words we are returning
+                group = groups.pop(key)
+                cached.n_bytes -= sum(x.nbytes for x in group.values())
+                cached.complete = False
+                self.n_evicted += 1
+            if len(groups) == 0:
+                del self.word_vec[name]
+
+    def resident_bytes(self):
+        return sum(x.n_bytes for x in self.word_vec.values())
+
+    def get_stats(self):
+        lookups = self.n_hits + self.n_misses
+        return dict(
+            hits=self.n_hits, misses=self.n_misses,
+            hit_rate=(self.n_hits / lookups) if lookups > 0 else None,
+            loads=self.n_loads, evicted=self.n_evicted,
+            resident_bytes=self.resident_bytes(),
+            resident_words={name: sum(len(g) for g in x.groups.values()) for name, x in self.word_vec.items()}
+        )
 
 
 def print_table(table: List[List[str]]):